@@ -3,10 +3,8 @@ from configparser import ConfigParser, ExtendedInterpolation
 import multiprocessing as mp
 import time
 
-import numpy as np
-import pandas as pd
-
 from sdss import download
+from sdss.metastore import load_meta_data
 
 ###############################################################################
 # spawn creates entirely new processes independent from the parent process
@@ -28,7 +26,9 @@ if __name__ == "__main__":
     meta_data_directory = parser.get("directories", "meta_data")
     spectra_df_name = parser.get("files", "spectra_df")
 
-    spectra_df = pd.read_csv(f"{meta_data_directory}/{spectra_df_name}")
+    spectra_df = load_meta_data(
+        f"{meta_data_directory}/{spectra_df_name}"
+    ).reset_index()
 
     number_spectra = parser.getint("parameters", "number_spectra")
 
@@ -38,13 +38,43 @@ if __name__ == "__main__":
     # Data Download
     output_directory = parser.get("directories", "output")
     number_processes = parser.getint("parameters", "number_processes")
+    engine = parser.get("parameters", "engine", fallback="pool")
+    concurrency = parser.getint("parameters", "concurrency", fallback=32)
+    manifest = parser.get("files", "manifest", fallback="") or None
+    max_attempts = parser.getint("parameters", "max_attempts", fallback=10)
+    requests_per_second = parser.get(
+        "parameters", "requests_per_second", fallback=""
+    )
+    requests_per_second = (
+        float(requests_per_second) if requests_per_second else None
+    )
+    raw_data_directory = (
+        parser.get("directories", "raw_data", fallback="") or None
+    )
+    disk_budget = parser.get("parameters", "disk_budget", fallback="")
+    disk_budget = int(disk_budget) if disk_budget else None
+    sources = parser.get("directories", "sources", fallback="").split()
+    sources = sources if len(sources) > 0 else None
+    ingestion = parser.get("parameters", "ingestion", fallback="fiber")
 
     download_spectra = download.DownloadData(
         spectra_df=spectra_df,
         output_directory=output_directory,
         n_processes=number_processes,
+        engine=engine,
+        concurrency=concurrency,
+        manifest=manifest,
+        max_attempts=max_attempts,
+        requests_per_second=requests_per_second,
+        raw_data_directory=raw_data_directory,
+        disk_budget=disk_budget,
+        sources=sources,
+        ingestion=ingestion,
     )
 
+    if parser.getboolean("parameters", "reconcile", fallback=False):
+        download_spectra.reconcile_manifest()
+
     download_spectra.download_files()
     ###########################################################################
     tf = time.time()
@@ -5,6 +5,7 @@ import time
 import numpy as np
 import pandas as pd
 
+from sdss.metastore import load_meta_data
 from sdss.process import inputting
 from sdss.utils.configfile import ConfigurationFile
 
@@ -19,9 +20,7 @@ parser.read(f"{name_config_file}")
 data_directory = parser.get("directory", "data")
 
 spectra_df_name = parser.get("files", "spectra_df")
-spectra_df = pd.read_csv(
-    f"{data_directory}/{spectra_df_name}", index_col="specobjid"
-)
+spectra_df = load_meta_data(f"{data_directory}/{spectra_df_name}")
 
 # Load interpolated spectra
 spectra_file_name = parser.get("files", "spectra")
@@ -5,13 +5,25 @@ from multiprocessing.sharedctypes import RawArray
 import time
 
 import numpy as np
-import pandas as pd
 
+from sdss.metastore import load_meta_data
 from sdss.process import interpolate
+from sdss.specobjindex import SpecObjIndex
 from sdss.utils.configfile import ConfigurationFile
 from sdss.utils.parallel import to_numpy_array
 
 
+###############################################################################
+def get_dust_parameters(parser: ConfigParser) -> dict:
+    """dust_law and r_v of Interpolate from the extinction section"""
+
+    return {
+        "dust_law": parser.get("extinction", "dust_law"),
+        "r_v": parser.getfloat("extinction", "r_v"),
+    }
+
+
+###############################################################################
 if __name__ == "__main__":
 
     mp.set_start_method("spawn")
@@ -28,8 +40,9 @@ if __name__ == "__main__":
     meta_data_directory = parser.get("directory", "meta_data")
 
     spectra_df_name = parser.get("files", "spectra_df")
-    spectra_df = pd.read_csv(
-        f"{meta_data_directory}/{spectra_df_name}", index_col="specobjid"
+    spectra_df = load_meta_data(
+        f"{meta_data_directory}/{spectra_df_name}",
+        columns=["z", "ebv"],
     )
     # set number of rows from data frame
     number_spectra = parser.getint("parameters", "number_spectra")
@@ -47,6 +60,13 @@ if __name__ == "__main__":
     grid_parameters = config_file.section_to_dictionary(
         grid_parameters, value_separators=[" "]
     )
+    # dust law to dered spectra, see sdss.process.extinction
+    dust_parameters = get_dust_parameters(parser)
+    # windows in observer frame to fill, see sdss.process.skylines
+    sky_lines = {
+        name: config_file.entry_to_list(window, float, ",")
+        for name, window in parser.items("sky_lines")
+    }
     # counter to track spectra and link it with specobjid in
     # track_indexes array
     counter = mp.Value("i", 0)
@@ -75,10 +95,12 @@ if __name__ == "__main__":
         initializer=interpolate.shared_data,
         initargs=(
             counter,
-            spectra_df,
+            SpecObjIndex.from_data_frame(spectra_df, ["z", "ebv"]).to_shared(),
             grid_parameters,
             raw_data_directory,
             shared_arrays_parameters,
+            dust_parameters,
+            sky_lines,
         ),
     ) as pool:
         # INTERPOLATE
@@ -91,7 +113,22 @@ if __name__ == "__main__":
         # De-redshift spectrum
         # interpolate in common grid
 
-        pool.map(interpolate.worker_interpolation, spectra_df.index)
+        block_size = parser.getint("parameters", "block_size")
+
+        if block_size > 0:
+
+            specobjids = spectra_df.index.to_numpy()
+
+            blocks = [
+                specobjids[start : start + block_size]
+                for start in range(0, number_spectra, block_size)
+            ]
+
+            pool.map(interpolate.worker_interpolation_block, blocks)
+
+        else:
+
+            pool.map(interpolate.worker_interpolation, spectra_df.index)
 
     output_directory = parser.get("directory", "output")
 
@@ -1,16 +1,13 @@
 #! /usr/bin/env python3
 from configparser import ConfigParser, ExtendedInterpolation
-import multiprocessing as mp
+import os
 import time
 
-import numpy as np
-import pandas as pd
-
-from sdss.raw.data import RawData
+from sdss.metastore import load_meta_data
+from sdss.raw.prune import Pruner
 
 ###############################################################################
 if __name__ == "__main__":
-    mp.set_start_method("spawn")
 
     ti = time.time()
     ###########################################################################
@@ -20,31 +17,40 @@ if __name__ == "__main__":
     ###########################################################################
     keep_df_name = parser.get("files", "keep_df")
 
-    keep_df = pd.read_csv(
-        f"{meta_data_directory}/{keep_df_name}", index_col="specobjid"
+    # the keep set needs the sas path of each spectrum
+    keep_df = load_meta_data(
+        f"{meta_data_directory}/{keep_df_name}",
+        columns=["plate", "mjd", "fiberid", "run2d"],
     )
-
     ##############################################################
-    remove_df_name = parser.get("files", "remove_df")
-    remove_df = pd.read_csv(
-        f"{meta_data_directory}/{remove_df_name}", index_col="specobjid"
+    report_directory = parser.get("directories", "report")
+    os.makedirs(report_directory, exist_ok=True)
+
+    pruner = Pruner(
+        number_threads=parser.getint("parameters", "number_threads"),
+        batch_size=parser.getint("parameters", "batch_size"),
+        dry_run=parser.getboolean("parameters", "dry_run"),
     )
-    ##############################################################
-    is_in_keep_mask = remove_df.index.isin(keep_df.index)
-    remove_mask = ~is_in_keep_mask
 
-    files_remove_df = remove_df.loc[remove_mask]
-    ##############################################################
-    data_directory = parser.get("directories", "data")
-    number_processes = parser.getint("parameters", "number_processes")
+    if parser.getboolean("parameters", "prune_fits"):
 
-    raw = RawData(
-        data_directory=data_directory,
-        output_directory=data_directory,
-        number_processes=number_processes,
-    )
+        data_directory = parser.get("directories", "data")
+
+        pruner.prune_fits(
+            data_directory,
+            keep_df,
+            report_to=f"{report_directory}/fits.csv",
+        )
+
+    if parser.getboolean("parameters", "prune_npy"):
+
+        raw_spectra_directory = parser.get("directories", "raw_spectra")
 
-    raw.remove_fits_files(files_remove_df)
+        pruner.prune_npy(
+            raw_spectra_directory,
+            keep_df.index.to_numpy(),
+            report_to=f"{report_directory}/npy.csv",
+        )
     ###########################################################################
     tf = time.time()
 
@@ -1,18 +1,14 @@
 """Spectra processing"""
 from configparser import ConfigParser, ExtendedInterpolation
-import multiprocessing as mp
-from multiprocessing.sharedctypes import Array, RawArray
 import time
 
-import pandas as pd
-
+from sdss.metastore import MetaDataStore, load_meta_data
 from sdss.process import deredspectra
+from sdss.process.ebvcache import EBVCache
 
 ###############################################################################
 if __name__ == "__main__":
 
-    mp.set_start_method("spawn")
-
     start_time = time.time()
 
     parser = ConfigParser(interpolation=ExtendedInterpolation())
@@ -23,40 +19,55 @@ if __name__ == "__main__":
     meta_data_directory = parser.get("directories", "meta_data")
 
     meta_data_name = parser.get("files", "meta_data")
-    meta_data = pd.read_csv(
-        f"{meta_data_directory}/{meta_data_name}", index_col="specobjid"
-    )
+    meta_data_location = f"{meta_data_directory}/{meta_data_name}"
 
-    # col 1: specobjid
-    # col 2: E(B-V) value
-    ebv_values = RawArray(
-        typecode_or_type="d", size_or_initializer=2 * meta_data.shape[0]
+    # a store only needs the coordinates and gets ebv as a new column,
+    # a csv file is rewritten with all its columns
+    is_store = MetaDataStore.is_store(meta_data_location)
+
+    meta_data = load_meta_data(
+        meta_data_location, columns=["ra", "dec"] if is_store else None
     )
 
     maps_directory = parser.get("directories", "ebv_maps")
-    counter = mp.Value("i", 0)
+    chunk_size = parser.getint("parameters", "chunk_size")
 
-    number_processes = parser.getint("parameters", "processes")
-    specobjids = meta_data.index
+    # values keyed by sky pixel or exact position, only galaxies not
+    # in the cache are looked up in the dust maps
+    cache_mode = parser.get("cache", "mode")
+    cache = None
 
-    with mp.Pool(
-        processes=number_processes,
-        initializer=deredspectra.shared_ebv_data,
-        initargs=(ebv_values, meta_data, maps_directory, counter),
-    ) as pool:
+    if cache_mode != "none":
 
-        pool.map(deredspectra.ebv_worker, specobjids)
+        cache = EBVCache(
+            directory=parser.get("directories", "ebv_cache"),
+            maps_directory=maps_directory,
+            nside=parser.getint("cache", "nside"),
+            exact=cache_mode == "exact",
+            chunk_size=chunk_size,
+        )
 
-    from sdss.utils.parallel import to_numpy_array
+    precompute = parser.get("cache", "precompute")
 
-    ebv_values = to_numpy_array(ebv_values, (meta_data.shape[0], 2))
-    # save data
-    specobjids = ebv_values[:, 0].astype(int)
-    import numpy as np
+    if cache_mode == "pixel" and precompute == "sky":
+        cache.precompute()
 
-    meta_data["ebv"] = np.nan
-    meta_data.loc[specobjids, "ebv"] = ebv_values[:, 1]
-    meta_data.to_csv(f"{meta_data_directory}/{meta_data_name}")
+    elif cache_mode == "pixel" and precompute == "footprint":
+        cache.precompute(
+            cache.footprint_pixels(meta_data["ra"], meta_data["dec"])
+        )
+
+    # a single instance of the dust maps, coordinates in chunks
+    ebv = deredspectra.ebv_column(
+        meta_data, maps_directory, chunk_size, cache=cache
+    )
+
+    # save data
+    if is_store:
+        MetaDataStore(meta_data_location).append_column("ebv", ebv)
+    else:
+        meta_data["ebv"] = ebv
+        meta_data.to_csv(meta_data_location)
 
     finish_time = time.time()
     print(f"Running time: {finish_time - start_time:.2f} [s]")
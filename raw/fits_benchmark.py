@@ -0,0 +1,152 @@
+"""
+Files per second when reading wave, flux and ivar from lite spectra:
+astropy with every column decoded versus sdss.raw.fitstable with
+only loglam, flux, ivar and specobjid. Synthetic files with the
+layout of lite spectra are written on the first run
+"""
+from configparser import ConfigParser, ExtendedInterpolation
+import os
+import time
+
+import astropy.io.fits as pyfits
+import numpy as np
+
+from sdss.raw.data import RawData
+
+
+###############################################################################
+def astropy_wave_flux_ivar(fits_file: str, specobjid: int) -> np.array:
+    """RawData.wave_flux_ivar before sdss.raw.fitstable"""
+
+    with pyfits.open(fits_file, memmap=False) as hdul:
+
+        wave = np.array(10.0 ** (hdul[1].data["loglam"]), dtype=float)
+        flux = hdul[1].data["flux"]
+        ivar = hdul[1].data["ivar"]
+        fits_specobjid = int(hdul[2].data["specobjid"].item())
+
+        assert fits_specobjid == specobjid, "specobjid do not match"
+
+        wave_flux_ivar = np.vstack((wave, flux, ivar))
+
+    return wave_flux_ivar
+
+
+###############################################################################
+def write_synthetic_lite(
+    save_to: str,
+    specobjid: int,
+    number_pixels: int,
+    number_spall_columns: int,
+    rng: np.random.Generator,
+) -> None:
+    """Write a file with the HDUs and columns of a lite spectrum"""
+
+    loglam = 3.5523 + 1e-4 * np.arange(number_pixels)
+    flux = rng.normal(10, 2, number_pixels)
+    ivar = rng.uniform(0, 4, number_pixels)
+
+    coadd = pyfits.BinTableHDU.from_columns(
+        [
+            pyfits.Column("flux", "E", array=flux),
+            pyfits.Column("loglam", "E", array=loglam),
+            pyfits.Column("ivar", "E", array=ivar),
+            pyfits.Column("and_mask", "J", array=np.zeros(number_pixels)),
+            pyfits.Column("or_mask", "J", array=np.zeros(number_pixels)),
+            pyfits.Column("wdisp", "E", array=np.ones(number_pixels)),
+            pyfits.Column("sky", "E", array=flux / 10),
+            pyfits.Column("model", "E", array=flux),
+        ],
+        name="COADD",
+    )
+
+    # specobjid is a string column in DR16 lite files
+    spall_columns = [
+        pyfits.Column("SPECOBJID", "19A", array=[str(specobjid)])
+    ] + [
+        pyfits.Column(f"COLUMN_{n}", "E", array=rng.normal(size=1))
+        for n in range(number_spall_columns - 1)
+    ]
+
+    spall = pyfits.BinTableHDU.from_columns(spall_columns, name="SPALL")
+
+    spzline = pyfits.BinTableHDU.from_columns(
+        [pyfits.Column("LINEWAVE", "D", array=rng.normal(size=32))],
+        name="SPZLINE",
+    )
+
+    hdul = pyfits.HDUList([pyfits.PrimaryHDU(), coadd, spall, spzline])
+    hdul.writeto(save_to, overwrite=True)
+
+
+###############################################################################
+def files_per_second(read, files: list, repetitions: int) -> float:
+    """Best rate over repetitions of read(location, specobjid)"""
+
+    best = np.inf
+
+    for _ in range(repetitions):
+
+        start = time.perf_counter()
+
+        for location, specobjid in files:
+            read(location, specobjid)
+
+        best = min(best, time.perf_counter() - start)
+
+    return len(files) / best
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    parser = ConfigParser(interpolation=ExtendedInterpolation())
+    parser.read("fits_benchmark.ini")
+
+    output_directory = parser.get("directories", "output")
+    number_files = parser.getint("parameters", "number_files")
+    number_pixels = parser.getint("parameters", "number_pixels")
+    number_spall_columns = parser.getint(
+        "parameters", "number_spall_columns"
+    )
+    repetitions = parser.getint("parameters", "repetitions")
+    ###########################################################################
+    os.makedirs(output_directory, exist_ok=True)
+
+    rng = np.random.default_rng(0)
+
+    files = []
+
+    for specobjid in range(1, number_files + 1):
+
+        location = f"{output_directory}/spec-synthetic-{specobjid:06d}.fits"
+
+        if not os.path.isfile(location):
+            write_synthetic_lite(
+                location, specobjid, number_pixels, number_spall_columns, rng
+            )
+
+        files.append((location, specobjid))
+
+    print(f"{len(files)} synthetic files in {output_directory}")
+    ###########################################################################
+    # same output before and after
+    for location, specobjid in files[:10]:
+
+        before = astropy_wave_flux_ivar(location, specobjid)
+        after = RawData.wave_flux_ivar(location, specobjid)
+
+        assert np.array_equal(before, after), "outputs do not match"
+
+    readers = {
+        "astropy, every column": astropy_wave_flux_ivar,
+        "fitstable, float64": RawData.wave_flux_ivar,
+        "fitstable, float32": lambda location, specobjid: (
+            RawData.wave_flux_ivar(location, specobjid, np.float32)
+        ),
+    }
+
+    for name, read in readers.items():
+
+        rate = files_per_second(read, files, repetitions)
+        print(f"{name}: {rate:.0f} files/s")
@@ -0,0 +1,64 @@
+"""Harvest header keywords of fits files into a meta data store"""
+from configparser import ConfigParser, ExtendedInterpolation
+import multiprocessing as mp
+import time
+
+from sdss.metastore import load_meta_data
+from sdss.raw import data
+
+
+###############################################################################
+def hdu_names(section: "SectionProxy") -> dict:
+    """{hdu: [name, ...]} from options as hdu_0 = NAME, NAME"""
+
+    return {
+        int(option.removeprefix("hdu_")): [
+            name.strip() for name in value.split(",") if name.strip()
+        ]
+        for option, value in section.items()
+    }
+
+
+###############################################################################
+if __name__ == "__main__":
+    mp.set_start_method("spawn")
+
+    t0 = time.time()
+    ###########################################################################
+    parser = ConfigParser(interpolation=ExtendedInterpolation())
+    parser.read("headers.ini")
+    ###########################################################################
+    meta_data_directory = parser.get("directories", "meta_data")
+
+    spectra_df_name = parser.get("files", "spectra_df")
+    spectra_df = load_meta_data(
+        f"{meta_data_directory}/{spectra_df_name}",
+        columns=["plate", "mjd", "fiberid", "run2d"],
+    )
+
+    number_spectra = parser.getint("parameters", "number_spectra")
+
+    if number_spectra != -1:
+        spectra_df = spectra_df[:number_spectra]
+    ###########################################################################
+    data_directory = parser.get("directories", "data")
+    output_directory = parser.get("directories", "output")
+    number_processes = parser.getint("parameters", "number_processes")
+
+    raw_data = data.RawData(
+        data_directory=data_directory,
+        output_directory=output_directory,
+        number_processes=number_processes,
+    )
+    ###########################################################################
+    headers_df = raw_data.save_headers(
+        spectra_df,
+        save_to=output_directory,
+        header_keywords=hdu_names(parser["header_keywords"]),
+        table_columns=hdu_names(parser["table_columns"]),
+    )
+
+    print(headers_df.dtypes)
+    ###########################################################################
+    t1 = time.time()
+    print(f"Run time: {t1-t0}")
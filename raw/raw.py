@@ -3,8 +3,7 @@ from configparser import ConfigParser, ExtendedInterpolation
 import multiprocessing as mp
 import time
 
-import pandas as pd
-
+from sdss.metastore import load_meta_data
 from sdss.raw import data
 
 ###############################################################################
@@ -27,9 +26,7 @@ if __name__ == "__main__":
     meta_data_directory = parser.get("directories", "meta_data")
 
     spectra_df_name = parser.get("files", "spectra_df")
-    spectra_df = pd.read_csv(
-        f"{meta_data_directory}/{spectra_df_name}", index_col="specobjid"
-    )
+    spectra_df = load_meta_data(f"{meta_data_directory}/{spectra_df_name}")
 
     number_spectra = parser.getint("parameters", "number_spectra")
 
@@ -39,16 +36,34 @@ if __name__ == "__main__":
     data_directory = parser.get("directories", "data")
     output_directory = parser.get("directories", "output")
     number_processes = parser.getint("parameters", "number_processes")
+    storage = parser.get("parameters", "storage")
+    shard_size = parser.getint("parameters", "shard_size")
+    dtype = parser.get("parameters", "dtype")
+    incremental = parser.getboolean("parameters", "incremental")
 
     raw_data = data.RawData(
         data_directory=data_directory,
         output_directory=output_directory,
         number_processes=number_processes,
+        storage=storage,
+        shard_size=shard_size,
+        dtype=dtype,
+        incremental=incremental,
     )
     ###########################################################################
+    columns = parser.get("extraction", "columns")
+    columns = [name.strip() for name in columns.split(",") if name.strip()]
+
+    reject_flags = parser.get("extraction", "reject_flags")
+    reject_flags = [
+        name.strip() for name in reject_flags.split(",") if name.strip()
+    ]
+    ###########################################################################
     print("Get raw spectra")
     # raw_data.save_raw_data()
-    raw_data.save_raw_data(spectra_df)
+    raw_data.save_raw_data(
+        spectra_df, columns=columns, reject_flags=reject_flags
+    )
     ###########################################################################
     t1 = time.time()
     print(f"Run time: {t1-t0}")
@@ -7,6 +7,7 @@ import numpy as np
 import pandas as pd
 
 from sdss.describe import DataDescription
+from sdss.metastore import load_meta_data
 from sdss.process.sample import FileDirectory
 from sdss.process.sample import SampleData
 
@@ -23,9 +24,7 @@ meta_data_directory = parser.get("directories", "meta_data")
 
 spectra_df_name = parser.get("files", "spectra_df")
 
-spectra_df = pd.read_csv(
-    f"{meta_data_directory}/{spectra_df_name}", index_col="specobjid"
-)
+spectra_df = load_meta_data(f"{meta_data_directory}/{spectra_df_name}")
 
 number_spectra = parser.getint("parameters", "number_spectra")
 
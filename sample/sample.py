@@ -2,9 +2,8 @@
 from configparser import ConfigParser, ExtendedInterpolation
 import time
 
-import numpy as np
-import pandas as pd
-
+from sdss.metadata import MetaData
+from sdss.metastore import MetaDataStore, load_meta_data
 from sdss.process.sample import FileDirectory
 from sdss.process.sample import SampleData
 
@@ -22,9 +21,7 @@ meta_data_directory = parser.get("directories", "meta_data")
 
 spectra_df_name = parser.get("files", "spectra_df")
 
-spectra_df = pd.read_csv(
-    f"{meta_data_directory}/{spectra_df_name}", index_col="specobjid"
-)
+spectra_df = load_meta_data(f"{meta_data_directory}/{spectra_df_name}")
 ###########################################################################
 # Set sample class
 sample = SampleData()
@@ -67,6 +64,10 @@ signal_to_noise_name = (
 
 spectra_df_name = f"{z_name}_{signal_to_noise_name}"
 
+# cache SAS paths as columns, later stages look them up instead of
+# formatting them for each spectrum
+spectra_df = MetaData.with_sas_paths(spectra_df)
+
 spectra_df.loc[selection_mask].to_csv(
     f"{meta_data_directory}/{spectra_df_name}", index=True
 )
@@ -78,6 +79,10 @@ check.check_directory(f"{output_directory}", exit=False)
 spectra_df.loc[selection_mask].to_csv(
     f"{output_directory}/{spectra_df_name}.csv.gz", index=True
 )
+# typed columnar copy, later stages load only the columns they need
+MetaDataStore(f"{output_directory}/{spectra_df_name}").write(
+    spectra_df.loc[selection_mask]
+)
 ###########################################################################
 # Save configuration file
 with open(f"{output_directory}/{name_cofig_file}", "w") as configfile:
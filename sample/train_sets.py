@@ -6,9 +6,10 @@ from configparser import ConfigParser, ExtendedInterpolation
 import time
 
 import numpy as np
-import pandas as pd
 
+from sdss.metastore import load_meta_data
 from sdss.utils.managefiles import FileDirectory
+from sdss.zwarning import ZWarningFlags
 
 ###############################################################################
 start_time = time.time()
@@ -23,9 +24,7 @@ print(f"Load data frame with metadata", end="\n")
 meta_data_directory = parser.get("directories", "meta_data")
 
 spectra_df_name = parser.get("files", "spectra_df")
-spectra_df = pd.read_csv(
-    f"{meta_data_directory}/{spectra_df_name}", index_col="specobjid"
-)
+spectra_df = load_meta_data(f"{meta_data_directory}/{spectra_df_name}")
 
 print(f"Load spectra and index array", end="\n")
 
@@ -43,7 +42,14 @@ spectra_df.loc[index_data[:, 1], "indexArray"] = index_data[:, 0].astype(int)
 ###############################################################################
 print(f"Save spectra with zWarning", end="\n")
 
-warning_mask = spectra_df["zWarning"] != 0
+z_warning_column = parser.get("z_warning", "column")
+include_flags = parser.get("z_warning", "include").split()
+exclude_flags = parser.get("z_warning", "exclude").split()
+
+z_warning_flags = ZWarningFlags(spectra_df[z_warning_column])
+print(f"Spectra per flag: {z_warning_flags.counts()}", end="\n")
+
+warning_mask = ~z_warning_flags.select(include_flags, exclude_flags)
 number_warnings = warning_mask.sum()
 print(f"Number of warnings: {number_warnings}", end="\n")
 index_warning = spectra_df.loc[warning_mask, "indexArray"].to_numpy(dtype=int)
@@ -0,0 +1,606 @@
+"""
+Asynchronous download of files from the science archive server.
+Connections are kept alive and reused among a bounded number of
+concurrent requests
+"""
+import asyncio
+import hashlib
+import os
+
+import aiohttp
+
+from sdss.fitsverify import FitsIntegrityError, FitsStreamVerifier
+from sdss.scheduler import RetryScheduler
+from sdss.sources import PARTIAL_SUFFIX, Source, SourceList
+
+
+###############################################################################
+class AsyncDownloader:
+    """Download files with asyncio over a pool of keep-alive connections"""
+
+    def __init__(
+        self,
+        base_url: str = "https://data.sdss.org",
+        concurrency: int = 32,
+        timeout: float = 300.0,
+        chunk_size: int = 2**16,
+        verify_fits: bool = True,
+        minimum_hdus: int = 1,
+        on_success: "callable" = None,
+        on_failure: "callable" = None,
+        scheduler: RetryScheduler = None,
+        on_content: "callable" = None,
+        sources: list = None,
+    ):
+        """
+        PARAMETERS
+            base_url: url of the server, e.g. https://data.sdss.org
+                or http://127.0.0.1:8000 for a local stand-in server
+            concurrency: maximum number of simultaneous requests, it
+                is also the size of the pool of connections
+            timeout: maximum time in seconds for a single request
+            chunk_size: number of bytes to write to disk at a time
+            verify_fits: if True, the FITS structure and checksums of
+                each file are verified while its bytes arrive, files
+                that fail are removed and counted as failed
+            minimum_hdus: number of HDUs each FITS file must have
+            on_success: called as on_success(key, size, checksum)
+                after a file is downloaded, checksum is the md5 hex
+                digest of the file
+            on_failure: called as on_failure(key) after a file
+                fails all its attempts
+            scheduler: decides retries, rate of requests and the number
+                of simultaneous requests. If None, a RetryScheduler
+                with max_concurrency equal to concurrency is used
+            on_content: if not None, files are kept in memory and
+                on_content(key, content) is called in a thread with
+                the bytes of the file. It returns True if the file
+                has to be written to destination as well
+            sources: locations tried in order for each file, local
+                mirrors as file:// paths and urls of HTTP mirrors.
+                If None, base_url is the only source
+        """
+
+        self.base_url = base_url.rstrip("/")
+
+        if sources is None:
+            sources = [self.base_url]
+
+        self.sources = SourceList(sources)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.verify_fits = verify_fits
+        self.minimum_hdus = minimum_hdus
+        self.on_success = on_success
+        self.on_failure = on_failure
+
+        if scheduler is None:
+            scheduler = RetryScheduler(max_concurrency=concurrency)
+
+        self.scheduler = scheduler
+        self.on_content = on_content
+
+    ###########################################################################
+    def download(self, tasks: list) -> list:
+        """
+        Download files in tasks
+
+        PARAMETERS
+            tasks: iterable of (key, url_path, destination) tuples,
+                key identifies the file in callbacks, e.g.
+                (
+                    299489677444933632,
+                    "sas/dr16/.../lite/0266/spec-0266-51602-0001.fits",
+                    "/home/john/spectra/sas/dr16/.../lite/0266/..."
+                )
+
+        OUTPUT
+            failed: list with the tasks that could not be downloaded
+
+        Raises the first exception of on_success or on_failure once
+        every task is done
+        """
+
+        return asyncio.run(self.download_async(tasks))
+
+    ###########################################################################
+    async def download_async(self, tasks: list) -> list:
+        """
+        Coroutine version of download to use inside a running loop.
+        A fixed number of workers consume tasks from a queue, hence
+        memory does not grow with the number of tasks. Failed tasks
+        go back to the queue after a backoff delay set by the
+        scheduler, meanwhile workers keep downloading other files
+        """
+
+        queue = asyncio.Queue(maxsize=2 * self.concurrency)
+        failed = []
+
+        # gate the number of active requests to scheduler.concurrency
+        self.number_active = 0
+        self.slots = asyncio.Condition()
+        self.retries = set()
+        # exceptions raised by on_success and on_failure
+        self.callback_errors = []
+
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency, limit_per_host=self.concurrency
+        )
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout
+        ) as session:
+
+            workers = [
+                asyncio.create_task(self._worker(session, queue, failed))
+                for _ in range(self.concurrency)
+            ]
+
+            for task in tasks:
+                await queue.put((task, 1))
+
+            # retries hold their slot in the queue until they are back
+            await queue.join()
+
+            for worker in workers:
+                worker.cancel()
+
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        if self.callback_errors:
+            raise self.callback_errors[0]
+
+        return failed
+
+    ###########################################################################
+    async def _worker(
+        self,
+        session: aiohttp.ClientSession,
+        queue: asyncio.Queue,
+        failed: list,
+    ) -> None:
+        """Consume (task, attempt) items from queue until cancelled"""
+
+        while True:
+
+            task, attempt = await queue.get()
+
+            key, url_path, destination = task
+
+            await self._acquire_slot()
+
+            try:
+
+                size, checksum = await self._fetch_from_sources(
+                    session, key, url_path, destination
+                )
+
+            except Exception as e:
+
+                self.scheduler.record(success=False)
+
+                retryable = self.scheduler.is_retryable(e)
+
+                if self.scheduler.should_retry(attempt, retryable):
+
+                    delay = self.scheduler.backoff(attempt)
+                    retry = asyncio.create_task(
+                        self._retry(queue, (task, attempt + 1), delay)
+                    )
+
+                    # keep a reference, the loop only holds weak ones
+                    self.retries.add(retry)
+                    retry.add_done_callback(self.retries.discard)
+
+                    continue
+
+                print(f"Failed : {url_path}")
+                print(f"{e}")
+
+                failed.append(task)
+
+                self._run_callback(queue, self.on_failure, key)
+
+                continue
+
+            finally:
+                await self._release_slot()
+
+            self.scheduler.record(success=True)
+
+            self._run_callback(queue, self.on_success, key, size, checksum)
+
+    ###########################################################################
+    def _run_callback(
+        self, queue: asyncio.Queue, callback: "callable", *args
+    ) -> None:
+        """
+        Call on_success or on_failure and mark the item of queue as
+        done even if the callback raises, hence queue.join returns.
+        The exception is raised by download_async after the queue is
+        done
+
+        PARAMETERS
+            queue: queue of the item being processed
+            callback: on_success, on_failure or None
+            args: arguments of the callback
+        """
+
+        try:
+
+            if callback is not None:
+                callback(*args)
+
+        except Exception as e:
+            self.callback_errors.append(e)
+
+        finally:
+            queue.task_done()
+
+    ###########################################################################
+    async def _retry(
+        self, queue: asyncio.Queue, item: tuple, delay: float
+    ) -> None:
+        """Put item back in the queue after delay seconds"""
+
+        await asyncio.sleep(delay)
+        await queue.put(item)
+
+        # the failed attempt is done once its retry is in the queue
+        queue.task_done()
+
+    ###########################################################################
+    async def _acquire_slot(self) -> None:
+        """Wait until there are less than scheduler.concurrency requests"""
+
+        async with self.slots:
+
+            await self.slots.wait_for(
+                lambda: self.number_active < self.scheduler.concurrency
+            )
+
+            self.number_active += 1
+
+    ###########################################################################
+    async def _release_slot(self) -> None:
+        """Free a slot for a request"""
+
+        async with self.slots:
+
+            self.number_active -= 1
+            self.slots.notify_all()
+
+    ###########################################################################
+    async def _fetch_from_sources(
+        self,
+        session: aiohttp.ClientSession,
+        key: object,
+        url_path: str,
+        destination: str,
+    ) -> tuple:
+        """
+        Try sources in order until one of them has the file. A source
+        that fails loses health, a source that does not have the file
+        does not
+
+        PARAMETERS
+            session: session holding the pool of connections
+            key: identifier of the file passed to on_content
+            url_path: location of the file in the SAS tree
+            destination: location of the file in local disk
+
+        OUTPUT
+            (size, checksum): size in bytes and md5 hex digest
+        """
+
+        errors = []
+
+        for source in self.sources.candidates():
+
+            try:
+
+                if source.is_local is True:
+
+                    loop = asyncio.get_running_loop()
+
+                    result = await loop.run_in_executor(
+                        None,
+                        self._from_local,
+                        source,
+                        key,
+                        url_path,
+                        destination,
+                    )
+
+                elif self.on_content is None:
+
+                    await asyncio.sleep(self.scheduler.reserve_request())
+
+                    result = await self._fetch(
+                        session, source, url_path, destination
+                    )
+
+                else:
+
+                    await asyncio.sleep(self.scheduler.reserve_request())
+
+                    result = await self._fetch_content(
+                        session, source, key, url_path, destination
+                    )
+
+            except Exception as e:
+
+                errors.append(e)
+
+                if self.sources.is_missing(e) is False:
+                    source.record(success=False)
+
+                continue
+
+            source.record(success=True)
+
+            return result
+
+        # an error other than a missing file is worth another round
+        for error in errors:
+
+            if self.sources.is_missing(error) is False:
+                raise error
+
+        raise errors[-1]
+
+    ###########################################################################
+    def _from_local(
+        self, source: Source, key: object, url_path: str, destination: str
+    ) -> tuple:
+        """
+        Get a file from a local mirror at disk speed
+
+        PARAMETERS
+            source: local mirror
+            key: identifier of the file passed to on_content
+            url_path: location of the file in the SAS tree
+            destination: location of the file in local disk
+
+        OUTPUT
+            (size, checksum): checksum is None, the file is not read
+                unless on_content needs its bytes. Files linked from
+                a mirror were verified when the mirror got them
+        """
+
+        if self.on_content is None:
+            return source.link(url_path, destination), None
+
+        with open(source.url(url_path), "rb") as file:
+            content = file.read()
+
+        self._verify_content(content)
+
+        checksum = hashlib.md5(content).hexdigest()
+
+        if self.on_content(key, content) is True:
+            source.link(url_path, destination)
+
+        return len(content), checksum
+
+    ###########################################################################
+    async def _fetch(
+        self,
+        session: aiohttp.ClientSession,
+        source: Source,
+        url_path: str,
+        destination: str,
+    ) -> tuple:
+        """
+        Stream a single file to a partial file next to destination.
+        If a partial file exists, only the missing bytes are requested
+        with a Range header. The partial file is renamed to destination
+        once it is complete and verified, hence a file at destination
+        is never truncated or corrupt
+
+        PARAMETERS
+            session: session holding the pool of connections
+            source: HTTP server to request the file from
+            url_path: location of the file in the server
+            destination: location of the file in local disk
+
+        OUTPUT
+            (size, checksum): size in bytes and md5 hex digest
+        """
+
+        file_url = source.url(url_path)
+
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+        partial_file = f"{destination}{PARTIAL_SUFFIX}"
+
+        resume_from = 0
+
+        if os.path.isfile(partial_file):
+            resume_from = os.path.getsize(partial_file)
+
+        headers = {}
+        md5, verifier = self._new_digests()
+
+        if resume_from > 0:
+            headers["Range"] = f"bytes={resume_from}-"
+            self._read_partial(partial_file, md5, verifier)
+
+        try:
+
+            async with session.get(file_url, headers=headers) as response:
+
+                if response.status == 416:
+
+                    # Content-Range: bytes */{file size}
+                    content_range = response.headers.get("Content-Range", "")
+                    file_size = content_range.rpartition("/")[-1]
+
+                    if file_size != str(resume_from):
+                        os.remove(partial_file)
+                        response.raise_for_status()
+
+                    # partial file already holds every byte of the file
+                    size = self._finish_file(
+                        partial_file, destination, verifier
+                    )
+
+                    return size, md5.hexdigest()
+
+                response.raise_for_status()
+
+                # the server ignored the Range header, start from scratch
+                mode = "ab" if response.status == 206 else "wb"
+
+                if response.status != 206:
+                    md5, verifier = self._new_digests()
+
+                with open(partial_file, mode) as file:
+
+                    async for chunk in response.content.iter_chunked(
+                        self.chunk_size
+                    ):
+                        file.write(chunk)
+                        md5.update(chunk)
+
+                        if verifier is not None:
+                            verifier.update(chunk)
+
+            size = self._finish_file(partial_file, destination, verifier)
+
+        except FitsIntegrityError:
+
+            # corrupt bytes, a new attempt has to start from scratch
+            if os.path.isfile(partial_file):
+                os.remove(partial_file)
+
+            raise
+
+        return size, md5.hexdigest()
+
+    ###########################################################################
+    async def _fetch_content(
+        self,
+        session: aiohttp.ClientSession,
+        source: Source,
+        key: object,
+        url_path: str,
+        destination: str,
+    ) -> tuple:
+        """
+        Download a single file into memory and pass its bytes to
+        on_content. The file is written to destination only if
+        on_content returns True
+
+        PARAMETERS
+            session: session holding the pool of connections
+            source: HTTP server to request the file from
+            key: identifier of the file passed to on_content
+            url_path: location of the file in the server
+            destination: location of the file in local disk
+
+        OUTPUT
+            (size, checksum): size in bytes and md5 hex digest
+        """
+
+        file_url = source.url(url_path)
+
+        async with session.get(file_url) as response:
+
+            response.raise_for_status()
+            content = await response.read()
+
+        self._verify_content(content)
+
+        checksum = hashlib.md5(content).hexdigest()
+
+        # parsing is CPU bound, keep it out of the event loop
+        keep_file = await asyncio.get_running_loop().run_in_executor(
+            None, self.on_content, key, content
+        )
+
+        if keep_file is True:
+
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+            partial_file = f"{destination}{PARTIAL_SUFFIX}"
+
+            with open(partial_file, "wb") as file:
+                file.write(content)
+
+            os.replace(partial_file, destination)
+
+        return len(content), checksum
+
+    ###########################################################################
+    def _new_digests(self) -> tuple:
+        """
+        OUTPUT
+            (md5, verifier): verifier is None if verify_fits is False
+        """
+
+        verifier = None
+
+        if self.verify_fits is True:
+            verifier = FitsStreamVerifier(self.minimum_hdus)
+
+        return hashlib.md5(), verifier
+
+    ###########################################################################
+    def _read_partial(
+        self,
+        partial_file: str,
+        md5: "hashlib.md5",
+        verifier: FitsStreamVerifier,
+    ) -> None:
+        """Feed md5 and verifier with the bytes already in partial_file"""
+
+        with open(partial_file, "rb") as file:
+
+            for chunk in iter(lambda: file.read(self.chunk_size), b""):
+
+                md5.update(chunk)
+
+                if verifier is not None:
+                    verifier.update(chunk)
+
+    ###########################################################################
+    def _verify_content(self, content: bytes) -> None:
+        """Verify a file held in memory, see FitsStreamVerifier"""
+
+        if self.verify_fits is False:
+            return
+
+        verifier = FitsStreamVerifier(self.minimum_hdus)
+
+        verifier.update(content)
+        verifier.finish()
+
+    ###########################################################################
+    def _finish_file(
+        self,
+        partial_file: str,
+        destination: str,
+        verifier: FitsStreamVerifier,
+    ) -> int:
+        """
+        Move partial file to destination with an atomic rename
+
+        PARAMETERS
+            partial_file: location of the complete partial file
+            destination: location of the file in local disk
+            verifier: fed with every byte of the file, if not None it
+                must find a complete FITS file
+
+        OUTPUT
+            file_size: size of the file in bytes
+        """
+
+        if verifier is not None:
+            verifier.finish()
+
+        os.replace(partial_file, destination)
+
+        return os.path.getsize(destination)
@@ -1,22 +1,62 @@
+import hashlib
+import heapq
+import io
 import multiprocessing as mp
 import os
+import queue
+import sys
+import threading
 import time
+import urllib.error
 import urllib.request
 
 ####################################################################
 import numpy as np
 import pandas as pd
 
+from sdss.asyncdownload import AsyncDownloader, PARTIAL_SUFFIX
+from sdss.fitsverify import FitsIntegrityError, FitsStreamVerifier
+from sdss.manifest import DownloadManifest
+from sdss.metadata import MetaData
+from sdss.plates import PlatePlanner
+from sdss.raw.data import RawData
+from sdss.scheduler import RetryScheduler
+from sdss.sources import SourceList
+
 ###############################################################################
-def init_download_worker(input_counter: "mp.Value") -> "None":
+def init_download_worker(
+    input_counter: "mp.Value", input_sources: "list"
+) -> "None":
     """
     Initialize worker for download
     PARAMETERS
         counter: counts the number of the child process
+        input_sources: locations of local mirrors and HTTP servers,
+            each child tracks the health of its own sources
     """
     global counter
+    global sources
 
     counter = input_counter
+    sources = SourceList(input_sources)
+
+
+###############################################################################
+def download_worker(index: "int", descriptor: "np.void") -> "tuple":
+    """
+    Download a single file, see DownloadData._get_file
+
+    PARAMETERS
+        index: position of descriptor in the array of descriptors
+        descriptor: record with url_path and destination of the file
+    """
+
+    return DownloadData._get_file(
+        index,
+        descriptor["url_path"].decode(),
+        descriptor["destination"].decode(),
+        sources,
+    )
 
 
 ###############################################################################
@@ -26,6 +66,16 @@ class DownloadData:
         spectra_df: "pandas data frame",
         output_directory: "str",
         n_processes: "int",
+        engine: "str" = "pool",
+        concurrency: "int" = 32,
+        base_url: "str" = "https://data.sdss.org",
+        manifest: "str" = None,
+        max_attempts: "int" = 10,
+        requests_per_second: "float" = None,
+        raw_data_directory: "str" = None,
+        disk_budget: "int" = None,
+        sources: "list" = None,
+        ingestion: "str" = "fiber",
     ) -> "None":
         """
         PARAMETERS
@@ -39,14 +89,84 @@ class DownloadData:
                 ]
             output_directory: location where the data will be downloaded
             n_processes: number of processes for parallel execution
+            engine: either "pool" to download with a pool of processes
+                or "async" to download with asyncio over a pool of
+                keep-alive connections
+            concurrency: maximum number of simultaneous requests
+                when engine is "async"
+            base_url: url of the science archive server
+            manifest: location of the SQLite manifest that records
+                the status of each download. If None, files already
+                downloaded are found checking the file system
+            max_attempts: maximum number of requests for a single
+                file, failed files are retried with exponential backoff
+            requests_per_second: global cap for the rate of requests,
+                if None, requests are not rate limited
+            raw_data_directory: if not None, streaming mode: each file
+                is parsed in memory and its wave, flux and ivar are
+                saved to f"{raw_data_directory}/{specobjid}.npy", as
+                RawData does. Only available with the async engine
+            disk_budget: in streaming mode, bytes of fits files to keep
+                in output_directory, the rest are discarded. If None,
+                every fits file is kept
+            sources: locations tried in order for each file, local
+                mirrors as file:// paths, e.g. file:///data/spectra,
+                followed by urls of HTTP mirrors. Files in local
+                mirrors are hard linked or copied. If None, base_url
+                is the only source
+            ingestion: "fiber" to get a lite spectrum per row,
+                "plate" to get spPlate files and split them into the
+                wave, flux and ivar of each row, or "auto" to decide
+                per plate which option needs fewer bytes and requests.
+                "plate" and "auto" need streaming mode
         """
-        self.spectra_df = spectra_df
+        # paths are formatted once for the whole data frame
+        self.spectra_df = MetaData.with_sas_paths(spectra_df)
 
         self._check_directory(output_directory)
         self.output_directory = output_directory
 
         self.n_processes = n_processes
 
+        if engine not in ("pool", "async"):
+            raise ValueError(f"engine must be pool or async, not {engine}")
+
+        self.engine = engine
+        self.concurrency = concurrency
+        self.base_url = base_url.rstrip("/")
+
+        if sources is None:
+            sources = [self.base_url]
+
+        self.sources = sources
+
+        # only the location, a sqlite connection cannot be pickled
+        # when sending self to child processes
+        self.manifest = manifest
+
+        self.max_attempts = max_attempts
+        self.requests_per_second = requests_per_second
+
+        if raw_data_directory is not None:
+
+            if engine != "async":
+                raise ValueError("streaming mode needs the async engine")
+
+            self._check_directory(raw_data_directory)
+
+        self.raw_data_directory = raw_data_directory
+        self.disk_budget = disk_budget
+
+        if ingestion not in ("fiber", "plate", "auto"):
+            raise ValueError(
+                f"ingestion must be fiber, plate or auto, not {ingestion}"
+            )
+
+        if ingestion != "fiber" and raw_data_directory is None:
+            raise ValueError(f"{ingestion} ingestion needs streaming mode")
+
+        self.ingestion = ingestion
+
     ###########################################################################
     def download_files(self) -> "None":
 
@@ -56,128 +176,833 @@ class DownloadData:
 
         start_time_download = time.time()
 
-        spectra_indexes = self.spectra_df.index.values
+        # streaming mode: the disk budget is shared among the threads
+        # extracting lite spectra and spPlate files
+        self.budget_lock = threading.Lock()
+        self.kept_bytes = 0
 
-        counter = mp.Value("i", 0)
+        manifest = None
+        positions = np.arange(self.spectra_df.shape[0])
 
-        with mp.Pool(
-            processes=self.n_processes,
-            initializer=init_download_worker,
-            initargs=(counter,),
-        ) as pool:
+        if self.manifest is not None:
+
+            manifest = DownloadManifest(self.manifest)
+
+            manifest.register(
+                self.spectra_df["specobjid"].to_numpy(),
+                (self.spectra_df["spectrum_name"] + ".fits").to_list(),
+            )
+
+            pending_mask = manifest.pending_mask(
+                self.spectra_df["specobjid"].to_numpy()
+            )
+            positions = positions[pending_mask]
+
+            print(f"Manifest: {manifest.status_counts()}")
+            print(f"{positions.size} files left to download")
+
+        plate_positions = positions[:0]
+
+        if self.ingestion != "fiber":
+
+            positions, plate_positions = self._split_by_ingestion(
+                positions, check_disk=manifest is None
+            )
+
+        descriptors = self._file_descriptors(positions)
+
+        if self.engine == "async":
 
-            results = pool.map(self._get_file, spectra_indexes)
-            number_fail = sum(results)
+            number_fail = self._download_files_async(descriptors, manifest)
+
+        else:
+
+            number_fail = self._download_files_pool(descriptors, manifest)
+
+        if plate_positions.size > 0:
+            number_fail += self._download_plates(plate_positions, manifest)
 
         finish_time_download = time.time()
 
         print(f"Finish download...")
         print(f"Fail to download {number_fail} files")
 
+        if manifest is not None:
+
+            print(f"Manifest: {manifest.status_counts()}")
+            manifest.close()
+
         download_time = finish_time_download - start_time_download
         print(f"Download took {download_time:.2f}[s]")
         #######################################################################
 
     ###########################################################################
+    def reconcile_manifest(self) -> "dict":
+        """
+        Rebuild the manifest from a scan of the output directory and,
+        in streaming mode, of the raw data directory
 
-    def _get_file(self, index_spectrum: "int") -> "int":
+        OUTPUT
+            counts: number of files per status in the manifest
         """
-        Retrieve a single file from the science archive server
+
+        if self.manifest is None:
+            raise ValueError("DownloadData was created without manifest")
+
+        locations = (
+            f"{self.output_directory}/" + self.spectra_df["url_path"]
+        ).to_list()
+
+        # streaming mode: spectra already extracted count as done
+        extracted_specobjids = None
+
+        if self.raw_data_directory is not None:
+
+            with os.scandir(self.raw_data_directory) as entries:
+
+                # {specobjid}.npy files, other .npy files such as
+                # shards of a packed store are skipped
+                extracted_specobjids = [
+                    int(entry.name[:-4])
+                    for entry in entries
+                    if entry.name.endswith(".npy")
+                    and entry.name[:-4].isdigit()
+                ]
+
+        manifest = DownloadManifest(self.manifest)
+
+        counts = manifest.reconcile(
+            self.spectra_df["specobjid"].to_numpy(),
+            locations,
+            extracted_specobjids,
+        )
+
+        manifest.close()
+
+        print(f"Manifest: {counts}")
+
+        return counts
+
+    ###########################################################################
+    def _download_files_pool(
+        self, descriptors: "np.array", manifest: "DownloadManifest"
+    ) -> "int":
+        """
+        Download spectra with a pool of processes. Children receive
+        only the descriptor of each file, never the data frame
 
         PARAMETERS
-            index_spectrum: index of the spectrum in spectra data frame
+            descriptors: structured array with specobjid, url_path
+                and destination of the files to download
+            manifest: if not None, the result of each download is
+                recorded in it
 
-        RETURN
-            0 if download is succesful, 1 otherwise
+        OUTPUT
+            number of files that failed to download
+        """
+
+        scheduler = self._get_scheduler(max_concurrency=self.n_processes)
+
+        counter = mp.Value("i", 0)
+        results = queue.Queue()
+
+        # (time when the retry is due, index, attempt)
+        retries = []
+        next_index = 0
+        number_in_flight = 0
+        number_fail = 0
+
+        with mp.Pool(
+            processes=self.n_processes,
+            initializer=init_download_worker,
+            initargs=(counter, self.sources),
+        ) as pool:
+
+            while (
+                next_index < descriptors.size or retries or number_in_flight
+            ):
+
+                # submit as many files as the scheduler allows
+                while number_in_flight < scheduler.concurrency:
+
+                    if retries and retries[0][0] <= time.monotonic():
+                        _, index, attempt = heapq.heappop(retries)
+
+                    elif next_index < descriptors.size:
+                        index = next_index
+                        attempt = 1
+                        next_index += 1
+
+                    else:
+                        break
+
+                    time.sleep(scheduler.reserve_request())
+
+                    pool.apply_async(
+                        download_worker,
+                        (index, descriptors[index]),
+                        callback=lambda result, a=attempt: results.put(
+                            (result, a)
+                        ),
+                        error_callback=lambda e, i=index, a=attempt: (
+                            results.put(
+                                (
+                                    (i, None, None, scheduler.is_retryable(e)),
+                                    a,
+                                )
+                            )
+                        ),
+                    )
+
+                    number_in_flight += 1
+
+                # wait for a result or for the next retry to be due
+                timeout = None
+
+                if retries:
+                    timeout = max(0.0, retries[0][0] - time.monotonic())
+
+                if number_in_flight == 0:
+                    time.sleep(timeout)
+                    continue
+
+                try:
+                    result, attempt = results.get(timeout=timeout)
+
+                except queue.Empty:
+                    continue
+
+                number_in_flight -= 1
+
+                index, file_size, checksum, retryable = result
+
+                scheduler.record(success=file_size is not None)
+
+                if file_size is None and scheduler.should_retry(
+                    attempt, retryable
+                ):
+
+                    retry_time = time.monotonic() + scheduler.backoff(attempt)
+                    heapq.heappush(retries, (retry_time, index, attempt + 1))
+
+                    continue
+
+                number_fail += file_size is None
+
+                if manifest is None:
+                    continue
+
+                specobjid = descriptors["specobjid"][index]
+
+                if file_size is None:
+                    manifest.mark_failed(specobjid)
+                else:
+                    manifest.mark_downloaded(specobjid, file_size, checksum)
+
+        if manifest is not None:
+            manifest.commit()
+
+        return number_fail
+
+    ###########################################################################
+    def _get_scheduler(self, max_concurrency: "int") -> "RetryScheduler":
+        """
+        Central scheduler for retries, rate and number of simultaneous
+        requests
+
+        PARAMETERS
+            max_concurrency: upper bound of simultaneous requests
+        """
+
+        return RetryScheduler(
+            max_attempts=self.max_attempts,
+            requests_per_second=self.requests_per_second,
+            max_concurrency=max_concurrency,
+        )
+
+    ###########################################################################
+    def _download_files_async(
+        self, descriptors: "np.array", manifest: "DownloadManifest"
+    ) -> "int":
+        """
+        Download spectra with asyncio, reusing connections among
+        at most self.concurrency simultaneous requests
+
+        PARAMETERS
+            descriptors: structured array with specobjid, url_path
+                and destination of the files to download
+            manifest: if not None, the result of each download is
+                recorded in it
+
+        OUTPUT
+            number of files that failed to download
+        """
+
+        on_success, on_failure, on_content = None, None, None
+
+        if manifest is not None:
+            on_success = manifest.mark_downloaded
+            on_failure = manifest.mark_failed
+
+        if self.raw_data_directory is not None:
+
+            on_content = self._extract_content
+
+            if manifest is not None:
+                on_success = manifest.mark_extracted
+
+        downloader = AsyncDownloader(
+            base_url=self.base_url,
+            concurrency=self.concurrency,
+            on_success=on_success,
+            on_failure=on_failure,
+            scheduler=self._get_scheduler(max_concurrency=self.concurrency),
+            on_content=on_content,
+            sources=self.sources,
+        )
+
+        # without manifest, files on disk are skipped
+        tasks = self._download_tasks(
+            descriptors, check_disk=manifest is None
+        )
+
+        failed = downloader.download(tasks)
+
+        print(f"Sources (successes, failures): {downloader.sources.health()}")
+
+        if manifest is not None:
+            manifest.commit()
+
+        return len(failed)
+
+    ###########################################################################
+    def _extract_content(self, specobjid: "int", content: "bytes") -> "bool":
+        """
+        Save wave, flux and ivar of a fits file held in memory
+
+        PARAMETERS
+            specobjid: specobjid of the spectrum
+            content: bytes of the lite fits file
+
+        OUTPUT
+            keep_file: True if the fits file fits in the disk budget
+                and has to be written to output_directory
+        """
+
+        wave_flux_ivar = RawData.wave_flux_ivar(io.BytesIO(content), specobjid)
+
+        self._save_raw_data(specobjid, wave_flux_ivar)
+
+        return self._keep_file(len(content))
+
+    ###########################################################################
+    def _extract_plate(self, key: "int", content: "bytes") -> "bool":
+        """
+        Save wave, flux and ivar of the fibers in the sample from a
+        spPlate file held in memory
+
+        PARAMETERS
+            key: position of the plate in self.plate_fibers
+            content: bytes of the spPlate file
+
+        OUTPUT
+            keep_file: True if the fits file fits in the disk budget
+                and has to be written to output_directory
+        """
+
+        specobjids, fiberids = self.plate_fibers[key]
+
+        spectra = RawData.plate_wave_flux_ivar(io.BytesIO(content), fiberids)
+
+        for specobjid, wave_flux_ivar in zip(specobjids, spectra):
+            self._save_raw_data(specobjid, wave_flux_ivar)
+
+        return self._keep_file(len(content))
+
+    ###########################################################################
+    def _save_raw_data(
+        self, specobjid: "int", wave_flux_ivar: "np.array"
+    ) -> "None":
+        """Save wave, flux and ivar as RawData does, atomically"""
+
+        save_to = f"{self.raw_data_directory}/{specobjid}.npy"
+        partial_file = f"{save_to}{PARTIAL_SUFFIX}"
+
+        # a file handle, np.save would add .npy to the partial name
+        with open(partial_file, "wb") as file:
+            np.save(file, wave_flux_ivar)
+
+        os.replace(partial_file, save_to)
+
+    ###########################################################################
+    def _keep_file(self, file_size: "int") -> "bool":
+        """
+        True if a fits file of file_size bytes fits in the disk budget,
+        its bytes are then taken from the budget
+        """
+
+        if self.disk_budget is None:
+            return True
+
+        with self.budget_lock:
+
+            if self.kept_bytes + file_size > self.disk_budget:
+                return False
+
+            self.kept_bytes += file_size
+
+        return True
+
+    ###########################################################################
+    def _split_by_ingestion(
+        self, positions: "np.array", check_disk: "bool"
+    ) -> "tuple":
+        """
+        Split files between lite spectra and spPlate files
+
+        PARAMETERS
+            positions: integer position in spectra_df of the files
+            check_disk: if True, rows with wave, flux and ivar already
+                in raw_data_directory are not taken from spPlate files
+
+        OUTPUT
+            (fiber_positions, plate_positions)
+        """
+
+        spectra_df = self.spectra_df.iloc[positions]
+
+        if self.ingestion == "plate":
+            use_plate = np.ones(positions.size, dtype=bool)
+        else:
+            use_plate = PlatePlanner().plan(spectra_df)
+
+        if check_disk is True:
+
+            saved = np.array(
+                [
+                    os.path.isfile(
+                        f"{self.raw_data_directory}/{specobjid}.npy"
+                    )
+                    for specobjid in spectra_df["specobjid"]
+                ],
+                dtype=bool,
+            )
+
+            # already extracted, skip them as lite files on disk are
+            keep = ~(use_plate & saved)
+
+            positions, use_plate = positions[keep], use_plate[keep]
+            spectra_df = spectra_df[keep]
+
+        number_plates = (
+            spectra_df[use_plate]
+            .drop_duplicates(["run2d", "plate", "mjd"])
+            .shape[0]
+        )
+
+        print(
+            f"{use_plate.sum()} spectra from {number_plates} spPlate files"
+        )
+
+        return positions[~use_plate], positions[use_plate]
+
+    ###########################################################################
+    def _download_plates(
+        self, positions: "np.array", manifest: "DownloadManifest"
+    ) -> "int":
+        """
+        Download spPlate files and extract in memory the wave, flux
+        and ivar of each row of spectra_df in them
+
+        PARAMETERS
+            positions: integer position in spectra_df of the rows to
+                take from spPlate files
+            manifest: if not None, rows are recorded as extracted or
+                failed according to their plate
+
+        OUTPUT
+            number of rows whose plate failed to download
         """
 
-        df_row_spectrum = self.spectra_df.iloc[index_spectrum]
+        spectra_df = self.spectra_df.iloc[positions]
+
+        tasks = []
+        # (specobjids, fiberids) of each plate, the key of its task
+        # is its position in the list
+        self.plate_fibers = []
+
+        for key, ((run2d, plate, mjd), plate_df) in enumerate(
+            spectra_df.groupby(["run2d", "plate", "mjd"], sort=False)
+        ):
+
+            url_path = PlatePlanner.plate_location(run2d, plate, mjd)
+
+            tasks.append(
+                (key, url_path, f"{self.output_directory}/{url_path}")
+            )
+
+            self.plate_fibers.append(
+                (
+                    plate_df["specobjid"].to_numpy(dtype=np.int64),
+                    plate_df["fiberid"].to_numpy(dtype=np.int64),
+                )
+            )
+
+        on_success, on_failure = None, None
+
+        if manifest is not None:
+
+            on_success = lambda key, size, checksum: self._mark_plate(
+                manifest.mark_extracted, key, None
+            )
+            on_failure = lambda key: self._mark_plate(
+                manifest.mark_failed, key
+            )
+
+        downloader = AsyncDownloader(
+            base_url=self.base_url,
+            concurrency=self.concurrency,
+            on_success=on_success,
+            on_failure=on_failure,
+            scheduler=self._get_scheduler(max_concurrency=self.concurrency),
+            on_content=self._extract_plate,
+            sources=self.sources,
+        )
+
+        failed = downloader.download(tasks)
+
+        if manifest is not None:
+            manifest.commit()
+
+        return sum(self.plate_fibers[key][0].size for key, _, _ in failed)
+
+    ###########################################################################
+    def _mark_plate(self, mark: "callable", key: "int", *args) -> "None":
+        """
+        Record the same outcome for every row of a plate
+
+        PARAMETERS
+            mark: method of the manifest, e.g. mark_failed
+            key: position of the plate in self.plate_fibers
+            args: arguments of mark after specobjid
+        """
+
+        for specobjid in self.plate_fibers[key][0]:
+            mark(specobjid, *args)
+
+    ###########################################################################
+    def _download_tasks(
+        self, descriptors: "np.array", check_disk: "bool"
+    ) -> "list":
+        """
+        Tasks for the async engine
+
+        PARAMETERS
+            descriptors: structured array with specobjid, url_path
+                and destination of the files
+            check_disk: if True, files already on disk are skipped
+
+        OUTPUT
+            tasks: list of (specobjid, url_path, destination) tuples
+        """
+
+        tasks = []
+
+        for specobjid, url_path, destination in descriptors:
+
+            destination = destination.decode()
+
+            if check_disk and self._file_exits(destination, exit=False):
+                continue
+
+            tasks.append((specobjid, url_path.decode(), destination))
+
+        return tasks
+
+    ###########################################################################
+    def _file_descriptors(self, positions: "np.array") -> "np.array":
+        """
+        Compact description of each file to download, computed once in
+        the parent process. Paths are ASCII, hence they are stored as
+        bytes to keep the array small
+
+        PARAMETERS
+            positions: integer position in spectra_df of the files
+
+        OUTPUT
+            descriptors: structured array with fields
+                specobjid: int64, position in spectra_df if the data
+                    frame has no specobjid column
+                url_path: path of the file in the server
+                destination: path of the file in local disk
+        """
+
+        spectra_df = self.spectra_df.iloc[positions]
+
+        if "specobjid" in spectra_df.columns:
+            specobjids = spectra_df["specobjid"].to_numpy(dtype=np.int64)
+        else:
+            specobjids = positions
+
+        url_paths = spectra_df["url_path"].to_numpy().astype(np.bytes_)
+        destinations = np.char.add(
+            f"{self.output_directory}/".encode(), url_paths
+        )
+
+        descriptors = np.empty(
+            positions.size,
+            dtype=[
+                ("specobjid", np.int64),
+                ("url_path", url_paths.dtype),
+                ("destination", destinations.dtype),
+            ],
+        )
+
+        descriptors["specobjid"] = specobjids
+        descriptors["url_path"] = url_paths
+        descriptors["destination"] = destinations
 
-        [plate, mjd, fiberid, run2d] = self._file_identifier(df_row_spectrum)
+        return descriptors
+
+    ###########################################################################
+    @staticmethod
+    def _get_file(
+        index: "int",
+        url_path: "str",
+        destination: "str",
+        sources: "SourceList",
+    ) -> "tuple":
+        """
+        Retrieve a single file from the science archive server.
+        A single attempt is made, retries are up to the scheduler
+        in the parent process
+
+        PARAMETERS
+            index: position of the file in the array of descriptors
+            url_path: path of the file in the server
+            destination: path of the file in local disk
+            sources: local mirrors and HTTP servers, tried in order
 
-        file_name = f"spec-{plate}-{mjd}-{fiberid}.fits"
+        RETURN
+            (index, file_size, checksum, retryable):
+                file_size is None if the download fails, checksum is
+                the md5 hex digest of the file or None if it was
+                already on disk and retryable is False if the error
+                is permanent, e.g. 404
+        """
 
         # Try & Except a failed Download
 
         try:
-            self._query_file(file_name, run2d, plate)
+            file_size, checksum = DownloadData._query_file(
+                sources, url_path, destination
+            )
 
-            return 0
+            return index, file_size, checksum, False
 
         except Exception as e:
 
-            print(f"Failed : {file_name}. run2d:{run2d}")
+            print(f"Failed : {url_path}")
             print(f"{e}")
 
-            return 1
+            retryable = RetryScheduler.is_retryable(e)
+
+            return index, None, None, retryable
 
     ###########################################################################
+    @staticmethod
     def _query_file(
-        self, file_name: "str", run2d: "str", plate: "str"
-    ) -> "None":
-
-        # sas: science archive server
-        sas_location = (
-            f"sas/dr16/sdss/spectro/redux/{run2d}/spectra/lite/{plate}"
-        )
+        sources: "SourceList", url_path: "str", destination: "str"
+    ) -> "tuple":
+        """
+        Get url_path to destination unless it is already there
 
-        save_to = f"{self.output_directory}/{sas_location}"
+        PARAMETERS
+            sources: local mirrors and HTTP servers, tried in order
+            url_path: path of the file in the server
+            destination: path of the file in local disk
 
-        file_url = f"https://data.sdss.org/{sas_location}/{file_name}"
+        OUTPUT
+            (file_size, checksum): checksum is None if the file was
+                already on disk
+        """
 
-        self._check_directory(save_to, exit=False)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
 
-        file_exists = self._file_exits(
-            file_location=f"{save_to}/{file_name}", exit=False
-        )
+        file_name = os.path.basename(destination)
 
-        if not file_exists:
+        if not os.path.isfile(destination):
 
             with counter.get_lock():
                 counter.value += 1
                 print(f"[{counter.value}] Download {file_name}", end="\r")
 
-            urllib.request.urlretrieve(file_url, f"{save_to}/{file_name}")
-
-            file_size = os.path.getsize(f"{save_to}/{file_name}")
-
-            self._retry_download_if_small_size(
-                file_size, file_name, save_to, file_url
+            return DownloadData._query_sources(
+                sources, url_path, destination
             )
 
-        else:
-            print(f"{file_name} already downloaded!!")
+        print(f"{file_name} already downloaded!!")
+
+        return os.path.getsize(destination), None
 
     ###########################################################################
-    def _retry_download_if_small_size(
-        self,
-        file_size: "float",
-        file_name: "str",
-        save_to: "str",
-        file_url: "str",
-    ) -> "None || exception":
+    @staticmethod
+    def _query_sources(
+        sources: "SourceList", url_path: "str", destination: "str"
+    ) -> "tuple":
+        """
+        Try sources in order until one of them has the file. A source
+        that fails loses health, a source that does not have the file
+        does not
 
+        PARAMETERS
+            sources: local mirrors and HTTP servers
+            url_path: path of the file in the server
+            destination: path of the file in local disk
+
+        OUTPUT
+            (file_size, checksum): checksum is None for files from
+                local mirrors
         """
-        Check the size of downloaded file. If the size is smaller than
-        60 Kbs, it trys to download it again (at least 10 times), otherwise
-        it will raise an exception
+
+        errors = []
+
+        for source in sources.candidates():
+
+            try:
+
+                if source.is_local is True:
+
+                    file_size = source.link(url_path, destination)
+                    source.record(success=True)
+
+                    return file_size, None
+
+                partial_file = f"{destination}{PARTIAL_SUFFIX}"
+
+                checksum = DownloadData._retrieve_file(
+                    source.url(url_path), partial_file
+                )
+
+            except Exception as e:
+
+                errors.append(e)
+
+                if sources.is_missing(e) is False:
+                    source.record(success=False)
+
+                continue
+
+            source.record(success=True)
+
+            # atomic: the final location only ever holds complete files
+            os.replace(partial_file, destination)
+
+            return os.path.getsize(destination), checksum
+
+        # an error other than a missing file is worth another round
+        for error in errors:
+
+            if sources.is_missing(error) is False:
+                raise error
+
+        raise errors[-1]
+
+    ###########################################################################
+    @staticmethod
+    def _retrieve_file(file_url: "str", partial_file: "str") -> "str":
+        """
+        Download file_url into partial_file. If partial_file exists,
+        e.g. from an interrupted run, only the missing bytes are
+        requested with an HTTP Range header. The FITS structure and
+        checksums are verified in the same pass, partial_file is
+        removed if the verification fails
+
+        PARAMETERS
+            file_url: url of the file in the science archive server
+            partial_file: temporary location of the file
+
+        OUTPUT
+            checksum: md5 hex digest of the file
         """
 
-        j = 0
+        try:
+            return DownloadData._stream_file(file_url, partial_file)
+
+        except FitsIntegrityError as e:
+
+            file_name = os.path.basename(partial_file)
+            print(f"{file_name}: {e}... Removing file!!")
+
+            # corrupt bytes, a new attempt has to start from scratch
+            if os.path.isfile(partial_file):
+                os.remove(partial_file)
+
+            raise
+
+    ###########################################################################
+    @staticmethod
+    def _stream_file(file_url: "str", partial_file: "str") -> "str":
+        """Write file_url to partial_file, see _retrieve_file"""
+
+        resume_from = 0
+        md5 = hashlib.md5()
+        verifier = FitsStreamVerifier()
+
+        if os.path.isfile(partial_file):
+            resume_from = os.path.getsize(partial_file)
+
+        request = urllib.request.Request(file_url)
+
+        if resume_from > 0:
+
+            request.add_header("Range", f"bytes={resume_from}-")
+
+            with open(partial_file, "rb") as file:
+
+                for chunk in iter(lambda: file.read(2**16), b""):
+                    md5.update(chunk)
+                    verifier.update(chunk)
+
+        try:
+            response = urllib.request.urlopen(request)
+
+        except urllib.error.HTTPError as e:
+
+            # 416: range not satisfiable, the file might be complete
+            content_range = e.headers.get("Content-Range", "")
+            file_size = content_range.rpartition("/")[-1]
+
+            if e.code == 416 and file_size == str(resume_from):
+
+                verifier.finish()
+
+                return md5.hexdigest()
+
+            if e.code == 416:
+                os.remove(partial_file)
+
+            raise
+
+        with response:
+
+            # the server ignored the Range header, start from scratch
+            mode = "ab" if response.status == 206 else "wb"
+
+            if response.status != 206:
+                md5 = hashlib.md5()
+                verifier = FitsStreamVerifier()
 
-        while j < 10 and (file_size < 60000):
+            with open(partial_file, mode) as file:
 
-            os.remove(f"{save_to}/{file_name}")
-            urllib.request.urlretrieve(file_url, f"{save_to}/{file_name}")
-            j += 1
-            time.sleep(1)
+                for chunk in iter(lambda: response.read(2**16), b""):
+                    file.write(chunk)
+                    md5.update(chunk)
+                    verifier.update(chunk)
 
-        file_size = os.path.getsize(f"{save_to}/{file_name}")
+        verifier.finish()
 
-        if file_size < 60000:
-            print(f"Size of {file_name}: {file_size}... Removing file!!")
-            os.remove(f"{save_to}/{file_name}")
-            raise Exception("Spectra wasn't found")
+        return md5.hexdigest()
 
     ###########################################################################
     def _file_identifier(self, df_row_spectrum):
@@ -199,7 +1024,7 @@ class DownloadData:
         if not os.path.exists(directory):
 
             if exit:
-                print(f"Directory {diretory} NOT FOUND")
+                print(f"Directory {directory} NOT FOUND")
                 print("Code cannot execute")
                 sys.exit()
 
@@ -0,0 +1,279 @@
+"""
+Verify the integrity of a FITS file while its bytes stream in, in the
+same pass that writes them to disk. The structure of each HDU is
+checked (header blocks, END card and size of the data unit from
+BITPIX, NAXISn, PCOUNT and GCOUNT) as well as DATASUM and CHECKSUM
+keywords when they are present
+"""
+import numpy as np
+
+# size in bytes of FITS blocks, headers and data units are padded to it
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+
+
+###############################################################################
+class FitsIntegrityError(Exception):
+    """Raised when the bytes of a file are not a complete FITS file"""
+
+
+###############################################################################
+def ones_complement_sum(data: bytes, initial: int = 0) -> int:
+    """
+    32 bit ones' complement sum of big endian words, as defined by
+    the FITS checksum convention
+
+    PARAMETERS
+        data: bytes with a length multiple of 4
+        initial: sum of previous bytes
+
+    OUTPUT
+        checksum: 32 bit ones' complement sum
+    """
+
+    words = np.frombuffer(data, dtype=">u4")
+
+    checksum = initial + int(words.sum(dtype=np.uint64))
+
+    # end-around carry
+    while checksum >> 32:
+        checksum = (checksum & 0xFFFFFFFF) + (checksum >> 32)
+
+    return checksum
+
+
+###############################################################################
+class FitsStreamVerifier:
+    """
+    Incremental verification of a FITS file. Feed it with update as
+    bytes arrive and call finish once the transfer is done
+    """
+
+    def __init__(self, minimum_hdus: int = 1):
+        """
+        PARAMETERS
+            minimum_hdus: number of HDUs the file must have, e.g. 3 for
+                primary, COADD and SPALL HDUs of lite spectra
+        """
+
+        self.minimum_hdus = minimum_hdus
+
+        self.number_hdus = 0
+        self.number_bytes = 0
+
+        # bytes of the header being read
+        self.header = bytearray()
+        self.header_checksum = 0
+
+        # bytes still expected in the data unit being read
+        self.data_left = 0
+        self.data_checksum = 0
+        # words split between chunks of the data unit
+        self.data_remainder = b""
+
+        self.datasum = None
+        self.checksum = None
+
+    ###########################################################################
+    def update(self, chunk: bytes) -> None:
+        """
+        Verify the next bytes of the file
+
+        PARAMETERS
+            chunk: bytes in the order they are received
+        """
+
+        self.number_bytes += len(chunk)
+        view = memoryview(chunk)
+
+        while len(view) > 0:
+
+            if self.data_left > 0:
+
+                number_bytes = min(self.data_left, len(view))
+                self._update_data(view[:number_bytes])
+
+                view = view[number_bytes:]
+
+                continue
+
+            # header: consume one block at a time
+            number_bytes = min(BLOCK_SIZE - len(self.header), len(view))
+            self.header += view[:number_bytes]
+
+            view = view[number_bytes:]
+
+            if len(self.header) % BLOCK_SIZE == 0:
+                self._read_header_block()
+
+    ###########################################################################
+    def finish(self) -> None:
+        """
+        Check that the file ended at the end of an HDU
+
+        Raises FitsIntegrityError otherwise
+        """
+
+        if self.data_left > 0 or len(self.header) > 0:
+            raise FitsIntegrityError(
+                f"Truncated FITS file: {self.number_bytes} bytes"
+            )
+
+        if self.number_hdus < self.minimum_hdus:
+            raise FitsIntegrityError(
+                f"FITS file with {self.number_hdus} HDUs, "
+                f"expected at least {self.minimum_hdus}"
+            )
+
+    ###########################################################################
+    def _read_header_block(self) -> None:
+        """Parse the header once a block with the END card arrives"""
+
+        block = self.header[-BLOCK_SIZE:]
+
+        if len(self.header) == BLOCK_SIZE:
+            self._check_first_card(bytes(block[:CARD_SIZE]))
+
+        self.header_checksum = ones_complement_sum(
+            bytes(block), self.header_checksum
+        )
+
+        cards = [
+            bytes(block[i : i + CARD_SIZE]).decode("ascii", "replace")
+            for i in range(0, BLOCK_SIZE, CARD_SIZE)
+        ]
+
+        if not any(card.rstrip() == "END" for card in cards):
+            return
+
+        keywords = self._parse_cards(self.header)
+
+        self.number_hdus += 1
+        self.header = bytearray()
+
+        self.datasum = keywords.get("DATASUM")
+        self.checksum = keywords.get("CHECKSUM")
+
+        data_size = self._data_size(keywords)
+        # data units are padded to a multiple of BLOCK_SIZE
+        self.data_left = -(-data_size // BLOCK_SIZE) * BLOCK_SIZE
+
+        self.data_checksum = 0
+        self.data_remainder = b""
+
+        if self.data_left == 0:
+            self._check_sums()
+
+    ###########################################################################
+    def _check_first_card(self, card: bytes) -> None:
+        """The first card is SIMPLE = T or XTENSION for extensions"""
+
+        keyword = card[:8].decode("ascii", "replace").strip()
+
+        if self.number_hdus == 0 and keyword != "SIMPLE":
+            raise FitsIntegrityError("Not a FITS file, SIMPLE card missing")
+
+        if self.number_hdus > 0 and keyword != "XTENSION":
+            raise FitsIntegrityError(
+                f"Unexpected bytes after HDU {self.number_hdus - 1}"
+            )
+
+    ###########################################################################
+    def _update_data(self, data: memoryview) -> None:
+        """Checksum of the data unit, words may be split among chunks"""
+
+        self.data_left -= len(data)
+
+        data = self.data_remainder + bytes(data)
+        number_words = len(data) // 4
+
+        self.data_checksum = ones_complement_sum(
+            data[: 4 * number_words], self.data_checksum
+        )
+        self.data_remainder = data[4 * number_words :]
+
+        if self.data_left == 0:
+            self._check_sums()
+
+    ###########################################################################
+    def _check_sums(self) -> None:
+        """Compare DATASUM and CHECKSUM keywords with the bytes received"""
+
+        if self.datasum not in (None, ""):
+
+            if int(self.datasum) != self.data_checksum:
+                raise FitsIntegrityError(
+                    f"DATASUM mismatch in HDU {self.number_hdus - 1}"
+                )
+
+        if self.checksum not in (None, ""):
+
+            hdu_checksum = ones_complement_sum(
+                b"", self.header_checksum + self.data_checksum
+            )
+
+            # a valid CHECKSUM makes the sum of the HDU negative zero
+            if hdu_checksum != 0xFFFFFFFF:
+                raise FitsIntegrityError(
+                    f"CHECKSUM mismatch in HDU {self.number_hdus - 1}"
+                )
+
+        self.header_checksum = 0
+
+    ###########################################################################
+    @staticmethod
+    def _parse_cards(header: bytearray) -> dict:
+        """
+        Keywords needed to verify the HDU
+
+        OUTPUT
+            keywords: dictionary with values as strings
+        """
+
+        keywords = {}
+
+        for i in range(0, len(header), CARD_SIZE):
+
+            card = bytes(header[i : i + CARD_SIZE]).decode("ascii", "replace")
+
+            if card[8:10] != "= ":
+                continue
+
+            keyword = card[:8].strip()
+            # remove comment and quotes of string values
+            value = card[10:].split("/")[0].strip().strip("'").strip()
+
+            keywords[keyword] = value
+
+        return keywords
+
+    ###########################################################################
+    @staticmethod
+    def _data_size(keywords: dict) -> int:
+        """
+        Size in bytes of the data unit without padding
+
+        PARAMETERS
+            keywords: output of _parse_cards
+        """
+
+        try:
+
+            bitpix = int(keywords["BITPIX"])
+            naxis = int(keywords["NAXIS"])
+
+            if naxis == 0:
+                return 0
+
+            size = 1
+
+            for axis in range(1, naxis + 1):
+                size *= int(keywords[f"NAXIS{axis}"])
+
+            pcount = int(keywords.get("PCOUNT", 0))
+            gcount = int(keywords.get("GCOUNT", 1))
+
+        except (KeyError, ValueError) as e:
+            raise FitsIntegrityError(f"Malformed FITS header: {e}")
+
+        return abs(bitpix) // 8 * gcount * (pcount + size)
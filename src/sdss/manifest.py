@@ -0,0 +1,284 @@
+"""
+Persistent record of downloaded files. The manifest is a SQLite
+database keyed by specobjid, hence a rerun can plan the remaining
+work with a single query instead of checking the file system
+"""
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+# number of updates to hold in memory before writing them to disk
+COMMIT_EVERY = 1000
+
+# status of a file in the manifest
+PENDING = "pending"
+DOWNLOADED = "downloaded"
+# wave, flux and ivar saved, the fits file may have been discarded
+EXTRACTED = "extracted"
+FAILED = "failed"
+
+
+###############################################################################
+class DownloadManifest:
+    """Track status, size, checksum and attempts of each download"""
+
+    def __init__(self, location: str):
+        """
+        PARAMETERS
+            location: location of the SQLite database, it is created
+                if it does not exist, e.g. /home/john/manifest.db
+        """
+
+        self.location = location
+        self.number_uncommitted = 0
+
+        self.connection = sqlite3.connect(location)
+
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "specobjid INTEGER PRIMARY KEY, "
+            "file_name TEXT NOT NULL, "
+            "status TEXT NOT NULL, "
+            "size INTEGER, "
+            "checksum TEXT, "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "updated REAL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS status_index ON files (status)"
+        )
+        self.connection.commit()
+
+    ###########################################################################
+    def close(self) -> None:
+        """Commit pending changes and close the database"""
+
+        self.connection.commit()
+        self.connection.close()
+
+    ###########################################################################
+    def downloaded_specobjids(self) -> np.array:
+        """
+        Single query for all files already downloaded or extracted
+
+        OUTPUT
+            specobjids: array with specobjid of downloaded files
+        """
+
+        rows = self.connection.execute(
+            "SELECT specobjid FROM files WHERE status IN (?, ?)",
+            (DOWNLOADED, EXTRACTED),
+        ).fetchall()
+
+        specobjids = np.array(rows, dtype=np.int64).reshape(-1)
+
+        return specobjids
+
+    ###########################################################################
+    def pending_mask(self, specobjids: np.array) -> np.array:
+        """
+        PARAMETERS
+            specobjids: specobjid of all files in the sample
+
+        OUTPUT
+            mask: True for files that still need to be downloaded
+        """
+
+        downloaded = self.downloaded_specobjids()
+
+        return ~np.isin(np.asarray(specobjids, dtype=np.int64), downloaded)
+
+    ###########################################################################
+    def register(self, specobjids: np.array, file_names: list) -> None:
+        """
+        Add files to the manifest as pending, files already in the
+        manifest keep their status
+
+        PARAMETERS
+            specobjids: specobjid of each file
+            file_names: name of each file, e.g. spec-0266-51602-0001.fits
+        """
+
+        rows = zip((int(i) for i in specobjids), file_names)
+
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO files (specobjid, file_name, status) "
+            f"VALUES (?, ?, '{PENDING}')",
+            rows,
+        )
+        self.connection.commit()
+
+    ###########################################################################
+    def mark_downloaded(
+        self, specobjid: int, size: int, checksum: str = None
+    ) -> None:
+        """
+        Record a successful download
+
+        PARAMETERS
+            specobjid: specobjid of the file
+            size: size of the file in bytes
+            checksum: md5 hex digest of the file
+        """
+
+        self._mark_done(specobjid, DOWNLOADED, size, checksum)
+
+    ###########################################################################
+    def mark_extracted(
+        self, specobjid: int, size: int, checksum: str = None
+    ) -> None:
+        """
+        Record a file downloaded and extracted in memory
+
+        PARAMETERS
+            specobjid: specobjid of the file
+            size: size of the file in bytes
+            checksum: md5 hex digest of the file
+        """
+
+        self._mark_done(specobjid, EXTRACTED, size, checksum)
+
+    ###########################################################################
+    def _mark_done(
+        self, specobjid: int, status: str, size: int, checksum: str
+    ) -> None:
+        """Record a successful download with status"""
+
+        self.connection.execute(
+            "UPDATE files SET status = ?, size = ?, checksum = ?, "
+            "attempts = attempts + 1, updated = ? WHERE specobjid = ?",
+            (status, size, checksum, time.time(), int(specobjid)),
+        )
+
+        self._count_update()
+
+    ###########################################################################
+    def mark_failed(self, specobjid: int) -> None:
+        """
+        Record a failed download
+
+        PARAMETERS
+            specobjid: specobjid of the file
+        """
+
+        self.connection.execute(
+            "UPDATE files SET status = ?, size = NULL, checksum = NULL, "
+            "attempts = attempts + 1, updated = ? WHERE specobjid = ?",
+            (FAILED, time.time(), int(specobjid)),
+        )
+
+        self._count_update()
+
+    ###########################################################################
+    def commit(self) -> None:
+        """Write changes to disk"""
+
+        self.connection.commit()
+        self.number_uncommitted = 0
+
+    ###########################################################################
+    def _count_update(self) -> None:
+        """Commit every COMMIT_EVERY updates to bound lost work on a crash"""
+
+        self.number_uncommitted += 1
+
+        if self.number_uncommitted >= COMMIT_EVERY:
+            self.commit()
+
+    ###########################################################################
+    def status_counts(self) -> dict:
+        """
+        OUTPUT
+            counts: number of files per status, e.g.
+                {"downloaded": 10, "failed": 1, "pending": 5}
+        """
+
+        rows = self.connection.execute(
+            "SELECT status, COUNT(*) FROM files GROUP BY status"
+        ).fetchall()
+
+        counts = {PENDING: 0, DOWNLOADED: 0, EXTRACTED: 0, FAILED: 0}
+        counts.update(dict(rows))
+
+        return counts
+
+    ###########################################################################
+    def reconcile(
+        self,
+        specobjids: np.array,
+        locations: list,
+        extracted_specobjids: np.array = None,
+    ) -> dict:
+        """
+        Rebuild the manifest from a scan of the directory holding
+        the files. Existing files are set as downloaded with their
+        size, missing files are set as pending. Checksums are lost
+        since computing them would require reading every file
+
+        PARAMETERS
+            specobjids: specobjid of each file
+            locations: location of each file, e.g.
+                /home/john/spectra/sas/dr16/.../spec-0266-51602-0001.fits
+            extracted_specobjids: specobjid of spectra with wave, flux
+                and ivar on disk, missing files among them are set as
+                extracted instead of pending
+
+        OUTPUT
+            counts: number of files per status after reconciliation
+        """
+
+        sizes = {}
+
+        for directory in {os.path.dirname(i) for i in locations}:
+
+            if os.path.isdir(directory) is False:
+                continue
+
+            with os.scandir(directory) as entries:
+
+                for entry in entries:
+
+                    if entry.is_file():
+                        sizes[entry.path] = entry.stat().st_size
+
+        if extracted_specobjids is None:
+            extracted_specobjids = []
+
+        extracted_specobjids = {int(i) for i in extracted_specobjids}
+
+        now = time.time()
+        rows = []
+
+        for specobjid, location in zip(specobjids, locations):
+
+            size = sizes.get(location)
+
+            if size is not None:
+                status = DOWNLOADED
+            elif int(specobjid) in extracted_specobjids:
+                status = EXTRACTED
+            else:
+                status = PENDING
+
+            rows.append(
+                (
+                    int(specobjid),
+                    os.path.basename(location),
+                    status,
+                    size,
+                    now,
+                )
+            )
+
+        self.connection.execute("DELETE FROM files")
+        self.connection.executemany(
+            "INSERT INTO files "
+            "(specobjid, file_name, status, size, updated) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        self.connection.commit()
+
+        return self.status_counts()
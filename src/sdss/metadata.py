@@ -1,9 +1,13 @@
 """Module to handle meta data from SDSS spectra"""
 import urllib.request
 
-import numpy as np
 import pandas as pd
 
+from sdss.zwarning import ZWarningFlags
+
+# columns added by MetaData.with_sas_paths
+SAS_PATH_COLUMNS = ("spectrum_name", "sas_directory", "url_path")
+
 
 class MetaData:
     """Deal with medata data"""
@@ -16,39 +20,16 @@ class MetaData:
 
         """
         Takes the interger representing the z warning and converts it to
-            the string indicating the meaning of the warning:
+            the string indicating the meaning of the warning. For whole
+            columns use sdss.zwarning.ZWarningFlags
 
         PARAMETERS
-            warning_flag: value between 0 and 9
+            warning_flag: zWarning value, bits 0 to 9 have a meaning
         OUTPUT
             warning_meaning: list of strings  with the meaning of warning
         """
 
-        map_warning = {
-            "0": "good",
-            "1": "LITTLE_COVERAGE",
-            "2": "SMALL_DELTA_CHI2",
-            "3": "NEGATIVE_MODEL",
-            "4": "MANY_OUTLIERS",
-            "5": "Z_FITLIMIT",
-            "6": "NEGATIVE_EMISSION",
-            "7": "UNPLUGGED",
-            "8": "BAD_TARGET",
-            "9": "NODATA",
-        }
-
-        if warning_flag == 0:
-            return []
-
-        warning_flag = list(np.binary_repr(warning_flag, 9))
-
-        warnings = [
-            int(val) * (8 - idx) for idx, val in enumerate(warning_flag)
-        ]
-
-        warning_meaning = [map_warning[str(i)] for i in warnings if i != 0]
-
-        return warning_meaning
+        return ZWarningFlags.meaning(warning_flag)
 
     ###########################################################################
     @staticmethod
@@ -133,6 +114,74 @@ class MetaData:
 
         return galaxy_url
 
+    ###########################################################################
+    @staticmethod
+    def sas_paths(spectra_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Vectorized version of get_file_location_sas for all rows of
+        spectra_df at once. If spectra_df already has the columns,
+        e.g. from a previous call saved with the meta data, they are
+        returned instead of formatted again
+
+        PARAMETERS
+            spectra_df: contains at least the columns
+                plate, mjd, fiberid, run2d
+
+        OUTPUT
+            paths_df: data frame with the index of spectra_df and
+                columns SAS_PATH_COLUMNS:
+                spectrum_name: f'spec-{plate}-{mjd}-{fiberid}'
+                sas_directory: location of the spectrum fits file
+                    in sas directory
+                url_path: f'{sas_directory}/{spectrum_name}.fits',
+                    relative to the url of the server or mirror
+        """
+
+        if set(SAS_PATH_COLUMNS).issubset(spectra_df.columns):
+            return spectra_df[list(SAS_PATH_COLUMNS)]
+
+        plate = spectra_df["plate"].astype(str).str.zfill(4)
+        mjd = spectra_df["mjd"].astype(str)
+        fiberid = spectra_df["fiberid"].astype(str).str.zfill(4)
+        run2d = spectra_df["run2d"].astype(str)
+
+        spectrum_name = "spec-" + plate + "-" + mjd + "-" + fiberid
+
+        sas_directory = (
+            "sas/dr16/sdss/spectro/redux/" + run2d + "/spectra/lite/" + plate
+        )
+
+        url_path = sas_directory + "/" + spectrum_name + ".fits"
+
+        paths_df = pd.DataFrame(
+            {
+                "spectrum_name": spectrum_name,
+                "sas_directory": sas_directory,
+                "url_path": url_path,
+            },
+            index=spectra_df.index,
+        )
+
+        return paths_df
+
+    ###########################################################################
+    @staticmethod
+    def with_sas_paths(spectra_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        PARAMETERS
+            spectra_df: contains at least the columns
+                plate, mjd, fiberid, run2d
+
+        OUTPUT
+            spectra_df: copy of spectra_df with SAS_PATH_COLUMNS, or
+                spectra_df itself if it already has them
+        """
+
+        if set(SAS_PATH_COLUMNS).issubset(spectra_df.columns):
+            return spectra_df
+
+        return spectra_df.join(MetaData.sas_paths(spectra_df))
+
     ###########################################################################
     @staticmethod
     def get_file_location_sas(file_row: pd.Series) -> list:
@@ -147,6 +196,10 @@ class MetaData:
                 spectrum_name: f'spec-{plate}-{mjd}-{fiberid}'
         """
 
+        # paths already computed by with_sas_paths
+        if "sas_directory" in file_row.index:
+            return [file_row["sas_directory"], file_row["spectrum_name"]]
+
         [plate, mjd, fiberid, run2d] = MetaData.galaxy_identifiers(file_row)
 
         spectrum_name = f"spec-{plate}-{mjd}-{fiberid}"
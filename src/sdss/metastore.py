@@ -0,0 +1,247 @@
+"""
+Columnar store of meta data: a directory with a Feather file per
+column and a schema with the dtype of each column. Selected columns
+are loaded without reading the others and a new column is appended
+without rewriting the existing ones
+"""
+import json
+import os
+
+import pandas as pd
+import pyarrow.feather as feather
+
+# every column is stored in the order of this index
+INDEX_COLUMN = "specobjid"
+SCHEMA_FILE = "schema.json"
+
+# dtypes of the columns of the SpecObj query, others keep their dtype
+META_DATA_DTYPES = {
+    "specobjid": "int64",
+    "mjd": "int32",
+    "plate": "int32",
+    "fiberid": "int16",
+    "run2d": "category",
+    "ra": "float64",
+    "dec": "float64",
+    "z": "float32",
+    "zErr": "float32",
+    "zWarning": "int32",
+    "class": "category",
+    "subClass": "category",
+    "z_noqso": "float32",
+    "zErr_noqso": "float32",
+    "zWarning_noqso": "int32",
+    "snMedian": "float32",
+    "ebv": "float32",
+}
+
+
+###############################################################################
+def load_meta_data(location: str, columns: list = None) -> pd.DataFrame:
+    """
+    Load meta data from a MetaDataStore directory or from a csv file,
+    e.g. the csv.gz of the SpecObj query
+
+    PARAMETERS
+        location: location of the store or of the csv file
+        columns: columns to load besides specobjid, if None, all
+            columns are loaded
+
+    OUTPUT
+        meta_data_df: data frame with specobjid as index
+    """
+
+    if MetaDataStore.is_store(location):
+        return MetaDataStore(location).read(columns)
+
+    usecols = None
+
+    if columns is not None:
+        usecols = [INDEX_COLUMN] + list(columns)
+
+    return pd.read_csv(location, index_col=INDEX_COLUMN, usecols=usecols)
+
+
+###############################################################################
+class MetaDataStore:
+    """Typed meta data with a Feather file per column"""
+
+    def __init__(self, directory: str):
+        """
+        PARAMETERS
+            directory: location of the store, e.g.
+                /home/john/spectra/0_01_z_0_5_4_0_snr_inf
+        """
+
+        self.directory = directory
+
+    ###########################################################################
+    @staticmethod
+    def is_store(location: str) -> bool:
+        """True if location is a directory with a schema file"""
+
+        return os.path.isfile(f"{location}/{SCHEMA_FILE}")
+
+    ###########################################################################
+    @property
+    def schema(self) -> dict:
+        """
+        OUTPUT
+            schema: number of rows and dtype of each column, e.g.
+                {"number_rows": 10, "columns": {"z": "float32"}}
+        """
+
+        with open(f"{self.directory}/{SCHEMA_FILE}", "r") as file:
+            return json.load(file)
+
+    ###########################################################################
+    @property
+    def columns(self) -> list:
+        """Columns in the store besides specobjid"""
+
+        return list(self.schema["columns"])
+
+    ###########################################################################
+    def write(self, meta_data_df: pd.DataFrame, dtypes: dict = None) -> None:
+        """
+        Create the store from a data frame, replacing an existing one
+
+        PARAMETERS
+            meta_data_df: data frame with specobjid as index
+            dtypes: dtype of each column, if None META_DATA_DTYPES
+        """
+
+        if dtypes is None:
+            dtypes = META_DATA_DTYPES
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        index = pd.Series(meta_data_df.index, name=INDEX_COLUMN)
+        self._write_column(index.astype(dtypes.get(INDEX_COLUMN, "int64")))
+
+        schema = {"number_rows": int(index.size), "columns": {}}
+
+        for name in meta_data_df.columns:
+
+            column = meta_data_df[name].reset_index(drop=True)
+            column = column.astype(dtypes.get(name, column.dtype))
+
+            self._write_column(column)
+            schema["columns"][name] = str(column.dtype)
+
+        self._write_schema(schema)
+
+    ###########################################################################
+    @staticmethod
+    def from_csv(csv_location: str, directory: str) -> "MetaDataStore":
+        """
+        Convert a csv file with meta data into a store
+
+        PARAMETERS
+            csv_location: location of the csv file with a specobjid
+                column, e.g. the csv.gz of the SpecObj query
+            directory: location of the store
+
+        OUTPUT
+            store: MetaDataStore at directory
+        """
+
+        store = MetaDataStore(directory)
+        store.write(pd.read_csv(csv_location, index_col=INDEX_COLUMN))
+
+        return store
+
+    ###########################################################################
+    def read(self, columns: list = None) -> pd.DataFrame:
+        """
+        PARAMETERS
+            columns: columns to load besides specobjid, if None, all
+                columns are loaded
+
+        OUTPUT
+            meta_data_df: data frame with specobjid as index
+        """
+
+        if columns is None:
+            columns = self.columns
+
+        missing = set(columns) - set(self.columns)
+
+        if len(missing) > 0:
+            raise KeyError(f"Columns not in {self.directory}: {missing}")
+
+        index = pd.Index(self._read_column(INDEX_COLUMN), name=INDEX_COLUMN)
+
+        meta_data_df = pd.DataFrame(
+            {name: self._read_column(name).values for name in columns},
+            index=index,
+        )
+
+        return meta_data_df
+
+    ###########################################################################
+    def append_column(
+        self, name: str, values: "pd.Series | np.array", dtype: str = None
+    ) -> None:
+        """
+        Add a column or replace it, other columns are not rewritten
+
+        PARAMETERS
+            name: name of the column, e.g. ebv
+            values: a value per row, in the order of the store. If
+                values is a series, it is aligned on specobjid
+            dtype: if None, META_DATA_DTYPES or the dtype of values
+        """
+
+        schema = self.schema
+
+        if isinstance(values, pd.Series):
+            values = values.reindex(self._read_column(INDEX_COLUMN).values)
+
+        column = pd.Series(values, name=name).reset_index(drop=True)
+
+        if column.size != schema["number_rows"]:
+            raise ValueError(
+                f"{name} has {column.size} values, "
+                f"the store has {schema['number_rows']} rows"
+            )
+
+        if dtype is None:
+            dtype = META_DATA_DTYPES.get(name, column.dtype)
+
+        column = column.astype(dtype)
+
+        self._write_column(column)
+
+        schema["columns"][name] = str(column.dtype)
+        self._write_schema(schema)
+
+    ###########################################################################
+    def _read_column(self, name: str) -> pd.Series:
+        """Load a single column"""
+
+        column_df = feather.read_feather(
+            f"{self.directory}/{name}.feather", memory_map=True
+        )
+
+        return column_df[name]
+
+    ###########################################################################
+    def _write_column(self, column: pd.Series) -> None:
+        """Save a single column atomically"""
+
+        save_to = f"{self.directory}/{column.name}.feather"
+
+        feather.write_feather(column.to_frame(), f"{save_to}.part")
+        os.replace(f"{save_to}.part", save_to)
+
+    ###########################################################################
+    def _write_schema(self, schema: dict) -> None:
+        """Save the schema last, a column is in the store once listed"""
+
+        save_to = f"{self.directory}/{SCHEMA_FILE}"
+
+        with open(f"{save_to}.part", "w") as file:
+            json.dump(schema, file, indent=4)
+
+        os.replace(f"{save_to}.part", save_to)
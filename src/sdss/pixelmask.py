@@ -0,0 +1,82 @@
+"""
+Bits of the and_mask and or_mask columns of SDSS spectra, the
+SPPIXMASK bitmask. A pixel with a bit set in and_mask was flagged in
+every exposure of the spectrum
+"""
+import numpy as np
+
+# bits of SPPIXMASK, see the SDSS bitmask documentation
+PIXEL_MASK_BITS = {
+    "NOPLUG": 0,
+    "BADTRACE": 1,
+    "BADFLAT": 2,
+    "BADARC": 3,
+    "MANYBADCOLUMNS": 4,
+    "MANYREJECTED": 5,
+    "LARGESHIFT": 6,
+    "BADSKYFIBER": 7,
+    "NEARWHOPPER": 8,
+    "WHOPPER": 9,
+    "SMEARIMAGE": 10,
+    "SMEARHIGHSN": 11,
+    "SMEARMEDSN": 12,
+    "NEARBADPIXEL": 16,
+    "LOWFLAT": 17,
+    "FULLREJECT": 18,
+    "PARTIALREJECT": 19,
+    "SCATTEREDLIGHT": 20,
+    "CROSSTALK": 21,
+    "NOSKY": 22,
+    "BRIGHTSKY": 23,
+    "NODATA": 24,
+    "COMBINEREJ": 25,
+    "BADFLUXFACTOR": 26,
+    "BADSKYCHI": 27,
+    "REDMONSTER": 28,
+}
+
+
+###############################################################################
+def pixel_mask_bits(names: list) -> int:
+    """
+    PARAMETERS
+        names: flag names, e.g. ["NODATA", "BRIGHTSKY"]
+
+    OUTPUT
+        bits: integer with the bits of all flags in names set, 0 if
+            names is empty
+    """
+
+    bits = 0
+
+    for name in names:
+
+        if name not in PIXEL_MASK_BITS:
+            raise ValueError(f"Unknown pixel mask flag: {name}")
+
+        bits |= 1 << PIXEL_MASK_BITS[name]
+
+    return bits
+
+
+###############################################################################
+def reject_pixels(
+    ivar: np.array, and_mask: np.array, reject_bits: int
+) -> np.array:
+    """
+    Set to zero, in place, the ivar of pixels with any of reject_bits
+    in and_mask. Downstream, pixels with ivar equal to zero are
+    treated as pixels without data
+
+    PARAMETERS
+        ivar: inverse variance of each pixel
+        and_mask: and_mask of each pixel
+        reject_bits: output of pixel_mask_bits
+
+    OUTPUT
+        ivar: same array, for convenience
+    """
+
+    ivar[(and_mask & reject_bits) != 0] = 0
+
+    return ivar
@@ -0,0 +1,105 @@
+"""
+Whole plate ingestion: a single spPlate file holds flux and ivar of
+every fiber of a plate, hence when many fibers of a plate are in the
+sample, one request per plate is cheaper than one request per fiber
+"""
+import numpy as np
+import pandas as pd
+
+# fibers per plate of SDSS and BOSS spectrographs
+SDSS_FIBERS = 640
+BOSS_FIBERS = 1000
+
+# pixels per fiber in spPlate files of each spectrograph
+SDSS_PIXELS = 3900
+BOSS_PIXELS = 4700
+
+# float32 images in spPlate: flux, ivar, and mask, or mask,
+# dispersion and sky
+PLATE_IMAGES = 6
+
+# typical size in bytes of a lite spectrum
+LITE_SPECTRUM_BYTES = 200_000
+
+# bytes that could be transferred in the time a request costs,
+# i.e. round trips, TLS handshake and work in the server
+REQUEST_COST_BYTES = 2**20
+
+
+###############################################################################
+class PlatePlanner:
+    """Decide per plate between lite spectra and the spPlate file"""
+
+    def __init__(self, request_cost: int = REQUEST_COST_BYTES):
+        """
+        PARAMETERS
+            request_cost: cost of a single request in bytes, the
+                larger it is, the fewer fibers it takes for the
+                spPlate file to be the cheaper option
+        """
+
+        self.request_cost = request_cost
+
+    ###########################################################################
+    def plan(self, spectra_df: pd.DataFrame) -> np.array:
+        """
+        Compare per plate the cost of n lite spectra with the cost of
+        a single spPlate file: bytes plus the cost of each request
+
+        PARAMETERS
+            spectra_df: data frame with at least the columns
+                run2d, plate, mjd
+
+        OUTPUT
+            use_plate: True for rows of spectra_df to get from the
+                spPlate file of their plate
+        """
+
+        number_fibers = spectra_df.groupby(
+            ["run2d", "plate", "mjd"], sort=False
+        )["plate"].transform("size")
+
+        number_fibers = number_fibers.to_numpy(dtype=np.int64)
+
+        fiber_cost = number_fibers * (LITE_SPECTRUM_BYTES + self.request_cost)
+
+        plate_cost = self.plate_bytes(spectra_df) + self.request_cost
+
+        return plate_cost < fiber_cost
+
+    ###########################################################################
+    @staticmethod
+    def plate_bytes(spectra_df: pd.DataFrame) -> np.array:
+        """
+        Approximate size in bytes of the spPlate file of each row
+
+        PARAMETERS
+            spectra_df: data frame with at least the column run2d
+        """
+
+        # BOSS reductions are named v5_13_0, SDSS ones 26, 103, 104
+        is_boss = spectra_df["run2d"].astype(str).str.startswith("v")
+        is_boss = is_boss.to_numpy()
+
+        number_fibers = np.where(is_boss, BOSS_FIBERS, SDSS_FIBERS)
+        number_pixels = np.where(is_boss, BOSS_PIXELS, SDSS_PIXELS)
+
+        return number_fibers * number_pixels * 4 * PLATE_IMAGES
+
+    ###########################################################################
+    @staticmethod
+    def plate_location(run2d: str, plate: int, mjd: int) -> str:
+        """
+        PARAMETERS
+            run2d: version of the reduction, e.g. 26 or v5_13_0
+            plate: plate number
+            mjd: date of the observation
+
+        OUTPUT
+            url_path: location of the spPlate file in the SAS tree
+        """
+
+        return (
+            f"sas/dr16/sdss/spectro/redux/{run2d}/{plate:04}/"
+            f"spPlate-{plate:04}-{mjd}.fits"
+        )
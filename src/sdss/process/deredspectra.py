@@ -1,14 +1,9 @@
 """E(B-V) values to correct dust effects on spectra fluxes"""
 
-import multiprocessing as mp
-from multiprocessing.sharedctypes import Array
-
-# import numpy as np
+import numpy as np
 import pandas as pd
 import sfdmap
 
-from sdss.utils.parallel import to_numpy_array
-
 
 def get_ebv_value(
     right_ascention: float, declination: float, ebv_map
@@ -32,46 +27,79 @@ def get_ebv_value(
     return ebv_value
 
 
-def shared_ebv_data(
-    input_ebv_values: Array,
-    input_meta_data: pd.DataFrame,
-    maps_directory: str,
-    input_counter: mp.Value,
-):
-    """share data among child processes"""
+def get_ebv_values(
+    right_ascention: np.array,
+    declination: np.array,
+    ebv_map,
+    chunk_size: int = 2**20,
+) -> np.array:
+    """
+    Compute E(B-V) values of many galaxies with a single dust map,
+    coordinates are passed to the map in chunks of arrays
+
+    INPUTS
+    right_ascention: ra of each galaxy
+    declination: dec of each galaxy
+    ebv_map: sfdmap.SFDMap instance
+    chunk_size: number of galaxies per call to ebv_map.ebv, it bounds
+        the memory of temporary arrays
+
+    OUTPUT
+    ebv_values: E(B-V) of each galaxy, aligned with the inputs
+    """
+
+    right_ascention = np.asarray(right_ascention, dtype=np.float64)
+    declination = np.asarray(declination, dtype=np.float64)
+
+    ebv_values = np.empty(right_ascention.size, dtype=np.float64)
 
-    # global shared_maps_directory
-    global ebv_map
-    global ebv_counter
-    global ebv_values
-    global meta_data
+    for start in range(0, right_ascention.size, chunk_size):
 
-    meta_data = input_meta_data
+        stop = start + chunk_size
 
-    ebv_counter = input_counter
-    # shared_maps_directory = maps_directory
-    ebv_map = sfdmap.SFDMap(maps_directory)
+        ebv_values[start:stop] = ebv_map.ebv(
+            right_ascention[start:stop], declination[start:stop]
+        )
 
-    # first column for specobjid and second for ebv value
-    ebv_values = to_numpy_array(
-        input_array=input_ebv_values, array_shape=(meta_data.shape[0], 2)
-    )
+        print(f"E(B-V) N: {min(stop, ebv_values.size)}", end="\r")
 
+    return ebv_values
+
+
+def ebv_column(
+    meta_data_df: pd.DataFrame,
+    maps_directory: str,
+    chunk_size: int = 2**20,
+    cache: "EBVCache" = None,
+) -> pd.Series:
+    """
+    E(B-V) of every galaxy in a meta data frame, the dust maps are
+    loaded once
+
+    INPUTS
+    meta_data_df: data frame with specobjid as index, ra and dec
+    maps_directory: location of fits files with E(B-V) maps
+    chunk_size: see get_ebv_values
+    cache: if not None, an ebvcache.EBVCache, only galaxies not in
+        the cache are looked up in the dust maps
+
+    OUTPUT
+    ebv: series named ebv aligned with meta_data_df
+    """
 
-def ebv_worker(specobjid: int) -> None:
-    """Obtain E(B-V) values"""
+    right_ascention = meta_data_df["ra"].to_numpy()
+    declination = meta_data_df["dec"].to_numpy()
 
-    right_ascention = meta_data.loc[specobjid]["ra"]
-    declination = meta_data.loc[specobjid]["dec"]
+    if cache is not None:
 
-    ebv_value = get_ebv_value(right_ascention, declination, ebv_map)
+        ebv_values = cache.ebv(right_ascention, declination)
 
-    with ebv_counter.get_lock():
+    else:
 
-        # print(specobjid, ebv_value, end="\r")
-        ebv_values[ebv_counter.value, 0] = specobjid
-        ebv_values[ebv_counter.value, 1] = ebv_value
+        ebv_map = sfdmap.SFDMap(maps_directory)
 
-        print(f"E(B-V) N: {ebv_counter.value}", end="\r")
+        ebv_values = get_ebv_values(
+            right_ascention, declination, ebv_map, chunk_size
+        )
 
-        ebv_counter.value += 1
+    return pd.Series(ebv_values, index=meta_data_df.index, name="ebv")
@@ -0,0 +1,214 @@
+"""
+Persistent cache of E(B-V) values. Values are keyed by HEALPix pixel,
+computed at the center of the pixel, or by exact (ra, dec). Cached
+values are returned at once and only the rest goes to the dust maps
+"""
+
+import os
+
+import numpy as np
+import sfdmap
+
+from sdss.process.deredspectra import get_ebv_values
+from sdss.utils.healpix import ang2pix, number_pixels, pix2ang
+
+EXACT_DTYPE = np.dtype(
+    [("ra", np.float64), ("dec", np.float64), ("ebv", np.float64)]
+)
+
+
+class EBVCache:
+    """E(B-V) values on disk, by sky pixel or by exact position"""
+
+    def __init__(
+        self,
+        directory: str,
+        maps_directory: str,
+        nside: int = 2048,
+        exact: bool = False,
+        chunk_size: int = 2**20,
+    ):
+        """
+        INPUTS
+        directory: location of the cache files
+        maps_directory: location of fits files with E(B-V) maps, they
+            are loaded only if a value is not in the cache
+        nside: resolution of the pixels, a power of 2. With 2048,
+            pixels are 1.7 arcmin wide, close to the 2.4 arcmin of
+            the SFD maps, and the cache takes 200 MB
+        exact: if True, values are keyed by exact (ra, dec) instead
+            of by pixel
+        chunk_size: see deredspectra.get_ebv_values
+        """
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.maps_directory = maps_directory
+        self.nside = nside
+        self.exact = exact
+        self.chunk_size = chunk_size
+
+        if exact is True:
+            self.location = f"{directory}/ebv_exact.npy"
+        else:
+            self.location = f"{directory}/ebv_nside_{nside}_nested.npy"
+
+        self.ebv_map = None
+
+    def ebv(self, ra: np.array, dec: np.array) -> np.array:
+        """
+        E(B-V) of each position, from the cache or from the dust maps
+        for positions not cached yet, which are then cached
+
+        INPUTS
+        ra: right ascension in degrees
+        dec: declination in degrees
+
+        OUTPUT
+        ebv_values: E(B-V) of each position
+        """
+
+        if self.exact is True:
+            return self._exact_ebv(ra, dec)
+
+        pixels = ang2pix(self.nside, ra, dec)
+        pixel_values = self.precompute(np.unique(pixels))
+
+        return pixel_values[pixels].astype(np.float64)
+
+    def precompute(self, pixels: np.array = None) -> np.array:
+        """
+        Fill the cache for a footprint
+
+        INPUTS
+        pixels: pixels of the footprint, e.g. the output of
+            footprint_pixels. If None, the whole sky is computed
+
+        OUTPUT
+        pixel_values: memory map of the cache, E(B-V) of each pixel,
+            NaN for pixels not computed
+        """
+
+        if self.exact is True:
+            raise ValueError("precompute needs a cache keyed by pixel")
+
+        pixel_values = self._pixel_values()
+
+        if pixels is None:
+            pixels = np.arange(number_pixels(self.nside))
+
+        missing = pixels[np.isnan(pixel_values[pixels])]
+
+        print(f"E(B-V) of {missing.size} pixels not in the cache")
+
+        if missing.size > 0:
+
+            ra, dec = pix2ang(self.nside, missing)
+
+            pixel_values[missing] = get_ebv_values(
+                ra, dec, self._ebv_map(), self.chunk_size
+            )
+            pixel_values.flush()
+
+        return pixel_values
+
+    def footprint_pixels(
+        self, ra: np.array, dec: np.array, neighbours: bool = True
+    ) -> np.array:
+        """
+        Pixels of a footprint from positions of a sample
+
+        INPUTS
+        ra: right ascension in degrees
+        dec: declination in degrees
+        neighbours: if True, pixels of the footprint at four times
+            the resolution are included, hence positions close to
+            the ones of the sample are covered as well
+
+        OUTPUT
+        pixels: unique pixels at the resolution of the cache
+        """
+
+        pixels = np.unique(ang2pix(self.nside, ra, dec))
+
+        if neighbours is True:
+            # all children of the parent pixels at nside / 4
+            parents = np.unique(pixels // 16)
+            pixels = (parents[:, None] * 16 + np.arange(16)).reshape(-1)
+
+        return pixels
+
+    def _pixel_values(self) -> np.memmap:
+        """Open the cache of pixels, create it if it does not exist"""
+
+        if not os.path.isfile(self.location):
+
+            pixel_values = np.lib.format.open_memmap(
+                f"{self.location}.part",
+                mode="w+",
+                dtype=np.float32,
+                shape=(number_pixels(self.nside),),
+            )
+            pixel_values[:] = np.nan
+            pixel_values.flush()
+
+            del pixel_values
+            os.replace(f"{self.location}.part", self.location)
+
+        return np.load(self.location, mmap_mode="r+")
+
+    def _exact_ebv(self, ra: np.array, dec: np.array) -> np.array:
+        """E(B-V) keyed by exact position, see ebv"""
+
+        keys = np.empty(len(ra), dtype=EXACT_DTYPE)
+        keys["ra"] = ra
+        keys["dec"] = dec
+
+        cache = np.empty(0, dtype=EXACT_DTYPE)
+
+        if os.path.isfile(self.location):
+            cache = np.load(self.location)
+
+        positions = np.searchsorted(cache[["ra", "dec"]], keys[["ra", "dec"]])
+        positions = np.minimum(positions, max(cache.size - 1, 0))
+
+        found = np.zeros(keys.size, dtype=bool)
+
+        if cache.size > 0:
+            found = (cache["ra"][positions] == keys["ra"]) & (
+                cache["dec"][positions] == keys["dec"]
+            )
+
+        keys["ebv"][found] = cache["ebv"][positions[found]]
+
+        missing = ~found
+
+        print(f"E(B-V) of {np.count_nonzero(missing)} positions not cached")
+
+        if np.any(missing):
+
+            keys["ebv"][missing] = get_ebv_values(
+                keys["ra"][missing],
+                keys["dec"][missing],
+                self._ebv_map(),
+                self.chunk_size,
+            )
+
+            new = np.unique(keys[missing])
+            cache = np.concatenate([cache, new])
+            cache = cache[np.argsort(cache[["ra", "dec"]], kind="stable")]
+
+            with open(f"{self.location}.part", "wb") as file:
+                np.save(file, cache)
+
+            os.replace(f"{self.location}.part", self.location)
+
+        return keys["ebv"]
+
+    def _ebv_map(self) -> sfdmap.SFDMap:
+        """Dust maps, loaded once and only if needed"""
+
+        if self.ebv_map is None:
+            self.ebv_map = sfdmap.SFDMap(self.maps_directory)
+
+        return self.ebv_map
@@ -0,0 +1,362 @@
+"""
+Extinction curves tabulated once over the log-lambda lattice of SDSS
+spectra, log10(wave) in steps of 1e-4. The wavelengths of a spectrum
+are a slice of the lattice, hence its correction is a look up by
+integer offset instead of an evaluation of the dust law
+"""
+
+from functools import lru_cache
+
+import numpy as np
+from scipy.interpolate import CubicSpline, interp1d
+
+# step of log10(wave) of SDSS spectra
+LOG_WAVE_STEP = 1e-4
+# wavelengths of a spectrum within this fraction of a step from the
+# lattice are looked up, e.g. 10**loglam with loglam in float32
+LATTICE_TOLERANCE = 0.05
+
+# range of the table in Angstroms, the range of the sdss law
+TABLE_LOWER = 2600
+TABLE_UPPER = 26500
+
+
+def lattice_position(wave: np.array) -> int:
+    """
+    INPUTS
+    wave: wavelengths of a spectrum in observer frame
+
+    OUTPUT
+    position: log10(wave[0]) / LOG_WAVE_STEP as an integer, None if
+        wave is not a contiguous slice of the lattice
+    """
+
+    first = np.log10(wave[0]) / LOG_WAVE_STEP
+    last = np.log10(wave[-1]) / LOG_WAVE_STEP
+
+    first_position = round(first)
+    last_position = round(last)
+
+    on_lattice = (
+        abs(first - first_position) < LATTICE_TOLERANCE
+        and abs(last - last_position) < LATTICE_TOLERANCE
+        and last_position - first_position == wave.size - 1
+    )
+
+    return first_position if on_lattice else None
+
+
+# polynomials in x - 1.82 of a(x) and b(x) in the optical range of
+# Cardelli, Clayton & Mathis (1989) and O'Donnell (1994)
+OPTICAL_COEFFICIENTS = {
+    "ccm89": (
+        [1.0, 0.17699, -0.50447, -0.02427, 0.72085, 0.01979, -0.7753, 0.32999],
+        [0.0, 1.41338, 2.28305, 1.07233, -5.38434, -0.62251, 5.3026, -2.09002],
+    ),
+    "odonnell94": (
+        [1.0, 0.104, -0.609, 0.701, 1.137, -1.718, -0.827, 1.647, -0.505],
+        [0.0, 1.952, 2.908, -3.989, -7.985, 11.102, 5.491, -10.805, 3.347],
+    ),
+}
+
+
+def sdss_law(wave: np.array, r_v: float = 3.1) -> np.array:
+    """
+    Cubic interpolation of A(lambda)/E(B-V) at the optical and infrared
+    anchors of Fitzpatrick (1999) for R_V = 3.1, the dust model used so
+    far to dered spectra
+
+    INPUTS
+    wave: wavelengths in Angstroms, within [2600, 26500]
+    r_v: ignored, the anchors are for R_V = 3.1
+
+    OUTPUT
+    extinction: A(lambda)/E(B-V)
+    """
+
+    anchors = np.array([2600, 2700, 4110, 4670, 5470, 6000, 12200, 26500])
+
+    extinction = np.array(
+        [6.591, 6.265, 4.315, 3.806, 3.055, 2.688, 0.829, 0.265]
+    )
+
+    return interp1d(anchors, extinction, kind="cubic")(wave)
+
+
+def _ccm_coefficients(x: np.array, optical: str) -> tuple:
+    """
+    a(x) and b(x) of Cardelli, Clayton & Mathis (1989)
+
+    INPUTS
+    x: inverse wavelengths in 1/micron, within [0.3, 10]
+    optical: a key of OPTICAL_COEFFICIENTS, the laws differ only in
+        the optical range, 1.1 <= x < 3.3
+
+    OUTPUT
+    a, b: coefficients of each x
+    """
+
+    a = np.empty(x.shape)
+    b = np.empty(x.shape)
+
+    infrared = x < 1.1
+    a[infrared] = 0.574 * x[infrared] ** 1.61
+    b[infrared] = -0.527 * x[infrared] ** 1.61
+
+    visible = (x >= 1.1) & (x < 3.3)
+    y = x[visible] - 1.82
+
+    a_coefficients, b_coefficients = OPTICAL_COEFFICIENTS[optical]
+
+    a[visible] = np.polynomial.polynomial.polyval(y, a_coefficients)
+    b[visible] = np.polynomial.polynomial.polyval(y, b_coefficients)
+
+    ultraviolet = (x >= 3.3) & (x < 8)
+    x_uv = x[ultraviolet]
+    y = np.maximum(x_uv - 5.9, 0)
+
+    a[ultraviolet] = (
+        1.752
+        - 0.316 * x_uv
+        - 0.104 / ((x_uv - 4.67) ** 2 + 0.341)
+        - 0.04473 * y**2
+        - 0.009779 * y**3
+    )
+    b[ultraviolet] = (
+        -3.090
+        + 1.825 * x_uv
+        + 1.206 / ((x_uv - 4.62) ** 2 + 0.263)
+        + 0.2130 * y**2
+        + 0.1207 * y**3
+    )
+
+    far_ultraviolet = x >= 8
+    y = x[far_ultraviolet] - 8
+
+    a[far_ultraviolet] = -1.073 - 0.628 * y + 0.137 * y**2 - 0.070 * y**3
+    b[far_ultraviolet] = 13.670 + 4.257 * y - 0.420 * y**2 + 0.374 * y**3
+
+    return a, b
+
+
+def ccm89_law(wave: np.array, r_v: float = 3.1) -> np.array:
+    """
+    A(lambda)/E(B-V) of Cardelli, Clayton & Mathis (1989)
+
+    INPUTS
+    wave: wavelengths in Angstroms, within [1000, 33333]
+    r_v: ratio of total to selective extinction, A(V)/E(B-V)
+
+    OUTPUT
+    extinction: A(lambda)/E(B-V)
+    """
+
+    a, b = _ccm_coefficients(1e4 / np.asarray(wave), "ccm89")
+
+    return r_v * a + b
+
+
+def odonnell94_law(wave: np.array, r_v: float = 3.1) -> np.array:
+    """
+    A(lambda)/E(B-V) of O'Donnell (1994), Cardelli, Clayton & Mathis
+    (1989) with new coefficients in the optical range
+
+    INPUTS
+    wave: wavelengths in Angstroms, within [1000, 33333]
+    r_v: ratio of total to selective extinction, A(V)/E(B-V)
+
+    OUTPUT
+    extinction: A(lambda)/E(B-V)
+    """
+
+    a, b = _ccm_coefficients(1e4 / np.asarray(wave), "odonnell94")
+
+    return r_v * a + b
+
+
+def _fitzpatrick99_uv(x: np.array, r_v: float) -> np.array:
+    """E(lambda-V)/E(B-V) of Fitzpatrick (1999) for x >= 1e4/2700"""
+
+    c2 = -0.824 + 4.717 / r_v
+    c1 = 2.030 - 3.007 * c2
+
+    drude = x**2 / ((x**2 - 4.596**2) ** 2 + x**2 * 0.99**2)
+
+    y = np.maximum(x - 5.9, 0)
+    far_ultraviolet = 0.5392 * y**2 + 0.05644 * y**3
+
+    return c1 + c2 * x + 3.23 * drude + 0.41 * far_ultraviolet
+
+
+def fitzpatrick99_law(wave: np.array, r_v: float = 3.1) -> np.array:
+    """
+    A(lambda)/E(B-V) of Fitzpatrick (1999), a natural cubic spline
+    through optical and infrared anchors and the ultraviolet curve
+
+    INPUTS
+    wave: wavelengths in Angstroms, within [910, 60000]
+    r_v: ratio of total to selective extinction, A(V)/E(B-V)
+
+    OUTPUT
+    extinction: A(lambda)/E(B-V)
+    """
+
+    x = 1e4 / np.asarray(wave, dtype=np.float64)
+
+    anchors = np.array(
+        [0.0, 1e4 / 26500, 1e4 / 12200, 1e4 / 6000, 1e4 / 5470]
+        + [1e4 / 4670, 1e4 / 4110, 1e4 / 2700, 1e4 / 2600]
+    )
+
+    r_v2 = r_v * r_v
+
+    anchor_values = np.empty(anchors.size)
+    anchor_values[0] = -r_v
+    anchor_values[1] = 0.26469 * r_v / 3.1 - r_v
+    anchor_values[2] = 0.82925 * r_v / 3.1 - r_v
+    anchor_values[3] = -0.422809 + 0.00270 * r_v + 2.13572e-04 * r_v2
+    anchor_values[4] = -5.13540e-02 + 0.00216 * r_v - 7.35778e-05 * r_v2
+    anchor_values[5] = 0.700127 + 0.00184 * r_v - 3.32598e-05 * r_v2
+    anchor_values[6] = (
+        1.19456
+        + 0.01707 * r_v
+        - 5.46959e-03 * r_v2
+        + 7.97809e-04 * r_v2 * r_v
+        - 4.45636e-05 * r_v2 * r_v2
+    )
+    anchor_values[7:] = _fitzpatrick99_uv(anchors[7:], r_v)
+
+    spline = CubicSpline(anchors, anchor_values, bc_type="natural")
+
+    ultraviolet = x >= anchors[7]
+
+    color_excess = np.where(
+        ultraviolet, _fitzpatrick99_uv(x, r_v), spline(x)
+    )
+
+    return color_excess + r_v
+
+
+# name in the configuration file: A(lambda)/E(B-V) as a function of
+# wavelengths in Angstroms and R_V
+DUST_LAWS = {
+    "sdss": sdss_law,
+    "ccm89": ccm89_law,
+    "odonnell94": odonnell94_law,
+    "fitzpatrick99": fitzpatrick99_law,
+}
+
+
+class ExtinctionTable:
+    """A dust law tabulated over the log-lambda lattice"""
+
+    def __init__(self, law: str = "sdss", r_v: float = 3.1):
+        """
+        INPUTS
+        law: a key of DUST_LAWS
+        r_v: ratio of total to selective extinction, A(V)/E(B-V)
+        """
+
+        if law not in DUST_LAWS:
+            raise ValueError(
+                f"Unknown dust law: {law}, options: {list(DUST_LAWS)}"
+            )
+
+        self.law = DUST_LAWS[law]
+        self.r_v = r_v
+
+        # lattice position of the first and last entries of the table
+        self.start = int(np.ceil(np.log10(TABLE_LOWER) / LOG_WAVE_STEP))
+        stop = int(np.floor(np.log10(TABLE_UPPER) / LOG_WAVE_STEP))
+
+        wave = 10 ** (np.arange(self.start, stop + 1) * LOG_WAVE_STEP)
+        # rounding errors at the edges
+        wave = np.clip(wave, TABLE_LOWER, TABLE_UPPER)
+
+        # 10**(ebv * extinction / 2.5) = exp(ebv * table)
+        self.table = self.law(wave, r_v) * (np.log(10) / 2.5)
+
+    def lattice_offset(self, wave: np.array) -> int:
+        """
+        INPUTS
+        wave: wavelengths of a spectrum in observer frame
+
+        OUTPUT
+        offset: position in the table of wave[0], None if wave is
+            not a slice of the lattice within the table
+        """
+
+        position = lattice_position(wave)
+
+        if position is None:
+            return None
+
+        offset = position - self.start
+
+        if offset >= 0 and offset + wave.size <= self.table.size:
+            return offset
+
+        return None
+
+    def dered(self, flux: np.array, wave: np.array, ebv: float) -> np.array:
+        """
+        Multiply flux by 10**(ebv * A(lambda) / 2.5)
+
+        INPUTS
+        flux: spectrum fluxes in observer frame
+        wave: wavelengths of spectrum in observer frame
+        ebv: E(B-V) from Schlegel, Finkbeiner & Davis (1998)
+
+        OUTPUT
+        dered_flux: float64 fluxes corrected by extinction
+        """
+
+        offset = self.lattice_offset(wave)
+
+        if offset is None:
+            # wavelengths off the lattice, e.g. resampled spectra
+            factor = self.law(wave, self.r_v) * (np.log(10) / 2.5)
+        else:
+            factor = self.table[offset : offset + wave.size].copy()
+
+        # ebv scaling, exponent and product in the same buffer
+        factor *= ebv
+        np.exp(factor, out=factor)
+
+        return np.multiply(flux, factor, out=factor)
+
+    def dered_block(
+        self, flux: np.array, position: int, ebv: np.array
+    ) -> np.array:
+        """
+        dered for a block of spectra on the same lattice columns
+
+        INPUTS
+        flux: (number_spectra, number_columns) fluxes in observer
+            frame
+        position: lattice position of column 0, see lattice_position
+        ebv: E(B-V) of each spectrum
+
+        OUTPUT
+        dered_flux: float64 fluxes corrected by extinction
+        """
+
+        offset = position - self.start
+
+        if offset < 0 or offset + flux.shape[1] > self.table.size:
+            raise ValueError("Wavelengths of the block are off the table")
+
+        factor = np.multiply(
+            np.asarray(ebv, dtype=np.float64)[:, None],
+            self.table[offset : offset + flux.shape[1]],
+        )
+        np.exp(factor, out=factor)
+
+        return np.multiply(flux, factor, out=factor)
+
+
+@lru_cache(maxsize=None)
+def extinction_table(law: str = "sdss", r_v: float = 3.1) -> ExtinctionTable:
+    """Tabulate a dust law once per process, see ExtinctionTable"""
+
+    return ExtinctionTable(law, r_v)
@@ -6,12 +6,22 @@ Functionality to do the computations in parallel
 import multiprocessing as mp
 import numpy as np
 import pandas as pd
-from scipy.interpolate import interp1d
-
 from sdss.metadata import MetaData
+from sdss.process.extinction import (
+    LOG_WAVE_STEP,
+    ExtinctionTable,
+    extinction_table,
+    lattice_position,
+)
+from sdss.process.skylines import SkyLineMask
+from sdss.raw.packed import PackedSpectra
+from sdss.specobjindex import SpecObjIndex
 from sdss.utils.managefiles import FileDirectory
 from sdss.utils.parallel import to_numpy_array
 
+# windows of OI_5577_interpolation, kept for backward compatibility
+OI_5577_MASK = SkyLineMask({"OI_5577": (5565, 5590)})
+
 
 class Interpolate(FileDirectory, MetaData):
     """
@@ -29,14 +39,20 @@ class Interpolate(FileDirectory, MetaData):
 
     def __init__(
         self,
-        meta_data_df: pd.DataFrame,
+        meta_data_df: "pd.DataFrame | SpecObjIndex",
         raw_data_dir: str,
         wave_parameters: dict,
+        dust_law: str = "sdss",
+        r_v: float = 3.1,
+        sky_lines: dict = None,
     ):
         """
         Class to process  spectra
         PARAMETERS
-        data_directory: location of raw spectra
+        meta_data_df: data frame or SpecObjIndex with ebv and z of
+            each spectrum
+        data_directory: location of raw spectra, a {specobjid}.npy
+            file per spectrum or a packed store, see sdss.raw.packed
         output_directory:
         grid_parameters: dictionary with structure
             {
@@ -46,6 +62,10 @@ class Interpolate(FileDirectory, MetaData):
             }
         number_processes: number of jobs when processing a bulk
             of a spectra
+        dust_law: a key of sdss.process.extinction.DUST_LAWS
+        r_v: ratio of total to selective extinction, A(V)/E(B-V)
+        sky_lines: {name: (lower, upper)} windows in observer frame
+            to fill, if None only [OI]5577, see sdss.process.skylines
         OUTPUT
             check how to document the constructor of a class
         """
@@ -55,11 +75,29 @@ class Interpolate(FileDirectory, MetaData):
 
         super().check_directory(raw_data_dir, exit_program=True)
         self.spectra_directory = raw_data_dir
+
+        self.packed_spectra = None
+
+        if PackedSpectra.is_packed(raw_data_dir):
+            self.packed_spectra = PackedSpectra(raw_data_dir)
+
+        # binary search instead of a pandas lookup per spectrum
+        if isinstance(meta_data_df, pd.DataFrame):
+            meta_data_df = SpecObjIndex.from_data_frame(
+                meta_data_df, ["ebv", "z"]
+            )
+
         self.meta_data = meta_data_df
         self.grid = self.get_grid(wave_parameters)
+        # position of the grid on the log-lambda lattice
+        self.lattice_grid = np.log10(self.grid) / LOG_WAVE_STEP
 
+        self.dust_law = dust_law
+        self.r_v = r_v
         self.extinction = self.dust_model()
 
+        self.sky_mask = SkyLineMask(sky_lines)
+
     def get_grid(self, wave_parameters: dict) -> np.array:
         """
         Computes the master grid for the interpolation of the spectra
@@ -99,26 +137,7 @@ class Interpolate(FileDirectory, MetaData):
             region caused by atmospheric airglow
         """
 
-        OI_mask = np.logical_and(wave > 5565, wave < 5590)
-        n_mask = OI_mask.sum()
-
-        try:
-
-            left_idx = np.argwhere(wave == wave[OI_mask][0])[0, 0]
-            right_idx = np.argwhere(wave == wave[OI_mask][-1])[0, 0]
-
-        except IndexError:
-
-            return spectrum
-
-        left_flux = spectrum[left_idx - n_mask : left_idx]
-        right_flux = spectrum[right_idx : right_idx + n_mask]
-
-        average_flux = (left_flux + right_flux) / 2.0
-
-        spectrum[OI_mask] = average_flux
-
-        return spectrum
+        return OI_5577_MASK.fill(wave, spectrum)
 
     def interpolate(self, specobjid: int) -> tuple:
         """
@@ -133,24 +152,18 @@ class Interpolate(FileDirectory, MetaData):
             over the common grid
         """
 
-        spectrum_location = f"{self.spectra_directory}/{specobjid}.npy"
-
-        spectrum = np.load(spectrum_location)
-
-        wave = spectrum[0]
-        flux = spectrum[1]
-        ivar = spectrum[2]
+        wave, flux, ivar = self.load_spectrum(specobjid)
 
-        # remove [OI]5577 line
-        flux = self.OI_5577_interpolation(wave=wave, spectrum=flux)
+        # remove sky lines
+        flux = self.sky_mask.fill(wave, flux)
         # remove large uncertainties
         flux, variance = self.remove_large_uncertainties(flux, ivar)
         # correct for extinction
-        ebv = self.meta_data.loc[specobjid, "ebv"]
+        ebv = self.meta_data.get(specobjid, "ebv")
         flux = self.dered_spectrum(flux, wave, ebv)
 
         # deredshift
-        z = self.meta_data.loc[specobjid, "z"]
+        z = self.meta_data.get(specobjid, "z")
         wave = self.convert_to_rest_frame(wave, z)
 
         # interpolate to common grid
@@ -162,6 +175,319 @@ class Interpolate(FileDirectory, MetaData):
 
         return flux, variance
 
+    def load_spectrum(self, specobjid: int) -> tuple:
+        """
+        INPUTS
+        specobjid: specobj of a spectrum
+
+        OUTPUT
+        wave, flux, ivar: raw spectrum, flux and ivar can be
+            modified in place
+        """
+
+        if self.packed_spectra is not None:
+
+            spectrum = self.packed_spectra.get(specobjid)
+
+            # the view of the shard is read only
+            return spectrum[0], spectrum[1].copy(), spectrum[2].copy()
+
+        spectrum_location = f"{self.spectra_directory}/{specobjid}.npy"
+
+        spectrum = np.load(spectrum_location)
+
+        return spectrum[0], spectrum[1], spectrum[2]
+
+    def lattice_block(self, specobjids: np.array) -> tuple:
+        """
+        Pad raw spectra onto a common slice of the log-lambda
+        lattice, see sdss.process.extinction
+
+        INPUTS
+        specobjids: specobjid of each spectrum in the block, spectra
+            on the lattice with the same dtype, ValueError otherwise
+
+        OUTPUT
+        wave, flux, ivar, starts, stops:
+            wave, flux, ivar: (number_spectra, number_columns)
+                arrays, column k is the lattice position of column 0
+                plus k. Outside of the pixels of each spectrum, wave
+                has the lattice wavelengths and flux and ivar zeros
+            starts, stops: first column and one past the last column
+                of each spectrum in the block
+        """
+
+        spectra = [self.load_spectrum(specobjid) for specobjid in specobjids]
+
+        positions = np.empty(len(spectra), dtype=np.int64)
+        sizes = np.empty(len(spectra), dtype=np.int64)
+
+        for idx, (wave, _, _) in enumerate(spectra):
+
+            position = lattice_position(wave)
+
+            if position is None:
+                raise ValueError(
+                    f"Wavelengths of {specobjids[idx]} are off the lattice"
+                )
+
+            positions[idx] = position
+            sizes[idx] = wave.size
+
+        first = positions.min()
+        starts = positions - first
+        stops = starts + sizes
+
+        shape = (len(spectra), stops.max())
+
+        # each spectrum keeps its own wavelengths, they may differ in
+        # the last bits from one spectrum to another
+        wave = np.empty(shape)
+        wave[:] = 10 ** ((first + np.arange(shape[1])) * LOG_WAVE_STEP)
+
+        # float32 and float64 spectra are processed with different
+        # precision by interpolate
+        dtypes = {spectrum[1].dtype for spectrum in spectra}
+        dtypes |= {spectrum[2].dtype for spectrum in spectra}
+
+        if len(dtypes) > 1:
+            raise ValueError(f"Spectra of the block have dtypes {dtypes}")
+
+        flux = np.zeros(shape, dtype=dtypes.pop())
+        ivar = np.zeros(shape, dtype=flux.dtype)
+
+        for idx, spectrum in enumerate(spectra):
+
+            columns = slice(starts[idx], stops[idx])
+
+            wave[idx, columns] = spectrum[0]
+            flux[idx, columns] = spectrum[1]
+            ivar[idx, columns] = spectrum[2]
+
+        return wave, flux, ivar, starts, stops
+
+    def interpolate_block(
+        self,
+        wave: np.array,
+        flux: np.array,
+        ivar: np.array,
+        starts: np.array,
+        stops: np.array,
+        z: np.array,
+        ebv: np.array,
+    ) -> tuple:
+        """
+        Interpolate a block of spectra with 2-D array operations, the
+        output is the same as the output of interpolate for each
+        spectrum
+
+        INPUTS
+        wave, flux, ivar, starts, stops: see lattice_block, flux and
+            ivar are modified in place
+        z: redshift of each spectrum
+        ebv: E(B-V) of each spectrum
+
+        OUTPUT
+        spectra, variance: (number_spectra, number_waves) arrays with
+            interpolated spectra and their variance over the grid
+        """
+
+        position = lattice_position(wave[0, starts[0] : stops[0]])
+
+        if position is None:
+            raise ValueError("Wavelengths of the block are off the lattice")
+
+        # lattice position of column 0
+        position -= starts[0]
+
+        # remove sky lines
+        lattice = position + np.arange(wave.shape[1])
+        lattice = 10 ** (lattice * LOG_WAVE_STEP)
+
+        flux = self.sky_mask.fill_block(wave, flux, starts, stops, lattice)
+        # remove large uncertainties, element wise
+        flux, variance = self.remove_large_uncertainties(flux, ivar)
+        # correct for extinction
+        flux = self.extinction.dered_block(flux, position, ebv)
+
+        # deredshift
+        rest_frame_factor = 1.0 / (1.0 + np.asarray(z, dtype=np.float64))
+        rest_wave = wave * rest_frame_factor[:, None]
+
+        # interpolate to common grid, brackets are shared by flux
+        # and variance
+        brackets = self._grid_brackets(
+            rest_wave, rest_frame_factor, position, starts, stops
+        )
+
+        flux = self._interpolate_rows(flux, brackets)
+        variance = self._interpolate_rows(variance, brackets)
+
+        return flux, variance
+
+    def _grid_brackets(
+        self,
+        rest_wave: np.array,
+        rest_frame_factor: np.array,
+        position: int,
+        starts: np.array,
+        stops: np.array,
+    ) -> dict:
+        """
+        Position of the grid in the rest frame wavelengths of each
+        spectrum, with the conventions of np.interp
+
+        INPUTS
+        rest_wave: (number_spectra, number_columns) wavelengths in
+            rest frame
+        rest_frame_factor: 1 / (1 + z) of each spectrum
+        position: lattice position of column 0
+        starts, stops: see lattice_block
+
+        OUTPUT
+        brackets: {
+            "lower": flat position in rest_wave of the largest
+                wavelength less than or equal to each point of the
+                grid, only meaningful within each spectrum
+            "x_1": wavelengths at lower + 1
+            "width", "distance": x_1 - x_0 and grid - x_0, shared by
+                flux and variance
+            "inside": first and one past the last point of the grid
+                within each spectrum
+            "on_last": (row, column, flat position) of grid points on
+                the last wavelength of a spectrum
+        }
+        """
+
+        number_spectra, number_columns = rest_wave.shape
+
+        # flat positions for take, faster than fancy indexing
+        row_starts = np.arange(number_spectra) * number_columns
+        rest_wave = rest_wave.reshape(-1)
+
+        first = row_starts + starts
+        last = row_starts + stops - 1
+
+        # guess on the lattice, a column off at most because of
+        # rounding errors
+        shift = np.log10(rest_frame_factor) / LOG_WAVE_STEP + position
+
+        lower = self.lattice_grid[None, :] - shift[:, None]
+        lower = np.floor(lower, out=lower).astype(np.int64)
+        lower += row_starts[:, None]
+
+        np.clip(lower, 0, rest_wave.size - 2, out=lower)
+
+        x_0 = rest_wave.take(lower)
+        x_1 = rest_wave.take(lower + 1)
+
+        # fix the few wrong guesses in the rest frame, np.interp
+        # brackets a point with x_0 <= point < x_1
+        wrong = np.flatnonzero((x_0 > self.grid) | (x_1 <= self.grid))
+
+        while wrong.size > 0:
+
+            rows, columns = np.divmod(wrong, self.grid.size)
+            points = self.grid[columns]
+            flat_lower = lower.reshape(-1)[wrong]
+
+            down = (x_0.reshape(-1)[wrong] > points) & (
+                flat_lower > first[rows]
+            )
+            up = (x_1.reshape(-1)[wrong] <= points) & (
+                flat_lower < last[rows] - 1
+            )
+
+            flat_lower += up.astype(np.int64) - down
+            flat_lower = np.clip(flat_lower, first[rows], last[rows] - 1)
+
+            lower.reshape(-1)[wrong] = flat_lower
+            x_0.reshape(-1)[wrong] = rest_wave.take(flat_lower)
+            x_1.reshape(-1)[wrong] = rest_wave.take(flat_lower + 1)
+
+            wrong = wrong[down | up]
+
+        # the grid is sorted, points within each spectrum are a slice
+        first_wave = rest_wave.take(first)
+        last_wave = rest_wave.take(last)
+
+        inside = (
+            np.searchsorted(self.grid, first_wave, side="left"),
+            np.searchsorted(self.grid, last_wave, side="right"),
+        )
+
+        rows = np.flatnonzero(
+            (inside[1] > 0) & (self.grid[inside[1] - 1] == last_wave)
+        )
+
+        return {
+            "lower": lower,
+            "x_1": x_1,
+            "width": x_1 - x_0,
+            "distance": np.subtract(self.grid, x_0, out=x_0),
+            "inside": inside,
+            "on_last": (rows, inside[1][rows] - 1, last[rows]),
+        }
+
+    def _interpolate_rows(self, values: np.array, brackets: dict) -> np.array:
+        """
+        np.interp of each row of values over the grid, with NaN out of
+        each spectrum
+
+        INPUTS
+        values: (number_spectra, number_columns) flux or variance
+        brackets: output of _grid_brackets
+
+        OUTPUT
+        interpolated: (number_spectra, number_waves) float64 array
+        """
+
+        values = values.reshape(-1)
+        lower = brackets["lower"]
+
+        y_0 = values.take(lower).astype(np.float64, copy=False)
+        interpolated = values.take(lower + 1).astype(np.float64)
+
+        with np.errstate(all="ignore"):
+
+            # slope * (x - x_0) + y_0, as np.interp
+            interpolated -= y_0
+            interpolated /= brackets["width"]
+            interpolated *= brackets["distance"]
+            interpolated += y_0
+
+            # a finite slope gives y_0 on x_0, otherwise same
+            # fallbacks as np.interp for non finite values
+            retry = np.flatnonzero(np.isnan(interpolated))
+
+            if retry.size > 0:
+
+                y_0 = y_0.reshape(-1)[retry]
+                y_1 = values.take(lower.reshape(-1)[retry] + 1)
+                y_1 = y_1.astype(np.float64, copy=False)
+
+                slope = (y_1 - y_0) / brackets["width"].reshape(-1)[retry]
+                x = self.grid[retry % self.grid.size]
+
+                fallback = slope * (x - brackets["x_1"].reshape(-1)[retry])
+                fallback += y_1
+
+                equal = np.isnan(fallback) & (y_0 == y_1)
+                equal |= brackets["distance"].reshape(-1)[retry] == 0
+                fallback[equal] = y_0[equal]
+
+                interpolated.reshape(-1)[retry] = fallback
+
+        rows, columns, positions = brackets["on_last"]
+        interpolated[rows, columns] = values.take(positions)
+
+        for row, (start, stop) in enumerate(zip(*brackets["inside"])):
+
+            interpolated[row, :start] = np.nan
+            interpolated[row, stop:] = np.nan
+
+        return interpolated
+
     def dered_spectrum(
         self, flux: np.array, wave: np.array, ebv: float
     ) -> np.array:
@@ -178,26 +504,18 @@ class Interpolate(FileDirectory, MetaData):
         dered_flux: fluxes corrected by extinction
         """
 
-        # extinction array for this spectrum
-        extinction = self.extinction(wave)
-        extinction *= ebv
-
-        dereded_flux = flux * 10 ** (extinction / 2.5)
+        # slice of the table by lattice offset
+        dereded_flux = self.extinction.dered(flux, wave, ebv)
 
         return dereded_flux
 
-    def dust_model(self) -> object:
-        """Extinction function to dered spectra"""
-        # dust model for dereden_spectrum
-        wave = np.array([2600, 2700, 4110, 4670, 5470, 6000, 12200, 26500])
-
-        extinction = np.array(
-            [6.591, 6.265, 4.315, 3.806, 3.055, 2.688, 0.829, 0.265]
-        )
-
-        extinction = interp1d(wave, extinction, kind="cubic")
+    def dust_model(self) -> ExtinctionTable:
+        """
+        Extinction function to dered spectra, tabulated once per
+        process over the log-lambda lattice of SDSS spectra
+        """
 
-        return extinction
+        return extinction_table(self.dust_law, self.r_v)
 
     def remove_large_uncertainties(
         self, flux: np.array, ivar: np.array
@@ -215,15 +533,18 @@ class Interpolate(FileDirectory, MetaData):
             and variance of flux measurements
         """
 
-        # Get variance of each flux
-        ivar[ivar == 0] = np.nan
-        variance = 1 / ivar
-        variance[np.isnan(ivar)] = np.inf
-        variance = np.nan_to_num(variance)
+        # Get variance of each flux, the largest float without data
+        no_data = (ivar == 0) | np.isnan(ivar)
+
+        with np.errstate(divide="ignore"):
+            variance = 1 / ivar
+
+        variance[no_data] = np.inf
+        variance = np.nan_to_num(variance, copy=False)
 
-        # mask of: variance > flux [higly uncertain values]
-        flux_no_nans = np.nan_to_num(flux)
-        large_variance_mask = np.sqrt(variance) > flux_no_nans
+        # mask of: variance > flux [higly uncertain values], a NaN
+        # flux stays NaN, hence no need of nan_to_num
+        large_variance_mask = np.sqrt(variance) > flux
 
         flux[large_variance_mask] = np.nan
 
@@ -255,10 +576,12 @@ class Interpolate(FileDirectory, MetaData):
 
 def shared_data(
     input_counter: mp.Value,
-    input_meta_data: pd.DataFrame,
+    input_meta_data: dict,
     input_grid_parameters: dict,
     input_raw_data_directory: str,
     shared_arrays_parameters: tuple,
+    input_dust_parameters: dict = None,
+    input_sky_lines: dict = None,
 ) -> None:
 
     """
@@ -266,7 +589,8 @@ def shared_data(
 
     INPUTS
     input_counter: value with lock to track each spectrum
-    input_meta_data: data frame with meda data of all spectra
+    input_meta_data: ebv and z of all spectra in shared memory,
+        output of SpecObjIndex.to_shared
     input_grid_parameters:
         {
             "upper": upper bound in wavelength common grid,
@@ -283,6 +607,9 @@ def shared_data(
             its specobjid in the spectra array
         ids_shape: (number_of_spectra, 2)
             column 0: spectra id, column 1: specobjid
+    input_dust_parameters: dust_law and r_v of Interpolate, if None
+        the defaults are used
+    input_sky_lines: sky_lines of Interpolate
 
     """
 
@@ -296,7 +623,7 @@ def shared_data(
     global interpolator
 
     counter = input_counter
-    meta_data = input_meta_data
+    meta_data = SpecObjIndex.from_shared(input_meta_data)
     grid_parameters = input_grid_parameters
     raw_data_directory = input_raw_data_directory
 
@@ -316,6 +643,8 @@ def shared_data(
         meta_data_df=meta_data,
         raw_data_dir=raw_data_directory,
         wave_parameters=grid_parameters,
+        sky_lines=input_sky_lines,
+        **(input_dust_parameters or {}),
     )
 
 
@@ -355,3 +684,48 @@ def worker_interpolation(specobjid: int) -> None:
     index_track = np.array([counter_value, specobjid], dtype=np.uint)
 
     track_indexes[counter_value, :] = index_track
+
+
+def worker_interpolation_block(specobjids: np.array) -> None:
+
+    """
+    Worker to interpolate a block of spectra in parallel with
+    Interpolate.interpolate_block, same workflow as
+    worker_interpolation
+
+    INPUTS
+    specobjids: unique identifiers of the spectra in the block
+    """
+
+    positions = meta_data.positions(specobjids)
+
+    try:
+
+        block_spectra, block_variance = interpolator.interpolate_block(
+            *interpolator.lattice_block(specobjids),
+            z=meta_data.columns["z"][positions],
+            ebv=meta_data.columns["ebv"][positions],
+        )
+
+    except ValueError:
+
+        # spectra off the lattice or with different dtypes
+        block = [interpolator.interpolate(idx) for idx in specobjids]
+
+        block_spectra = np.array([spectrum for spectrum, _ in block])
+        block_variance = np.array([variance for _, variance in block])
+
+    with counter.get_lock():
+
+        counter_value = counter.value
+        counter.value += len(specobjids)
+
+        print(f"[{counter_value}] Interpolate block", end="\r")
+
+    rows = slice(counter_value, counter_value + len(specobjids))
+
+    spectra[rows, :] = block_spectra
+    variance_of_spectra[rows, :] = block_variance
+
+    track_indexes[rows, 0] = np.arange(rows.start, rows.stop)
+    track_indexes[rows, 1] = specobjids
@@ -0,0 +1,240 @@
+"""
+Fill windows around sky and airglow lines with the average flux of
+the neighboring segments. Windows are found with a binary search on
+the sorted wavelengths and their pixel indices are computed once per
+set of windows, hence all windows of a spectrum are filled in one
+vectorized pass
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+# name: (lower, upper) wavelengths in Angstroms of the window in the
+# observer frame, both bounds excluded
+SKY_LINES = {"OI_5577": (5565, 5590)}
+
+# sets of window indices kept in memory, spectra with the same size
+# and windows share them and the least recently used are dropped,
+# hence memory stays bounded in long runs
+INDICES_CACHE_SIZE = 1024
+
+
+class SkyLineMask:
+    """Fill the windows of a list of sky lines"""
+
+    def __init__(self, lines: dict = None):
+        """
+        INPUTS
+        lines: {name: (lower, upper)}, see SKY_LINES, the default
+        """
+
+        lines = SKY_LINES if lines is None else lines
+
+        bounds = np.array(list(lines.values()), dtype=np.float64)
+        bounds = bounds.reshape(-1, 2)
+
+        if np.any(bounds[:, 0] >= bounds[:, 1]):
+            raise ValueError(f"Windows need lower < upper: {lines}")
+
+        self.lines = lines
+        self.lower = bounds[:, 0]
+        self.upper = bounds[:, 1]
+
+    def windows(self, wave: np.array) -> tuple:
+        """
+        INPUTS
+        wave: sorted wavelengths of a spectrum in observer frame
+
+        OUTPUT
+        left, right: first pixel and one past the last pixel of the
+            window of each line, left == right for empty windows
+        """
+
+        left = np.searchsorted(wave, self.lower, side="right")
+        right = np.searchsorted(wave, self.upper, side="left")
+
+        return left, right
+
+    def indices(self, wave: np.array) -> dict:
+        """
+        Pixels of the windows and of their neighboring segments. As
+        in the original [OI]5577 fill, a window of n pixels takes the
+        average of the n pixels before it and the n pixels from its
+        last pixel on
+
+        INPUTS
+        wave: sorted wavelengths of a spectrum in observer frame
+
+        OUTPUT
+        indices: None if no window has pixels, otherwise {
+            "window", "before", "after": pixels of the windows and
+                of the segments, "before" and "after" are clipped
+                to the spectrum
+            "has_before", "has_after": False for pixels of the
+                segments out of the spectrum
+            "complete": True if all segments are in the spectrum
+        }
+        """
+
+        left, right = self.windows(wave)
+
+        pixels = tuple(
+            (lo, hi)
+            for lo, hi in zip(left.tolist(), right.tolist())
+            if lo < hi
+        )
+
+        if len(pixels) == 0:
+            return None
+
+        return window_indices(wave.size, pixels)
+
+    def fill(self, wave: np.array, flux: np.array) -> np.array:
+        """
+        Fill, in place, the windows of a spectrum. Near the edges of
+        the spectrum the segment that is available is used, windows
+        without any neighboring pixel are set to NaN
+
+        INPUTS
+        wave: sorted wavelengths of the spectrum in observer frame
+        flux: flux of the spectrum
+
+        OUTPUT
+        flux: same array with the windows filled
+        """
+
+        indices = self.indices(wave)
+
+        if indices is None:
+            return flux
+
+        before = flux[indices["before"]]
+        after = flux[indices["after"]]
+
+        average = (before + after) / 2.0
+
+        if indices["complete"] is False:
+
+            has_before = indices["has_before"]
+            has_after = indices["has_after"]
+
+            average = np.where(
+                has_before & has_after,
+                average,
+                np.where(has_before, before, after),
+            )
+            average[~(has_before | has_after)] = np.nan
+
+        flux[indices["window"]] = average
+
+        return flux
+
+    def fill_block(
+        self,
+        wave: np.array,
+        flux: np.array,
+        starts: np.array,
+        stops: np.array,
+        lattice: np.array,
+    ) -> np.array:
+        """
+        Fill, in place, a block of spectra on common lattice columns.
+        Spectra with their windows in the columns of the lattice
+        windows and with complete segments are filled at once, the
+        others one by one
+
+        INPUTS
+        wave, flux: (number_spectra, number_columns) wavelengths and
+            fluxes of each spectrum in observer frame
+        starts, stops: first column and one past the last column of
+            each spectrum
+        lattice: wavelengths of the lattice in the columns
+
+        OUTPUT
+        flux: same array with the windows filled
+        """
+
+        indices = self.indices(lattice)
+        left, right = self.windows(lattice)
+
+        number_columns = lattice.size
+
+        def column(pixels: np.array) -> np.array:
+            return np.clip(pixels, 0, number_columns - 1)
+
+        # windows of each spectrum in the same columns as the lattice
+        # windows, bounds without a column are not checked
+        inside = (
+            np.all(
+                (wave[:, column(left - 1)] <= self.lower) | (left == 0),
+                axis=1,
+            )
+            & np.all(
+                (wave[:, column(left)] > self.lower)
+                | (left == number_columns),
+                axis=1,
+            )
+            & np.all(
+                (wave[:, column(right - 1)] < self.upper) | (right == 0),
+                axis=1,
+            )
+            & np.all(
+                (wave[:, column(right)] >= self.upper)
+                | (right == number_columns),
+                axis=1,
+            )
+        )
+
+        if indices is not None:
+
+            # segments in each spectrum
+            inside &= indices["complete"]
+            inside &= starts <= indices["before"].min()
+            inside &= stops > indices["after"].max()
+
+            rows = np.flatnonzero(inside)[:, None]
+
+            flux[rows, indices["window"]] = (
+                flux[rows, indices["before"]] + flux[rows, indices["after"]]
+            ) / 2.0
+
+        for row in np.flatnonzero(~inside):
+
+            columns = slice(starts[row], stops[row])
+
+            self.fill(wave[row, columns], flux[row, columns])
+
+        return flux
+
+
+@lru_cache(maxsize=INDICES_CACHE_SIZE)
+def window_indices(size: int, pixels: tuple) -> dict:
+    """
+    INPUTS
+    size: number of pixels of the spectrum
+    pixels: ((left, right), ...) first pixel and one past the last
+        pixel of each window with pixels, see SkyLineMask.windows
+
+    OUTPUT
+    indices: see SkyLineMask.indices, shared among calls, hence it
+        must not be modified
+    """
+
+    window = np.concatenate([np.arange(lo, hi) for lo, hi in pixels])
+    before = np.concatenate([np.arange(2 * lo - hi, lo) for lo, hi in pixels])
+    after = np.concatenate(
+        [np.arange(hi - 1, 2 * hi - lo - 1) for lo, hi in pixels]
+    )
+
+    has_before = before >= 0
+    has_after = after < size
+
+    return {
+        "window": window,
+        "before": np.maximum(before, 0),
+        "after": np.minimum(after, size - 1),
+        "has_before": has_before,
+        "has_after": has_after,
+        "complete": bool(np.all(has_before) and np.all(has_after)),
+    }
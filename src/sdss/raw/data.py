@@ -8,22 +8,30 @@ import pandas as pd
 
 from sdss.utils.managefiles import FileDirectory
 from sdss.metadata import MetaData
+from sdss.metastore import MetaDataStore
+from sdss.pixelmask import pixel_mask_bits
+from sdss.raw.fitstable import read_lite_spectrum
+from sdss.raw.headers import HEADER_KEYWORDS, TABLE_COLUMNS
+from sdss.raw.headers import harvest_names, headers_data_frame, read_headers
+from sdss.raw.incremental import ExtractionIndex, source_stats
+from sdss.raw.packed import PackedSpectra, PackedSpectraWriter
+from sdss.raw.prune import Pruner
+from sdss.specobjindex import SpecObjIndex
 
 ###############################################################################
-def init_worker(
-    input_counter: "mp.Value", input_df: "pandas dataframe"
-) -> "None":
+def init_worker(input_counter: "mp.Value", input_index: "dict") -> "None":
     """
     Initialize worker
     PARAMETERS
         counter: counts the number of the child process
-        input_df: pandas dataframe to be accessible to each child
+        input_index: sas_directory and spectrum_name of each file in
+            shared memory, output of SpecObjIndex.to_shared
     """
     global counter
-    global files_df
+    global files_index
 
     counter = input_counter
-    files_df = input_df
+    files_index = SpecObjIndex.from_shared(input_index)
 
 
 ###############################################################################
@@ -35,6 +43,10 @@ class RawData(FileDirectory, MetaData):
         data_directory: str,
         output_directory: str,
         number_processes: int,
+        storage: str = "npy",
+        shard_size: int = 2**28,
+        dtype: str = "float64",
+        incremental: bool = False,
     ):
         """
         PARAMETERS
@@ -42,6 +54,14 @@ class RawData(FileDirectory, MetaData):
             data_directory : sdss raw data's directory
             output_directory : save here .npy files
             number_processes : number of processes to use with mp.Pool
+            storage : npy for a {specobjid}.npy file per spectrum,
+                packed for shards of many spectra, see
+                sdss.raw.packed
+            shard_size : bytes of spectra per shard with packed storage
+            dtype : float64 or float32, dtype of saved spectra
+            incremental : if True, save_raw_data extracts only
+                spectra whose fits file is not in the extraction
+                index or changed since, see sdss.raw.incremental
 
         OUTPUT
             RawData object
@@ -49,6 +69,14 @@ class RawData(FileDirectory, MetaData):
 
         self.number_processes = number_processes
 
+        if storage not in ("npy", "packed"):
+            raise ValueError(f"storage must be npy or packed: {storage}")
+
+        self.storage = storage
+        self.shard_size = shard_size
+        self.dtype = np.dtype(dtype)
+        self.incremental = incremental
+
         super().check_directory(data_directory, exit_program=True)
         self.data_directory = data_directory
 
@@ -66,68 +94,350 @@ class RawData(FileDirectory, MetaData):
         """
         print("Remove files...")
 
-        # I use specobjid as the index in the data frame
+        files_df = self.with_sas_paths(files_df)
+
+        locations = (
+            f"{self.data_directory}/"
+            + files_df["sas_directory"]
+            + "/"
+            + files_df["spectrum_name"]
+            + ".fits"
+        ).tolist()
+
+        # a batch of files per thread instead of a process per file
+        number_failed = Pruner(dry_run=False).remove(locations)
+
+        print(f"Remove files finish, {number_failed} files not found")
+
+    ###########################################################################
+    def _files_index(self, files_df: "pandas dataframe") -> "SpecObjIndex":
+        """
+        Index with the location of each file for lookups in workers
+
+        PARAMETERS
+            files_df: data frame with specobjid as index
+        """
+
+        files_df = self.with_sas_paths(files_df)
+
+        return SpecObjIndex.from_data_frame(
+            files_df, ["sas_directory", "spectrum_name"]
+        )
+
+    ###########################################################################
+    def save_raw_data(
+        self,
+        files_df: "pandas dataframe",
+        columns: "list" = None,
+        reject_flags: "list" = None,
+    ) -> "None":
+        """
+        Save data frame with all meta dat
+
+        PARAMETERS
+            files_df: data frame with meta data of galaxies
+            columns: other columns of the COADD table saved as rows
+                after wave, flux and ivar, e.g. ["and_mask", "sky",
+                "model"], all of them read in the same pass
+            reject_flags: names of and_mask bits, ivar of pixels with
+                any of them is set to zero, e.g. ["NODATA"], see
+                sdss.pixelmask.PIXEL_MASK_BITS
+        """
+
+        print(f"Save wave, flux, ivar!")
+
+        self.columns = columns
+        self.reject_bits = pixel_mask_bits(reject_flags or [])
+
         files_indexes = files_df.index.values
 
+        # paths are formatted once here instead of in each worker
+        files_index = self._files_index(files_df)
+
+        if self.incremental is True:
+            self._save_incremental(files_df, files_index)
+            return
+
+        if self.storage == "packed":
+            self._save_packed_data(files_indexes, files_index)
+            return
+
         counter = mp.Value("i", 0)
 
         with mp.Pool(
             processes=self.number_processes,
             initializer=init_worker,
-            initargs=(counter, files_df),
+            initargs=(counter, files_index.to_shared()),
         ) as pool:
 
-            pool.map(self._remove_fits_file, files_indexes)
+            results = pool.map(self._get_data, files_indexes)
 
-        print("Remove files finish...")
+        number_fail = sum(results)
+        print(f"Fail with {number_fail} files")
 
     ###########################################################################
-    def _remove_fits_file(self, file_index: "int") -> "None":
+    def _save_incremental(
+        self, files_df: "pandas dataframe", files_index: "SpecObjIndex"
+    ) -> "None":
         """
-        Remove file
+        Plan with the extraction index and the files on disk, then
+        extract only new or changed spectra. Workers do not check if
+        files exist, the plan already did
+
         PARAMETERS
-            file_index: specobjid of the object
+            files_df: data frame with meta data of galaxies
+            files_index: location of each file, see _files_index
         """
 
-        file_row = files_df.loc[file_index]
+        specobjids = files_df.index.to_numpy(dtype=np.int64)
+
+        positions = files_index.positions(specobjids)
 
-        [file_directory, spectrum_name] = super().get_file_location_sas(
-            file_row
+        mtimes, sizes = source_stats(
+            self.data_directory,
+            files_index.columns["sas_directory"][positions].astype(str),
+            files_index.columns["spectrum_name"][positions].astype(str),
         )
 
-        file_location = f"{file_directory}/{spectrum_name}.fits"
+        extraction_index = ExtractionIndex(self.output_directory)
 
-        with counter.get_lock():
-            counter.value += 1
-            print(f"[{counter.value}] Remove {spectrum_name}", end="\r")
+        exists = sizes >= 0
+        changed = exists & extraction_index.changed(specobjids, mtimes, sizes)
+
+        print(
+            f"{np.count_nonzero(~exists)} files missing, "
+            f"{np.count_nonzero(changed)} new or changed, "
+            f"{np.count_nonzero(exists & ~changed)} up to date"
+        )
+
+        specobjids = specobjids[changed]
+        mtimes = mtimes[changed]
+        sizes = sizes[changed]
+
+        writer = None
+
+        if self.storage == "packed":
+            writer = PackedSpectraWriter(
+                self.output_directory, self.shard_size
+            )
+
+        counter = mp.Value("i", 0)
+        extracted = np.zeros(specobjids.size, dtype=bool)
+
+        with mp.Pool(
+            processes=self.number_processes,
+            initializer=init_worker,
+            initargs=(counter, files_index.to_shared()),
+        ) as pool:
+
+            results = pool.imap(self._extract_data, specobjids, chunksize=64)
+
+            for position, (file_index, result) in enumerate(results):
+
+                if result is None:
+                    continue
+
+                if writer is not None:
+                    writer.add(file_index, result)
+
+                extracted[position] = True
+
+                if position % 1000 == 0:
+                    print(f"[{position}] Get {file_index}", end="\r")
+
+        if writer is not None:
+            writer.close()
 
-        super().remove_file(file_location)
+        # saved after the shards, a crash means extracting again
+        extraction_index.update(
+            specobjids[extracted], mtimes[extracted], sizes[extracted]
+        )
+
+        print(f"Fail with {np.count_nonzero(~extracted)} files")
 
     ###########################################################################
-    def save_raw_data(self, files_df: "pandas dataframe") -> "None":
+    def _extract_data(self, file_index: "int") -> "tuple":
         """
-        Save data frame with all meta dat
+        Worker of _save_incremental
+
+        PARAMETERS
+            file_index: specobjid of a galaxy
+
+        OUTPUT
+            (file_index, result): result is None if the file cannot
+            be read, True once saved as .npy and the array with wave,
+            flux and ivar with packed storage
+        """
+
+        sas_directory = files_index.get(file_index, "sas_directory")
+        spectrum_name = files_index.get(file_index, "spectrum_name")
+
+        file_location = (
+            f"{self.data_directory}/{sas_directory}/{spectrum_name}.fits"
+        )
+
+        warnings.filterwarnings(action="error")
+
+        try:
+
+            wave_flux_ivar = self.wave_flux_ivar(
+                file_location,
+                file_index,
+                self.dtype,
+                self.columns,
+                self.reject_bits,
+            )
+
+        except Exception as e:
+
+            print(f"Problem with {spectrum_name}")
+            print(e)
+
+            return file_index, None
+
+        if self.storage == "packed":
+            return file_index, wave_flux_ivar
+
+        np.save(f"{self.output_directory}/{file_index}.npy", wave_flux_ivar)
+
+        return file_index, True
+
+    ###########################################################################
+    def _save_packed_data(
+        self, files_indexes: "np.array", files_index: "SpecObjIndex"
+    ) -> "None":
+        """
+        Workers read fits files and this process appends the arrays
+        to the shards of the packed store in output_directory
+
+        PARAMETERS
+            files_indexes: specobjids to save
+            files_index: location of each file, see _files_index
+        """
+
+        # spectra already in the store are not read again
+        packed = PackedSpectra(self.output_directory)
+        is_saved = np.isin(files_indexes, packed.specobjids)
+
+        print(f"Data of {np.count_nonzero(is_saved)} spectra already saved")
+
+        files_indexes = files_indexes[~is_saved]
+
+        writer = PackedSpectraWriter(self.output_directory, self.shard_size)
+
+        counter = mp.Value("i", 0)
+        number_fail = 0
+
+        with mp.Pool(
+            processes=self.number_processes,
+            initializer=init_worker,
+            initargs=(counter, files_index.to_shared()),
+        ) as pool:
+
+            for file_index, wave_flux_ivar in pool.imap_unordered(
+                self._read_data, files_indexes, chunksize=16
+            ):
+
+                if wave_flux_ivar is None:
+                    number_fail += 1
+                    continue
+
+                writer.add(file_index, wave_flux_ivar)
+
+        writer.close()
+
+        print(f"Fail with {number_fail} files")
+
+    ###########################################################################
+    def save_headers(
+        self,
+        files_df: "pandas dataframe",
+        save_to: "str",
+        header_keywords: "dict" = None,
+        table_columns: "dict" = None,
+    ) -> "pd.DataFrame":
+        """
+        Harvest header keywords and the SPALL row of each fits file
+        into a MetaDataStore, data units are not read
 
         PARAMETERS
             files_df: data frame with meta data of galaxies
+            save_to: location of the store, e.g.
+                {output_directory}/headers
+            header_keywords: {hdu: [keyword, ...]}, see
+                sdss.raw.headers.HEADER_KEYWORDS
+            table_columns: {hdu: [column, ...]}, see
+                sdss.raw.headers.TABLE_COLUMNS
+
+        OUTPUT
+            headers_df: harvested values with specobjid as index,
+                files that cannot be read are left out
         """
 
-        print(f"Save wave, flux, ivar!")
+        print("Harvest headers!")
+
+        self.header_keywords = header_keywords
+        self.table_columns = table_columns
+
+        names = harvest_names(
+            header_keywords or HEADER_KEYWORDS,
+            table_columns or TABLE_COLUMNS,
+        )
 
         files_indexes = files_df.index.values
+        files_index = self._files_index(files_df)
 
         counter = mp.Value("i", 0)
 
         with mp.Pool(
             processes=self.number_processes,
             initializer=init_worker,
-            initargs=(counter, files_df),
+            initargs=(counter, files_index.to_shared()),
         ) as pool:
 
-            results = pool.map(self._get_data, files_indexes)
+            results = pool.map(self._read_headers, files_indexes, 64)
 
-        number_fail = sum(results)
-        print(f"Fail with {number_fail} files")
+        results = [result for result in results if result[1] is not None]
+
+        print(f"Fail with {files_indexes.size - len(results)} files")
+
+        headers_df = headers_data_frame(
+            [specobjid for specobjid, _ in results],
+            [values for _, values in results],
+            names,
+        )
+
+        MetaDataStore(save_to).write(headers_df, dtypes={})
+
+        return headers_df
+
+    ###########################################################################
+    def _read_headers(self, file_index: "int") -> "tuple":
+        """
+        OUTPUT
+            (file_index, values), values is None if the file is
+            missing or cannot be read, see sdss.raw.headers
+        """
+
+        file_location = self._file_location(file_index)
+
+        if file_location is None:
+            return file_index, None
+
+        try:
+
+            values = read_headers(
+                file_location, self.header_keywords, self.table_columns
+            )
+
+            return file_index, values
+
+        except Exception as e:
+
+            print(f"Problem with {file_location}")
+            print(e)
+
+            return file_index, None
 
     ###########################################################################
     def _get_data(self, file_index: "int") -> "int":
@@ -143,12 +453,78 @@ class RawData(FileDirectory, MetaData):
             0 for successful operation, 1 otherwise
         """
 
-        file_row = files_df.loc[file_index]
+        spectrum_name = files_index.get(file_index, "spectrum_name")
+
+        # spectra taken from spPlate files have no lite file
+        save_to = f"{self.output_directory}/{file_index}.npy"
 
-        [sas_directory, spectrum_name] = super().get_file_location_sas(
-            file_row
+        if super().file_exists(save_to, exit_program=False):
+            print(f"Data of {spectrum_name} already saved!", end="\r")
+            return 0
+
+        file_location = self._file_location(file_index)
+
+        if file_location is None:
+            return 1
+
+        result = self._get_save_wave_flux_ivar(
+            file_index, file_location, spectrum_name
         )
 
+        return result
+
+    ###########################################################################
+    def _read_data(self, file_index: "int") -> "tuple":
+        """
+        Read data from spectrum corresponding to file_index, the
+        caller saves it
+
+        PARAMETERS
+            file_index: specobjid of a galaxy
+
+        OUTPUT
+            (file_index, wave_flux_ivar), wave_flux_ivar is None if
+            the file is missing or cannot be read
+        """
+
+        file_location = self._file_location(file_index)
+
+        if file_location is None:
+            return file_index, None
+
+        warnings.filterwarnings(action="error")
+
+        try:
+
+            wave_flux_ivar = self.wave_flux_ivar(
+                file_location,
+                file_index,
+                self.dtype,
+                self.columns,
+                self.reject_bits,
+            )
+
+            return file_index, wave_flux_ivar
+
+        except Exception as e:
+
+            print(f"Problem with {file_location}")
+            print(e)
+
+            return file_index, None
+
+    ###########################################################################
+    def _file_location(self, file_index: "int") -> "str":
+        """
+        Location of the fits file of file_index in a worker
+
+        OUTPUT
+            file_location: None if the file does not exist
+        """
+
+        sas_directory = files_index.get(file_index, "sas_directory")
+        spectrum_name = files_index.get(file_index, "spectrum_name")
+
         file_location = (
             f"{self.data_directory}/{sas_directory}/{spectrum_name}.fits"
         )
@@ -156,17 +532,13 @@ class RawData(FileDirectory, MetaData):
         if not super().file_exists(file_location, exit_program=False):
             print(file_location)
 
-            return 1
+            return None
 
         with counter.get_lock():
             counter.value += 1
             print(f"[{counter.value}] Get {spectrum_name}", end="\r")
 
-        result = self._get_save_wave_flux_ivar(
-            file_index, file_location, spectrum_name
-        )
-
-        return result
+        return file_location
 
     ###########################################################################
     def _get_save_wave_flux_ivar(
@@ -195,26 +567,17 @@ class RawData(FileDirectory, MetaData):
 
         save_to = f"{self.output_directory}/{file_index}.npy"
 
-        if super().file_exists(save_to, exit_program=False):
-            print(f"Data of {spectrum_name} already saved!", end="\r")
-            return 0
-
         warnings.filterwarnings(action="error")
 
         try:
 
-            hdul = pyfits.open(file_location, memmap=False)
-
-            wave = np.array(10.0 ** (hdul[1].data["loglam"]), dtype=float)
-            flux = hdul[1].data["flux"]
-            ivar = hdul[1].data["ivar"]
-            specobjid = int(hdul[2].data["specobjid"].item())
-
-            assert specobjid == file_index, "specobjid do not match"
-
-            hdul.close()
-
-            array_to_save = np.vstack((wave, flux, ivar))
+            array_to_save = self.wave_flux_ivar(
+                file_location,
+                file_index,
+                self.dtype,
+                self.columns,
+                self.reject_bits,
+            )
 
             np.save(save_to, array_to_save)
 
@@ -227,5 +590,95 @@ class RawData(FileDirectory, MetaData):
 
             return 1
 
+    ###########################################################################
+    @staticmethod
+    def wave_flux_ivar(
+        fits_file: "str",
+        specobjid: "int",
+        dtype: "np.dtype" = np.float64,
+        columns: "list" = None,
+        reject_bits: "int" = 0,
+    ) -> "np.array":
+        """
+        Get wave, flux and ivar from a lite spectrum
+
+        PARAMETERS
+            fits_file: location of the fits file or a file-like
+                object, e.g. io.BytesIO with a downloaded file
+            specobjid: specobjid expected in the fits file
+            dtype: dtype of the output, e.g. np.float32
+            columns: other columns of the COADD table, see
+                save_raw_data
+            reject_bits: and_mask bits that set ivar to zero, see
+                sdss.pixelmask.pixel_mask_bits
+
+        OUTPUT
+            array with wave, flux, ivar and each column in columns
+            in a row
+        """
+
+        # only loglam, flux, ivar, columns and specobjid are decoded
+        wave_flux_ivar, fits_specobjid = read_lite_spectrum(
+            fits_file, dtype, columns, reject_bits
+        )
+
+        assert fits_specobjid == specobjid, "specobjid do not match"
+
+        return wave_flux_ivar
+
+    ###########################################################################
+    @staticmethod
+    def plate_wave_flux_ivar(fits_file: "str", fiberids: "list") -> "list":
+        """
+        Get wave, flux and ivar of many fibers from a spPlate file
+
+        PARAMETERS
+            fits_file: location of the spPlate file or a file-like
+                object, e.g. io.BytesIO with a downloaded file
+            fiberids: fibers to extract, starting at 1
+
+        OUTPUT
+            list with an array per fiber with wave, flux and ivar
+            in each row, pixels without data at both ends are dropped
+        """
+
+        with pyfits.open(fits_file, memmap=False) as hdul:
+
+            header = hdul[0].header
+
+            # log-linear wavelength solution shared by all fibers
+            loglam = header["COEFF0"] + header["COEFF1"] * np.arange(
+                header["NAXIS1"]
+            )
+            wave = 10.0 ** loglam
+
+            rows = np.asarray(fiberids, dtype=int) - 1
+
+            flux = hdul[0].data[rows]
+            ivar = hdul[1].data[rows]
+
+        spectra = []
+
+        for fiber_flux, fiber_ivar in zip(flux, ivar):
+
+            with_data = np.flatnonzero(fiber_ivar > 0)
+
+            start, stop = 0, wave.size
+
+            if with_data.size > 0:
+                start, stop = with_data[0], with_data[-1] + 1
+
+            spectra.append(
+                np.vstack(
+                    (
+                        wave[start:stop],
+                        fiber_flux[start:stop],
+                        fiber_ivar[start:stop],
+                    )
+                )
+            )
+
+        return spectra
+
 
 ###############################################################################
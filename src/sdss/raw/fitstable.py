@@ -0,0 +1,440 @@
+"""
+Read selected columns of FITS binary tables without astropy. Headers
+are parsed to locate each HDU and a structured dtype with only the
+requested columns, at their byte offsets in a row, gives a view of
+the table bytes. Columns are decoded once, into the output array
+"""
+import io
+import re
+
+import numpy as np
+
+from sdss.pixelmask import reject_pixels
+
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+
+# numpy dtype of the big-endian FITS binary table formats
+TABLE_FORMATS = {
+    "L": "i1",
+    "B": "u1",
+    "I": ">i2",
+    "J": ">i4",
+    "K": ">i8",
+    "E": ">f4",
+    "D": ">f8",
+    "C": ">c8",
+    "M": ">c16",
+}
+
+# bytes per element of formats without a numpy dtype
+FORMAT_BYTES = {"A": 1, "P": 8, "Q": 16}
+
+TFORM_PATTERN = re.compile(r"\s*(\d*)([LXBIJKAEDCMPQ])")
+
+
+###############################################################################
+def file_bytes(fits_file: "str | io.BytesIO | bytes") -> np.array:
+    """
+    PARAMETERS
+        fits_file: location of the fits file, a file-like object,
+            e.g. io.BytesIO with a downloaded file, or bytes
+
+    OUTPUT
+        buffer: uint8 array with the bytes of the file, for BytesIO
+            and bytes it is a view, nothing is copied
+    """
+
+    if isinstance(fits_file, str):
+        with open(fits_file, "rb") as file:
+            fits_file = file.read()
+
+    elif isinstance(fits_file, io.BytesIO):
+        fits_file = fits_file.getbuffer()
+
+    elif not isinstance(fits_file, (bytes, bytearray, memoryview)):
+        fits_file = fits_file.read()
+
+    return np.frombuffer(fits_file, dtype=np.uint8)
+
+
+###############################################################################
+def read_header(buffer: np.array, offset: int) -> tuple:
+    """
+    PARAMETERS
+        buffer: bytes of the file, see file_bytes
+        offset: position of the first card of the header
+
+    OUTPUT
+        (header, data_offset): header is a dictionary with the value
+            of each keyword, data_offset the position of the data of
+            the HDU
+    """
+
+    header = {}
+
+    while True:
+
+        if offset + BLOCK_SIZE > buffer.size:
+            raise ValueError("FITS header without END card")
+
+        block = buffer[offset : offset + BLOCK_SIZE].tobytes()
+        offset += BLOCK_SIZE
+
+        if _parse_block(block, header):
+            return header, offset
+
+
+###############################################################################
+def _parse_block(block: bytes, header: dict) -> bool:
+    """
+    Add the cards of a header block to header
+
+    OUTPUT
+        True if the block has the END card
+    """
+
+    block = block.decode("ascii")
+
+    for start in range(0, BLOCK_SIZE, CARD_SIZE):
+
+        card = block[start : start + CARD_SIZE]
+        keyword = card[:8].strip()
+
+        if keyword == "END":
+            return True
+
+        if card[8:10] == "= ":
+            header[keyword] = _card_value(card[10:])
+
+    return False
+
+
+###############################################################################
+def _card_value(value: str) -> object:
+    """Value of a card, after the value indicator"""
+
+    value = value.strip()
+
+    if value.startswith("'"):
+        # quotes inside strings are written twice
+        text = re.match(r"'((?:[^']|'')*)'", value).group(1)
+        return text.replace("''", "'").rstrip()
+
+    value = value.split("/")[0].strip()
+
+    if value in ("T", "F"):
+        return value == "T"
+
+    try:
+        return int(value)
+
+    except ValueError:
+        pass
+
+    try:
+        return float(value.replace("D", "E"))
+
+    except ValueError:
+        return value
+
+
+###############################################################################
+def hdu_locations(buffer: np.array, number_hdus: int = None) -> list:
+    """
+    PARAMETERS
+        buffer: bytes of the file, see file_bytes
+        number_hdus: stop after this number of HDUs, if None, every
+            HDU in the file is located
+
+    OUTPUT
+        locations: (header, data_offset) of each HDU
+    """
+
+    locations = []
+    offset = 0
+
+    while offset < buffer.size:
+
+        if number_hdus is not None and len(locations) == number_hdus:
+            break
+
+        header, data_offset = read_header(buffer, offset)
+        locations.append((header, data_offset))
+
+        offset = data_offset + padded_data_size(header)
+
+    return locations
+
+
+###############################################################################
+def padded_data_size(header: dict) -> int:
+    """Bytes of the data unit of an HDU, with the padding of its block"""
+
+    number_axes = header.get("NAXIS", 0)
+
+    if number_axes == 0:
+        return 0
+
+    axes = [header[f"NAXIS{n}"] for n in range(1, number_axes + 1)]
+    number_values = int(np.prod(axes))
+
+    data_size = (
+        abs(header["BITPIX"])
+        // 8
+        * header.get("GCOUNT", 1)
+        * (header.get("PCOUNT", 0) + number_values)
+    )
+
+    # data is padded to a whole number of blocks
+    return -(-data_size // BLOCK_SIZE) * BLOCK_SIZE
+
+
+###############################################################################
+def file_headers(file: "io.BufferedReader", number_hdus: int) -> list:
+    """
+    Read headers without data: header blocks are read and data units
+    are skipped with a seek
+
+    PARAMETERS
+        file: fits file opened in binary mode
+        number_hdus: number of HDUs to read, starting at the primary
+
+    OUTPUT
+        locations: (header, data_offset) of each HDU, as in
+            hdu_locations
+    """
+
+    locations = []
+    offset = 0
+
+    while len(locations) < number_hdus:
+
+        file.seek(offset)
+        header = {}
+
+        while True:
+
+            block = file.read(BLOCK_SIZE)
+            offset += BLOCK_SIZE
+
+            if len(block) < BLOCK_SIZE:
+                raise ValueError("FITS header without END card")
+
+            if _parse_block(block, header):
+                break
+
+        locations.append((header, offset))
+        offset += padded_data_size(header)
+
+    return locations
+
+
+###############################################################################
+def table_names(header: dict) -> list:
+    """Names of the columns of a binary table in upper case"""
+
+    return [
+        header.get(f"TTYPE{number}", "").upper()
+        for number in range(1, header["TFIELDS"] + 1)
+    ]
+
+
+###############################################################################
+def read_table_row(
+    file: "io.BufferedReader", location: tuple, columns: list, row: int = 0
+) -> np.array:
+    """
+    Read a single row of a binary table, e.g. the SPALL row in HDU 2
+    of lite spectra, without the rest of the data unit
+
+    PARAMETERS
+        file: fits file opened in binary mode
+        location: (header, data_offset) of the table, see file_headers
+        columns: names of the columns to read
+        row: position of the row, starting at 0
+
+    OUTPUT
+        row: structured scalar with a field per column
+    """
+
+    header, data_offset = location
+
+    if header.get("XTENSION") != "BINTABLE":
+        raise ValueError(f"Not a binary table: {header.get('XTENSION')}")
+
+    file.seek(data_offset + row * header["NAXIS1"])
+    row_bytes = file.read(header["NAXIS1"])
+
+    return np.frombuffer(row_bytes, dtype=column_dtype(header, columns))[0]
+
+
+###############################################################################
+def column_dtype(header: dict, columns: list) -> np.dtype:
+    """
+    PARAMETERS
+        header: header of a binary table
+        columns: names of the columns to read, case insensitive as in
+            astropy
+
+    OUTPUT
+        dtype: structured dtype of a row with only the columns in
+            columns at their offsets, the other bytes are skipped
+    """
+
+    wanted = {name.lower(): name for name in columns}
+
+    names, formats, offsets = [], [], []
+    offset = 0
+
+    for number in range(1, header["TFIELDS"] + 1):
+
+        repeat, code = TFORM_PATTERN.match(header[f"TFORM{number}"]).groups()
+        repeat = int(repeat) if repeat else 1
+
+        if code == "X":
+            size = -(-repeat // 8)
+        elif code in FORMAT_BYTES:
+            size = repeat * FORMAT_BYTES[code]
+        else:
+            size = repeat * np.dtype(TABLE_FORMATS[code]).itemsize
+
+        name = header.get(f"TTYPE{number}", "").lower()
+
+        if name in wanted:
+
+            if code == "A":
+                column_format = f"S{repeat}"
+            elif code in TABLE_FORMATS and repeat > 1:
+                column_format = (TABLE_FORMATS[code], (repeat,))
+            elif code in TABLE_FORMATS:
+                column_format = TABLE_FORMATS[code]
+            else:
+                raise ValueError(f"Column {name} has format {code}")
+
+            names.append(wanted.pop(name))
+            formats.append(column_format)
+            offsets.append(offset)
+
+        offset += size
+
+    if len(wanted) > 0:
+        raise KeyError(f"Columns not in table: {list(wanted.values())}")
+
+    if offset != header["NAXIS1"]:
+        raise ValueError(f"Row has {header['NAXIS1']} bytes, TFORM {offset}")
+
+    return np.dtype(
+        {
+            "names": names,
+            "formats": formats,
+            "offsets": offsets,
+            "itemsize": offset,
+        }
+    )
+
+
+###############################################################################
+def table_columns(
+    buffer: np.array, location: tuple, columns: list
+) -> np.array:
+    """
+    PARAMETERS
+        buffer: bytes of the file, see file_bytes
+        location: (header, data_offset) of a binary table, see
+            hdu_locations
+        columns: names of the columns to read
+
+    OUTPUT
+        table: structured array with a field per column, a view of
+            buffer in the byte order of the file
+    """
+
+    header, data_offset = location
+
+    if header.get("XTENSION") != "BINTABLE":
+        raise ValueError(f"Not a binary table: {header.get('XTENSION')}")
+
+    table = np.ndarray(
+        shape=(header["NAXIS2"],),
+        dtype=column_dtype(header, columns),
+        buffer=buffer,
+        offset=data_offset,
+    )
+
+    return table
+
+
+###############################################################################
+def read_lite_spectrum(
+    fits_file: "str | io.BytesIO | bytes",
+    dtype: "np.dtype" = np.float64,
+    columns: list = None,
+    reject_bits: int = 0,
+) -> tuple:
+    """
+    Get wave, flux and ivar from a lite spectrum
+
+    PARAMETERS
+        fits_file: location of the fits file, a file-like object or
+            bytes, see file_bytes
+        dtype: dtype of the output, e.g. np.float32 for half the
+            memory of the default
+        columns: other columns of the COADD table to add as rows
+            after wave, flux and ivar, e.g. ["and_mask", "sky"]
+        reject_bits: ivar is set to zero where and_mask has any of
+            these bits, see sdss.pixelmask
+
+    OUTPUT
+        (wave_flux_ivar, specobjid): array in native byte order with
+            wave, flux, ivar and each column in columns in a row, and
+            the specobjid in HDU 2
+    """
+
+    columns = list(columns or [])
+
+    buffer = file_bytes(fits_file)
+    locations = hdu_locations(buffer, number_hdus=3)
+
+    coadd_columns = ["loglam", "flux", "ivar", *columns]
+
+    if reject_bits != 0 and "and_mask" not in coadd_columns:
+        coadd_columns.append("and_mask")
+
+    coadd = table_columns(buffer, locations[1], coadd_columns)
+    spall = table_columns(buffer, locations[2], ["specobjid"])
+
+    dtype = np.dtype(dtype)
+
+    for name in columns:
+
+        # e.g. bits of and_mask above 2**24 do not fit in float32
+        integer = coadd[name].dtype
+
+        if integer.kind in "iu" and integer.itemsize >= dtype.itemsize:
+            raise ValueError(f"{name} does not fit in {dtype}")
+
+    loglam = coadd["loglam"]
+
+    wave_flux_ivar = np.empty((3 + len(columns), coadd.size), dtype=dtype)
+
+    # 10**loglam in the precision of the column, as astropy data does
+    np.power(
+        10,
+        loglam,
+        out=wave_flux_ivar[0],
+        dtype=loglam.dtype.newbyteorder("="),
+    )
+
+    wave_flux_ivar[1] = coadd["flux"]
+    wave_flux_ivar[2] = coadd["ivar"]
+
+    for row, name in enumerate(columns, start=3):
+        wave_flux_ivar[row] = coadd[name]
+
+    if reject_bits != 0:
+        reject_pixels(wave_flux_ivar[2], coadd["and_mask"], reject_bits)
+
+    specobjid = int(spall["specobjid"][0])
+
+    return wave_flux_ivar, specobjid
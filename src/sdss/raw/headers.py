@@ -0,0 +1,154 @@
+"""
+Harvest header keywords and the SPALL row of lite spectra into a
+table keyed by specobjid. Only header blocks and a single table row
+are read from each file, data units are skipped, hence the whole
+archive can be scanned to select a sample before any extraction
+"""
+import numpy as np
+import pandas as pd
+
+from sdss.raw.fitstable import file_headers, read_table_row, table_names
+
+# keywords of the header of each HDU, by position of the HDU
+HEADER_KEYWORDS = {
+    0: [
+        "PLATEID",
+        "MJD",
+        "FIBERID",
+        "EXPTIME",
+        "NEXP",
+        "AIRMASS",
+        "SEEING50",
+        "COEFF0",
+        "COEFF1",
+    ],
+    # number of pixels of the spectrum
+    1: ["NAXIS2"],
+}
+
+# columns of the single row of a table HDU, by position of the HDU
+TABLE_COLUMNS = {
+    2: ["PLATEQUALITY", "PLATESN2", "SN_MEDIAN_ALL", "ZWARNING"],
+}
+
+
+###############################################################################
+def harvest_names(header_keywords: dict, table_columns: dict) -> list:
+    """
+    Names of the harvested values in the output table, keywords and
+    columns in lower case
+
+    Raises ValueError if a name is requested from two HDUs or if it
+    is specobjid, the index of the table
+    """
+
+    names = [
+        name.lower()
+        for requested in (header_keywords, table_columns)
+        for names in requested.values()
+        for name in names
+    ]
+
+    repeated = {name for name in names if names.count(name) > 1}
+
+    if len(repeated) > 0:
+        raise ValueError(f"Names requested from two HDUs: {repeated}")
+
+    if "specobjid" in names:
+        raise ValueError("specobjid is the index of the harvested table")
+
+    return names
+
+
+###############################################################################
+def read_headers(
+    fits_file: str,
+    header_keywords: dict = None,
+    table_columns: dict = None,
+) -> dict:
+    """
+    PARAMETERS
+        fits_file: location of the fits file
+        header_keywords: {hdu: [keyword, ...]}, if None,
+            HEADER_KEYWORDS
+        table_columns: {hdu: [column, ...]} read from the first row
+            of binary tables, if None, TABLE_COLUMNS
+
+    OUTPUT
+        values: {name: value}, names in lower case, None for keywords
+            and columns not in the file
+    """
+
+    if header_keywords is None:
+        header_keywords = HEADER_KEYWORDS
+
+    if table_columns is None:
+        table_columns = TABLE_COLUMNS
+
+    number_hdus = max([*header_keywords, *table_columns]) + 1
+
+    values = {}
+
+    with open(fits_file, "rb") as file:
+
+        locations = file_headers(file, number_hdus)
+
+        for hdu, keywords in header_keywords.items():
+
+            header = locations[hdu][0]
+
+            for keyword in keywords:
+                values[keyword.lower()] = header.get(keyword.upper())
+
+        for hdu, columns in table_columns.items():
+
+            in_table = set(table_names(locations[hdu][0]))
+            found = [name for name in columns if name.upper() in in_table]
+
+            row = read_table_row(file, locations[hdu], found)
+
+            for name in columns:
+
+                value = row[name] if name in found else None
+
+                if isinstance(value, bytes):
+                    value = value.decode().strip()
+
+                values[name.lower()] = value
+
+    return values
+
+
+###############################################################################
+def headers_data_frame(
+    specobjids: list, records: list, names: list
+) -> pd.DataFrame:
+    """
+    PARAMETERS
+        specobjids: identifier of each record
+        records: output of read_headers for each file
+        names: names of the harvested values, see harvest_names
+
+    OUTPUT
+        headers_df: typed data frame with specobjid as index, text is
+            categorical, header numbers are int64 or float64 and
+            table columns keep the type of the fits file
+    """
+
+    headers_df = pd.DataFrame.from_records(
+        records,
+        index=pd.Index(np.asarray(specobjids, np.int64), name="specobjid"),
+        columns=names,
+    )
+
+    # a numeric column with missing values is float, as in the csv files
+    for name in names:
+
+        column = pd.to_numeric(headers_df[name], errors="coerce")
+
+        if column.notna().sum() == headers_df[name].notna().sum():
+            headers_df[name] = column
+        else:
+            headers_df[name] = headers_df[name].astype("category")
+
+    return headers_df
@@ -0,0 +1,178 @@
+"""
+Plan incremental extractions: an index of extracted specobjids with
+the modification time and size of their fits files is compared with
+the files on disk, found with a single scandir per directory, hence
+only new or changed spectra are sent to the pool of processes
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import numpy as np
+import pandas as pd
+
+# saved in the output directory of the extraction
+INDEX_FILE = "extraction.index"
+
+INDEX_DTYPE = np.dtype(
+    [("specobjid", np.int64), ("mtime", np.int64), ("size", np.int64)]
+)
+
+
+###############################################################################
+def source_stats(
+    data_directory: str,
+    sas_directories: np.array,
+    spectrum_names: np.array,
+    number_threads: int = 16,
+) -> tuple:
+    """
+    Modification time and size of many fits files, each directory is
+    listed once and directories are listed in parallel threads
+
+    PARAMETERS
+        data_directory: sdss raw data's directory
+        sas_directories: sas_directory of each file
+        spectrum_names: spectrum_name of each file, without extension
+        number_threads: number of directories listed at once
+
+    OUTPUT
+        (mtimes, sizes): arrays aligned with spectrum_names, mtime in
+            nanoseconds, -1 for files that do not exist
+    """
+
+    mtimes = np.full(len(spectrum_names), -1, dtype=np.int64)
+    sizes = np.full(len(spectrum_names), -1, dtype=np.int64)
+
+    groups = pd.Series(np.arange(len(spectrum_names))).groupby(
+        np.asarray(sas_directories)
+    )
+
+    def list_directory(sas_directory: str) -> dict:
+
+        stats = {}
+
+        try:
+            entries = os.scandir(f"{data_directory}/{sas_directory}")
+        except FileNotFoundError:
+            return stats
+
+        with entries:
+
+            for entry in entries:
+
+                if entry.name.endswith(".fits"):
+                    stat = entry.stat()
+                    stats[entry.name[:-5]] = (stat.st_mtime_ns, stat.st_size)
+
+        return stats
+
+    sas_directories = list(groups.groups)
+
+    with ThreadPoolExecutor(max_workers=number_threads) as executor:
+
+        listings = executor.map(list_directory, sas_directories)
+
+        for sas_directory, stats in zip(sas_directories, listings):
+
+            positions = groups.get_group(sas_directory).to_numpy()
+
+            for position in positions:
+
+                stat = stats.get(spectrum_names[position])
+
+                if stat is not None:
+                    mtimes[position], sizes[position] = stat
+
+    return mtimes, sizes
+
+
+###############################################################################
+class ExtractionIndex:
+    """specobjid, mtime and size of the source of each saved spectrum"""
+
+    def __init__(self, directory: str):
+        """
+        PARAMETERS
+            directory: output directory of the extraction, the index
+                is saved there as INDEX_FILE
+        """
+
+        self.location = f"{directory}/{INDEX_FILE}"
+
+    ###########################################################################
+    def load(self) -> np.array:
+        """
+        OUTPUT
+            index: structured array sorted by specobjid, empty if the
+                index does not exist yet
+        """
+
+        if not os.path.isfile(self.location):
+            return np.empty(0, dtype=INDEX_DTYPE)
+
+        with open(self.location, "rb") as file:
+            return np.load(file)
+
+    ###########################################################################
+    def changed(
+        self, specobjids: np.array, mtimes: np.array, sizes: np.array
+    ) -> np.array:
+        """
+        PARAMETERS
+            specobjids, mtimes, sizes: aligned arrays, see source_stats
+
+        OUTPUT
+            mask: True for spectra not in the index or whose source has
+                another mtime or size than when it was extracted
+        """
+
+        index = self.load()
+        specobjids = np.asarray(specobjids, dtype=np.int64)
+
+        if index.size == 0:
+            return np.ones(specobjids.size, dtype=bool)
+
+        positions = np.searchsorted(index["specobjid"], specobjids)
+        positions = np.minimum(positions, index.size - 1)
+
+        entries = index[positions]
+
+        return (
+            (entries["specobjid"] != specobjids)
+            | (entries["mtime"] != mtimes)
+            | (entries["size"] != sizes)
+        )
+
+    ###########################################################################
+    def update(
+        self, specobjids: np.array, mtimes: np.array, sizes: np.array
+    ) -> None:
+        """
+        Add or replace entries and save the index atomically
+
+        PARAMETERS
+            specobjids, mtimes, sizes: aligned arrays of the spectra
+                just extracted
+        """
+
+        if len(specobjids) == 0:
+            return
+
+        new = np.empty(len(specobjids), dtype=INDEX_DTYPE)
+        new["specobjid"] = specobjids
+        new["mtime"] = mtimes
+        new["size"] = sizes
+
+        index = np.concatenate([self.load(), new])
+
+        # new entries come last, a stable sort keeps them last
+        index = index[np.argsort(index["specobjid"], kind="stable")]
+        is_last = np.append(
+            index["specobjid"][1:] != index["specobjid"][:-1], True
+        )
+        index = index[is_last]
+
+        with open(f"{self.location}.part", "wb") as file:
+            np.save(file, index)
+
+        os.replace(f"{self.location}.part", self.location)
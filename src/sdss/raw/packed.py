@@ -0,0 +1,294 @@
+"""
+Packed storage of raw spectra: instead of a {specobjid}.npy file per
+spectrum, wave, flux and ivar of many spectra are concatenated in
+large shards, each with an index of specobjid, offset, number of rows
+and length.
+Shards are read with memory mapping, hence a spectrum is a slice of
+the shard without a copy, and a whole shard is a sequential read
+"""
+from collections import OrderedDict
+import glob
+import os
+
+import numpy as np
+
+# rows of a spectrum: wave, flux, ivar and other columns, if any
+MINIMUM_ROWS = 3
+
+INDEX_DTYPE = np.dtype(
+    [
+        ("specobjid", np.int64),
+        ("offset", np.int64),
+        ("rows", np.int64),
+        ("length", np.int64),
+    ]
+)
+
+
+###############################################################################
+class PackedSpectraWriter:
+    """Append spectra to shards of a packed store"""
+
+    def __init__(self, directory: str, shard_size: int = 2**28):
+        """
+        PARAMETERS
+            directory: location of the packed store, shards already
+                there are kept and new ones are numbered after them
+            shard_size: bytes of spectra to hold in memory before they
+                are written to disk as a shard
+        """
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.shard_size = shard_size
+
+        self.shard_number = len(PackedSpectra.shard_names(directory))
+
+        self.spectra = []
+        self.specobjids = []
+        self.number_bytes = 0
+
+    ###########################################################################
+    def add(self, specobjid: int, wave_flux_ivar: np.array) -> None:
+        """
+        PARAMETERS
+            specobjid: unique identifier of the spectrum
+            wave_flux_ivar: array with wave, flux, ivar and other
+                columns in each row, as returned by
+                RawData.wave_flux_ivar. Spectra of a
+                shard are saved with a common dtype, e.g. float32 if
+                all of them are float32
+        """
+
+        wave_flux_ivar = np.asarray(wave_flux_ivar)
+
+        if wave_flux_ivar.shape[0] < MINIMUM_ROWS:
+            raise ValueError(
+                f"Spectrum {specobjid} has {wave_flux_ivar.shape[0]} rows, "
+                f"expected at least {MINIMUM_ROWS}"
+            )
+
+        self.spectra.append(wave_flux_ivar)
+        self.specobjids.append(specobjid)
+        self.number_bytes += wave_flux_ivar.nbytes
+
+        if self.number_bytes >= self.shard_size:
+            self.flush()
+
+    ###########################################################################
+    def flush(self) -> None:
+        """Write spectra held in memory as a new shard"""
+
+        if len(self.spectra) == 0:
+            return
+
+        index = np.empty(len(self.spectra), dtype=INDEX_DTYPE)
+
+        index["specobjid"] = self.specobjids
+        index["rows"] = [spectrum.shape[0] for spectrum in self.spectra]
+        index["length"] = [spectrum.shape[1] for spectrum in self.spectra]
+        # each spectrum is a contiguous block of rows * length
+        sizes = index["rows"] * index["length"]
+        index["offset"] = np.cumsum(sizes) - sizes
+
+        data = np.concatenate(
+            [spectrum.reshape(-1) for spectrum in self.spectra]
+        )
+
+        name = f"{self.directory}/shard_{self.shard_number:05d}"
+
+        # data first, a shard counts once its index is in place
+        self._save(f"{name}.npy", data)
+        self._save(f"{name}_index.npy", index)
+
+        self.shard_number += 1
+
+        self.spectra = []
+        self.specobjids = []
+        self.number_bytes = 0
+
+    ###########################################################################
+    def close(self) -> None:
+        """Write the last shard"""
+
+        self.flush()
+
+    ###########################################################################
+    @staticmethod
+    def _save(save_to: str, array: np.array) -> None:
+        """Save array atomically"""
+
+        # a file handle, np.save would add .npy to the partial name
+        with open(f"{save_to}.part", "wb") as file:
+            np.save(file, array)
+
+        os.replace(f"{save_to}.part", save_to)
+
+
+###############################################################################
+class PackedSpectra:
+    """Read spectra from a packed store"""
+
+    def __init__(self, directory: str, max_open_shards: int = 8):
+        """
+        PARAMETERS
+            directory: location of the packed store
+            max_open_shards: number of shards kept memory mapped, the
+                least recently used is released when another one is
+                opened
+        """
+
+        self.directory = directory
+        self.max_open_shards = max_open_shards
+
+        shard_names = self.shard_names(directory)
+
+        indexes = [np.load(f"{name}_index.npy") for name in shard_names]
+        shards = [
+            np.full(index.size, number, dtype=np.int32)
+            for number, index in enumerate(indexes)
+        ]
+
+        index = np.concatenate(indexes) if indexes else np.empty(
+            0, dtype=INDEX_DTYPE
+        )
+        shards = np.concatenate(shards) if shards else np.empty(0, np.int32)
+
+        # sorted by specobjid for binary search
+        order = np.argsort(index["specobjid"], kind="stable")
+
+        index = index[order]
+        shards = shards[order]
+
+        # a spectrum extracted again is in a later shard, it wins
+        is_last = np.append(
+            index["specobjid"][1:] != index["specobjid"][:-1], True
+        )[: index.size]
+
+        self.index = index[is_last]
+        self.shards = shards[is_last]
+
+        self.shard_files = [f"{name}.npy" for name in shard_names]
+        # shard number: memory map, from least to most recently used
+        self.memory_maps = OrderedDict()
+
+    ###########################################################################
+    @staticmethod
+    def shard_names(directory: str) -> list:
+        """Shards with an index, without extension, in order"""
+
+        return sorted(
+            location[: -len("_index.npy")]
+            for location in glob.glob(f"{directory}/shard_*_index.npy")
+        )
+
+    ###########################################################################
+    @staticmethod
+    def is_packed(directory: str) -> bool:
+        """True if directory holds at least one shard"""
+
+        return len(PackedSpectra.shard_names(directory)) > 0
+
+    ###########################################################################
+    @property
+    def specobjids(self) -> np.array:
+        """specobjid of every spectrum in the store, sorted"""
+
+        return self.index["specobjid"]
+
+    ###########################################################################
+    def get(self, specobjid: int) -> np.array:
+        """
+        PARAMETERS
+            specobjid: unique identifier of the spectrum
+
+        OUTPUT
+            wave_flux_ivar: read only view of the memory mapped shard
+                with wave, flux, ivar and other columns in each row,
+                copy the rows to be modified
+        """
+
+        position = self.index["specobjid"].searchsorted(specobjid)
+
+        if (
+            position == self.index.size
+            or self.index["specobjid"][position] != specobjid
+        ):
+            raise KeyError(f"specobjid not in packed store: {specobjid}")
+
+        shard_number = self.shards[position]
+
+        data = self._memory_map(shard_number)
+
+        _, offset, rows, length = self.index[position]
+
+        return data[offset : offset + rows * length].reshape(rows, length)
+
+    ###########################################################################
+    def close(self) -> None:
+        """
+        Release the memory maps of the shards, views returned by get
+        keep their shard mapped until they are deleted
+        """
+
+        self.memory_maps.clear()
+
+    ###########################################################################
+    def __enter__(self) -> "PackedSpectra":
+        """Use the store in a with statement, see close"""
+
+        return self
+
+    ###########################################################################
+    def __exit__(self, *exception) -> None:
+        """Release the memory maps at the end of the with statement"""
+
+        self.close()
+
+    ###########################################################################
+    def _memory_map(self, shard_number: int) -> np.memmap:
+        """Memory map of a shard, at most max_open_shards are kept"""
+
+        if shard_number in self.memory_maps:
+
+            self.memory_maps.move_to_end(shard_number)
+
+            return self.memory_maps[shard_number]
+
+        data = np.load(self.shard_files[shard_number], mmap_mode="r")
+
+        self.memory_maps[shard_number] = data
+
+        if len(self.memory_maps) > self.max_open_shards:
+            self.memory_maps.popitem(last=False)
+
+        return data
+
+    ###########################################################################
+    def load_shard(self, shard_number: int) -> dict:
+        """
+        Load a whole shard with a single sequential read
+
+        PARAMETERS
+            shard_number: position of the shard, starting at 0
+
+        OUTPUT
+            spectra: {specobjid: wave_flux_ivar} with views of the
+                shard in memory
+        """
+
+        data = np.load(self.shard_files[shard_number])
+
+        index = np.load(
+            self.shard_files[shard_number][: -len(".npy")] + "_index.npy"
+        )
+
+        spectra = {
+            int(specobjid): data[offset : offset + rows * length].reshape(
+                rows, length
+            )
+            for specobjid, offset, rows, length in index
+        }
+
+        return spectra
@@ -0,0 +1,241 @@
+"""
+Remove files outside of a keep set: fits files in the SAS tree of
+the raw data directory or .npy files of extracted spectra. The tree
+is walked once with scandir, the files to remove are a set
+difference and they are deleted in batches by a pool of threads
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import numpy as np
+import pandas as pd
+
+from sdss.metadata import MetaData
+
+
+###############################################################################
+class Pruner:
+    """Delete, or report in a dry run, files not in a keep set"""
+
+    def __init__(
+        self,
+        number_threads: int = 16,
+        batch_size: int = 1000,
+        dry_run: bool = True,
+    ):
+        """
+        PARAMETERS
+            number_threads: number of batches deleted at once
+            batch_size: number of files deleted by a thread in a task
+            dry_run: if True, files are only reported, not deleted
+        """
+
+        self.number_threads = number_threads
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+
+    ###########################################################################
+    def prune_fits(
+        self,
+        data_directory: str,
+        keep_df: pd.DataFrame,
+        report_to: str = None,
+    ) -> dict:
+        """
+        Remove spec-*.fits files of spectra not in keep_df
+
+        PARAMETERS
+            data_directory: sdss raw data's directory, with the sas
+                directory inside
+            keep_df: data frame with plate, mjd, fiberid and run2d of
+                spectra to keep
+            report_to: if not None, location of a csv file with the
+                location and size of each file to remove
+
+        OUTPUT
+            report: see _prune
+        """
+
+        data_directory = data_directory.rstrip("/")
+        keep_df = MetaData.with_sas_paths(keep_df)
+
+        keep = set(
+            keep_df["sas_directory"] + "/" + keep_df["spectrum_name"] + ".fits"
+        )
+
+        sas_directory = f"{data_directory}/sas"
+
+        if not os.path.isdir(sas_directory):
+
+            print(f"No sas directory in {data_directory}, nothing to prune")
+
+            return self._prune([], [], keep, report_to)
+
+        files = self._walk(
+            sas_directory,
+            lambda name: name.startswith("spec-") and name.endswith(".fits"),
+        )
+
+        # keys relative to data_directory, as sas_directory
+        start = len(data_directory) + 1
+        keys = [location[start:] for location, _ in files]
+
+        return self._prune(files, keys, keep, report_to)
+
+    ###########################################################################
+    def prune_npy(
+        self,
+        spectra_directory: str,
+        keep_specobjids: np.array,
+        report_to: str = None,
+    ) -> dict:
+        """
+        Remove {specobjid}.npy files of spectra not in keep_specobjids
+
+        PARAMETERS
+            spectra_directory: location of the extracted spectra
+            keep_specobjids: specobjid of spectra to keep
+            report_to: see prune_fits
+
+        OUTPUT
+            report: see _prune
+        """
+
+        keep = set(np.asarray(keep_specobjids, dtype=np.int64).tolist())
+
+        files = self._walk(
+            spectra_directory,
+            lambda name: name.endswith(".npy") and name[:-4].isdigit(),
+            recursive=False,
+        )
+
+        keys = [
+            int(os.path.basename(location)[:-4]) for location, _ in files
+        ]
+
+        return self._prune(files, keys, keep, report_to)
+
+    ###########################################################################
+    def remove(self, locations: list) -> int:
+        """
+        Delete files in batches with a pool of threads
+
+        PARAMETERS
+            locations: files to delete
+
+        OUTPUT
+            number_failed: files that could not be deleted, e.g.
+                because they do not exist
+        """
+
+        batches = [
+            locations[start : start + self.batch_size]
+            for start in range(0, len(locations), self.batch_size)
+        ]
+
+        with ThreadPoolExecutor(max_workers=self.number_threads) as executor:
+            number_failed = sum(executor.map(self._remove_batch, batches))
+
+        return number_failed
+
+    ###########################################################################
+    @staticmethod
+    def _remove_batch(locations: list) -> int:
+        """Delete a batch of files, returns the number of failures"""
+
+        number_failed = 0
+
+        for location in locations:
+
+            try:
+                os.remove(location)
+
+            except OSError:
+                number_failed += 1
+
+        return number_failed
+
+    ###########################################################################
+    def _prune(
+        self, files: list, keys: list, keep: set, report_to: str
+    ) -> dict:
+        """
+        PARAMETERS
+            files: (location, size) of each file found
+            keys: key of each file to look up in keep
+            keep: keys of files to keep
+            report_to: see prune_fits
+
+        OUTPUT
+            report: {"files": number of files to remove,
+                "bytes": bytes to free, "kept": number of files kept,
+                "failed": files that could not be deleted, 0 in a
+                dry run}
+        """
+
+        remove = [
+            (location, size)
+            for (location, size), key in zip(files, keys)
+            if key not in keep
+        ]
+
+        report = {
+            "files": len(remove),
+            "bytes": sum(size for _, size in remove),
+            "kept": len(files) - len(remove),
+            "failed": 0,
+        }
+
+        if report_to is not None:
+            pd.DataFrame(remove, columns=["location", "size"]).to_csv(
+                report_to, index=False
+            )
+
+        action = "Would remove" if self.dry_run else "Remove"
+
+        print(
+            f"{action} {report['files']} files, "
+            f"{report['bytes'] / 2**30:.2f} GiB, "
+            f"keep {report['kept']} files"
+        )
+
+        if self.dry_run is False:
+            locations = [location for location, _ in remove]
+            report["failed"] = self.remove(locations)
+
+        return report
+
+    ###########################################################################
+    @staticmethod
+    def _walk(directory: str, select, recursive: bool = True) -> list:
+        """
+        Walk directory once with scandir
+
+        PARAMETERS
+            directory: root of the walk
+            select: function of a file name, True for files to list
+            recursive: if False, subdirectories are not listed
+
+        OUTPUT
+            files: (location, size) of each selected file
+        """
+
+        files = []
+        directories = [directory]
+
+        while directories:
+
+            with os.scandir(directories.pop()) as entries:
+
+                for entry in entries:
+
+                    if entry.is_dir(follow_symlinks=False):
+
+                        if recursive:
+                            directories.append(entry.path)
+
+                    elif select(entry.name):
+                        size = entry.stat(follow_symlinks=False).st_size
+                        files.append((entry.path, size))
+
+        return files
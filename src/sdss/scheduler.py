@@ -0,0 +1,173 @@
+"""
+Central scheduling of download requests: retries with exponential
+backoff and jitter, a global cap of requests per second and a number
+of simultaneous requests adapted to the observed error rate
+"""
+import random
+import time
+
+# HTTP status codes where retrying cannot help
+PERMANENT_ERRORS = (400, 401, 403, 404, 410)
+
+
+###############################################################################
+class RetryScheduler:
+    """
+    Decide when requests start and when failed requests are retried.
+    It is meant to live in a single place, the parent process or the
+    event loop, hence it needs no locks
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 10,
+        base_delay: float = 1.0,
+        max_delay: float = 300.0,
+        requests_per_second: float = None,
+        max_concurrency: int = 32,
+        min_concurrency: int = 1,
+        error_threshold: float = 0.2,
+    ):
+        """
+        PARAMETERS
+            max_attempts: maximum number of requests for a single file
+            base_delay: delay in seconds before the first retry, it
+                doubles with each attempt
+            max_delay: upper bound in seconds of the delay
+            requests_per_second: global cap for the rate of requests,
+                if None, requests are not rate limited
+            max_concurrency: upper bound of simultaneous requests
+            min_concurrency: lower bound of simultaneous requests
+            error_threshold: when the fraction of failed requests is
+                above this value, the number of simultaneous requests
+                is halved
+        """
+
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.requests_per_second = requests_per_second
+        self.next_request_time = time.monotonic()
+
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = max_concurrency
+
+        self.error_threshold = error_threshold
+        # exponentially weighted moving average of failures
+        self.error_rate = 0.0
+        self.number_successes = 0
+        self.last_decrease = 0.0
+
+    ###########################################################################
+    def backoff(self, attempt: int) -> float:
+        """
+        Delay before the next attempt: exponential backoff with full
+        jitter, hence failed files retried at the same time spread out
+
+        PARAMETERS
+            attempt: number of attempts already made, starting at 1
+
+        OUTPUT
+            delay: seconds to wait before retrying
+        """
+
+        cap = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+
+        return random.uniform(0, cap)
+
+    ###########################################################################
+    def should_retry(self, attempt: int, retryable: bool) -> bool:
+        """
+        PARAMETERS
+            attempt: number of attempts already made, starting at 1
+            retryable: output of is_retryable for the last error
+
+        OUTPUT
+            True if the file has to be queued again
+        """
+
+        return retryable and attempt < self.max_attempts
+
+    ###########################################################################
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        """
+        Errors such as 404 are permanent, others such as timeouts,
+        throttling (429) or server errors (5xx) might go away
+
+        PARAMETERS
+            error: exception raised by the request
+        """
+
+        # missing file in a local mirror
+        if isinstance(error, FileNotFoundError):
+            return False
+
+        # aiohttp uses status and urllib uses code
+        status = getattr(error, "status", None) or getattr(
+            error, "code", None
+        )
+
+        return status not in PERMANENT_ERRORS
+
+    ###########################################################################
+    def reserve_request(self) -> float:
+        """
+        Reserve a slot for a request under the global rate cap
+
+        OUTPUT
+            wait: seconds to wait before starting the request
+        """
+
+        if self.requests_per_second is None:
+            return 0.0
+
+        now = time.monotonic()
+
+        start_time = max(now, self.next_request_time)
+        self.next_request_time = start_time + 1.0 / self.requests_per_second
+
+        return start_time - now
+
+    ###########################################################################
+    def record(self, success: bool) -> None:
+        """
+        Adapt the number of simultaneous requests to the outcome of a
+        request: additive increase while requests succeed and
+        multiplicative decrease when the error rate is too high
+
+        PARAMETERS
+            success: True if the request succeeded
+        """
+
+        self.error_rate = 0.95 * self.error_rate + 0.05 * (not success)
+
+        if success is True:
+
+            self.number_successes += 1
+
+            if self.number_successes >= self.concurrency:
+
+                self.number_successes = 0
+                self.concurrency = min(
+                    self.max_concurrency, self.concurrency + 1
+                )
+
+            return
+
+        self.number_successes = 0
+
+        now = time.monotonic()
+
+        # decrease at most once per backoff period to let it take effect
+        if (
+            self.error_rate > self.error_threshold
+            and now - self.last_decrease > self.base_delay
+        ):
+
+            self.last_decrease = now
+            self.concurrency = max(
+                self.min_concurrency, self.concurrency // 2
+            )
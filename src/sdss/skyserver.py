@@ -0,0 +1,180 @@
+"""
+Bulk download of image cutouts and spectrum plots from SkyServer,
+e.g. to review a list of outlier candidates. Requests run
+concurrently and files already in the cache directory are skipped
+"""
+import os
+
+import numpy as np
+
+from sdss.asyncdownload import AsyncDownloader
+from sdss.scheduler import RetryScheduler
+
+
+###############################################################################
+class SkyServerFetcher:
+    """Cached and concurrent version of MetaData.get_sdss_image"""
+
+    def __init__(
+        self,
+        cache_directory: str,
+        base_url: str = "http://skyserver.sdss.org/dr16",
+        concurrency: int = 8,
+        max_attempts: int = 5,
+        requests_per_second: float = None,
+    ):
+        """
+        PARAMETERS
+            cache_directory: files are saved here, named after the
+                parameters of the request, hence a file on disk is a
+                cache hit
+            base_url: url of SkyServer or of a local stand-in server,
+                e.g. http://127.0.0.1:8000
+            concurrency: maximum number of simultaneous requests
+            max_attempts: maximum number of requests for a single file
+            requests_per_second: global cap for the rate of requests,
+                if None, requests are not rate limited
+        """
+
+        os.makedirs(cache_directory, exist_ok=True)
+        self.cache_directory = cache_directory
+
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.requests_per_second = requests_per_second
+
+    ###########################################################################
+    def images(
+        self,
+        specobjids: np.array,
+        coordinates: tuple,
+        dimensions: tuple = (0.2, 200, 200),
+        opt: str = "G",
+        image_format: str = "jpeg",
+    ) -> list:
+        """
+        Download image cutouts centered on each galaxy
+
+        PARAMETERS
+            specobjids: unique identification of each galaxy
+            coordinates: (ra, dec) arrays in degrees, one entry per
+                specobjid
+            dimensions: (scale, width, height) of the cutouts, scale
+                in arcsec per pixel, width and height in pixels
+            opt: drawing options of SkyServer, e.g. G for grid
+            image_format: extension of the files in the cache
+
+        OUTPUT
+            failed: specobjids that could not be downloaded
+        """
+
+        ra, dec = coordinates
+        scale, width, height = dimensions
+
+        tasks = [
+            (
+                specobjid,
+                "SkyServerWS/ImgCutout/getjpeg?"
+                f"TaskName=Skyserver.Explore.Image&ra={ra_i}&dec={dec_i}"
+                f"&scale={scale}&width={width}&height={height}&opt={opt}",
+                self.image_location(
+                    specobjid, dimensions, opt, image_format
+                ),
+            )
+            for specobjid, ra_i, dec_i in zip(specobjids, ra, dec)
+        ]
+
+        return self._fetch(tasks)
+
+    ###########################################################################
+    def spectrum_plots(
+        self, specobjids: np.array, image_format: str = "png"
+    ) -> list:
+        """
+        Download the plot of each spectrum
+
+        PARAMETERS
+            specobjids: unique identification of each galaxy
+            image_format: extension of the files in the cache
+
+        OUTPUT
+            failed: specobjids that could not be downloaded
+        """
+
+        tasks = [
+            (
+                specobjid,
+                f"en/get/SpecById.ashx?id={specobjid}",
+                self.spectrum_location(specobjid, image_format),
+            )
+            for specobjid in specobjids
+        ]
+
+        return self._fetch(tasks)
+
+    ###########################################################################
+    def image_location(
+        self,
+        specobjid: int,
+        dimensions: tuple = (0.2, 200, 200),
+        opt: str = "G",
+        image_format: str = "jpeg",
+    ) -> str:
+        """
+        Location in the cache of an image cutout, keyed by specobjid,
+        scale, width, height and opt, see images
+        """
+
+        scale, width, height = dimensions
+
+        return (
+            f"{self.cache_directory}/"
+            f"{specobjid}_{scale}_{width}_{height}_{opt}.{image_format}"
+        )
+
+    ###########################################################################
+    def spectrum_location(
+        self, specobjid: int, image_format: str = "png"
+    ) -> str:
+        """Location in the cache of a spectrum plot, see spectrum_plots"""
+
+        return f"{self.cache_directory}/{specobjid}_spectrum.{image_format}"
+
+    ###########################################################################
+    def _fetch(self, tasks: list) -> list:
+        """
+        Download tasks not in the cache
+
+        PARAMETERS
+            tasks: list of (specobjid, url_path, destination) tuples
+
+        OUTPUT
+            failed: specobjids that could not be downloaded
+        """
+
+        missing = [task for task in tasks if not os.path.isfile(task[2])]
+
+        print(
+            f"{len(tasks) - len(missing)} files in cache, "
+            f"{len(missing)} to download"
+        )
+
+        downloader = AsyncDownloader(
+            base_url=self.base_url,
+            concurrency=self.concurrency,
+            verify_fits=False,
+            scheduler=RetryScheduler(
+                max_attempts=self.max_attempts,
+                requests_per_second=self.requests_per_second,
+                max_concurrency=self.concurrency,
+            ),
+        )
+
+        failed = [
+            specobjid for specobjid, _, _ in downloader.download(missing)
+        ]
+
+        print(f"Fail to download {len(failed)} files")
+
+        return failed
@@ -0,0 +1,192 @@
+"""
+Ordered sources of files: local mirrors on shared storage, given as
+file:// paths, and HTTP mirrors of the science archive server. Each
+source keeps track of its health, unhealthy sources are skipped for a
+while and the next source in the list is used instead
+"""
+import os
+import shutil
+import time
+
+from sdss.scheduler import RetryScheduler
+
+# bytes are written here and renamed to destination once complete
+PARTIAL_SUFFIX = ".part"
+
+
+###############################################################################
+class Source:
+    """A local mirror or an HTTP server holding the SAS tree"""
+
+    def __init__(
+        self, location: str, max_failures: int = 5, cooldown: float = 60.0
+    ):
+        """
+        PARAMETERS
+            location: either a local mirror, e.g.
+                file:///data/shared/spectra, or the url of a server,
+                e.g. https://data.sdss.org
+            max_failures: number of consecutive failures after which
+                the source is considered unhealthy
+            cooldown: seconds to skip an unhealthy source
+        """
+
+        self.is_local = location.startswith("file://")
+
+        if self.is_local is True:
+            location = location[len("file://") :]
+
+        self.location = location.rstrip("/")
+
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+
+        self.number_successes = 0
+        self.number_failures = 0
+        self.consecutive_failures = 0
+        self.skip_until = 0.0
+
+    ###########################################################################
+    def is_healthy(self) -> bool:
+        """True unless the source failed recently too many times"""
+
+        return time.monotonic() >= self.skip_until
+
+    ###########################################################################
+    def record(self, success: bool) -> None:
+        """
+        Update health of the source after a request
+
+        PARAMETERS
+            success: True if the request succeeded
+        """
+
+        if success is True:
+
+            self.number_successes += 1
+            self.consecutive_failures = 0
+
+            return
+
+        self.number_failures += 1
+        self.consecutive_failures += 1
+
+        if self.consecutive_failures >= self.max_failures:
+
+            print(f"Source {self.location} unhealthy, skip it for a while")
+
+            self.skip_until = time.monotonic() + self.cooldown
+            self.consecutive_failures = 0
+
+    ###########################################################################
+    def url(self, url_path: str) -> str:
+        """Location of url_path in this source"""
+
+        return f"{self.location}/{url_path.lstrip('/')}"
+
+    ###########################################################################
+    def link(self, url_path: str, destination: str) -> int:
+        """
+        Get a file from a local mirror with a hard link or, if the
+        mirror is in a different file system, with a copy
+
+        PARAMETERS
+            url_path: location of the file in the SAS tree
+            destination: location of the file in local disk
+
+        OUTPUT
+            file_size: size of the file in bytes
+        """
+
+        mirror_file = self.url(url_path)
+
+        # FileNotFoundError if the mirror does not have the file
+        file_size = os.path.getsize(mirror_file)
+
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+        partial_file = f"{destination}{PARTIAL_SUFFIX}"
+
+        if os.path.isfile(partial_file):
+            os.remove(partial_file)
+
+        try:
+            os.link(mirror_file, partial_file)
+
+        except OSError:
+            shutil.copyfile(mirror_file, partial_file)
+
+        os.replace(partial_file, destination)
+
+        return file_size
+
+
+###############################################################################
+class SourceList:
+    """Ordered sources with failover"""
+
+    def __init__(
+        self, locations: list, max_failures: int = 5, cooldown: float = 60.0
+    ):
+        """
+        PARAMETERS
+            locations: sources in order of preference, e.g.
+                [
+                    "file:///data/shared/spectra",
+                    "https://mirror.example.org",
+                    "https://data.sdss.org"
+                ]
+            max_failures: number of consecutive failures after which
+                a source is considered unhealthy
+            cooldown: seconds to skip an unhealthy source
+        """
+
+        self.sources = [
+            Source(location, max_failures, cooldown)
+            for location in locations
+        ]
+
+    ###########################################################################
+    def candidates(self) -> list:
+        """
+        Healthy sources in order of preference. If every source is
+        unhealthy, all of them are returned to keep trying
+
+        OUTPUT
+            sources: list of Source objects
+        """
+
+        healthy = [source for source in self.sources if source.is_healthy()]
+
+        if len(healthy) == 0:
+            return self.sources
+
+        return healthy
+
+    ###########################################################################
+    def health(self) -> dict:
+        """
+        OUTPUT
+            report: successes and failures of each source, e.g.
+                {"https://data.sdss.org": (100, 2)}
+        """
+
+        report = {
+            source.location: (source.number_successes, source.number_failures)
+            for source in self.sources
+        }
+
+        return report
+
+    ###########################################################################
+    @staticmethod
+    def is_missing(error: Exception) -> bool:
+        """
+        True if the error means that the source does not have the file,
+        then the next source is tried without penalty for the source
+
+        PARAMETERS
+            error: exception raised while getting the file
+        """
+
+        return RetryScheduler.is_retryable(error) is False
@@ -0,0 +1,183 @@
+"""
+Compact index from specobjid to meta data for lookups in workers:
+sorted int64 specobjids with a contiguous array per column, searched
+with a binary search. The arrays can live in shared memory, hence
+child processes read them without a copy of the data frame
+"""
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+import pandas as pd
+
+# name of the sorted keys in the output of SpecObjIndex.to_shared
+INDEX_COLUMN = "specobjid"
+
+
+###############################################################################
+class SpecObjIndex:
+    """Look up meta data of spectra by specobjid without pandas"""
+
+    def __init__(
+        self, specobjids: np.array, columns: dict, is_sorted: bool = False
+    ):
+        """
+        PARAMETERS
+            specobjids: unique identifier of each row
+            columns: a numpy array per column, aligned with specobjids,
+                e.g. {"z": z_array, "ebv": ebv_array}
+            is_sorted: True if specobjids are already sorted, e.g.
+                when the arrays come from shared memory
+        """
+
+        specobjids = np.asarray(specobjids, dtype=np.int64)
+        columns = {name: np.asarray(array) for name, array in columns.items()}
+
+        if is_sorted is False:
+
+            order = np.argsort(specobjids, kind="stable")
+
+            specobjids = specobjids[order]
+            columns = {name: array[order] for name, array in columns.items()}
+
+        self.specobjids = specobjids
+        self.columns = columns
+
+    ###########################################################################
+    @staticmethod
+    def from_data_frame(
+        meta_data_df: pd.DataFrame, columns: list
+    ) -> "SpecObjIndex":
+        """
+        PARAMETERS
+            meta_data_df: data frame with specobjid as index
+            columns: columns of meta_data_df to keep. Text columns,
+                e.g. sas_directory, are stored as fixed width bytes
+
+        OUTPUT
+            index: SpecObjIndex with the columns of meta_data_df
+        """
+
+        arrays = {}
+
+        for name in columns:
+
+            column = meta_data_df[name]
+
+            if column.dtype.kind in "biuf":
+                arrays[name] = column.to_numpy()
+            else:
+                arrays[name] = column.astype(str).to_numpy(dtype=np.bytes_)
+
+        return SpecObjIndex(meta_data_df.index.to_numpy(), arrays)
+
+    ###########################################################################
+    @property
+    def size(self) -> int:
+        """Number of rows in the index"""
+
+        return self.specobjids.size
+
+    ###########################################################################
+    def positions(self, specobjids: "int | np.array") -> "int | np.array":
+        """
+        Binary search of specobjids
+
+        PARAMETERS
+            specobjids: a single specobjid or an array of them
+
+        OUTPUT
+            positions: row of each specobjid in the column arrays
+
+        Raises KeyError if a specobjid is not in the index
+        """
+
+        positions = np.searchsorted(self.specobjids, specobjids)
+
+        # no row to compare with in an empty index
+        if self.size == 0:
+
+            if np.size(specobjids) > 0:
+                raise KeyError(f"specobjid not in index: {specobjids}")
+
+            return positions
+
+        positions = np.minimum(positions, self.size - 1)
+
+        found = self.specobjids[positions] == specobjids
+
+        if not np.all(found):
+            raise KeyError(f"specobjid not in index: {specobjids}")
+
+        return positions
+
+    ###########################################################################
+    def get(self, specobjid: int, column: str) -> object:
+        """
+        PARAMETERS
+            specobjid: identifier of the spectrum
+            column: name of the column, e.g. z
+
+        OUTPUT
+            value: value of column for specobjid, text is decoded
+        """
+
+        if self.size == 0:
+            raise KeyError(f"specobjid not in index: {specobjid}")
+
+        # scalar version of positions, without temporary arrays
+        position = self.specobjids.searchsorted(specobjid)
+
+        if position == self.size or self.specobjids[position] != specobjid:
+            raise KeyError(f"specobjid not in index: {specobjid}")
+
+        value = self.columns[column][position]
+
+        if isinstance(value, bytes):
+            return value.decode()
+
+        return value
+
+    ###########################################################################
+    def to_shared(self) -> dict:
+        """
+        Copy the arrays to shared memory, e.g. to pass them to the
+        initializer of a pool of processes
+
+        OUTPUT
+            shared: {name: (RawArray, dtype)} for specobjid and each
+                column, see from_shared
+        """
+
+        arrays = {INDEX_COLUMN: self.specobjids, **self.columns}
+
+        shared = {}
+
+        for name, array in arrays.items():
+
+            shared_array = RawArray("B", array.nbytes)
+            np.frombuffer(shared_array, dtype=array.dtype)[:] = array
+
+            shared[name] = (shared_array, array.dtype.str)
+
+        return shared
+
+    ###########################################################################
+    @staticmethod
+    def from_shared(shared: dict) -> "SpecObjIndex":
+        """
+        PARAMETERS
+            shared: output of to_shared
+
+        OUTPUT
+            index: SpecObjIndex whose arrays are views of shared
+                memory, nothing is copied
+        """
+
+        arrays = {
+            name: np.frombuffer(shared_array, dtype=dtype)
+            for name, (shared_array, dtype) in shared.items()
+        }
+
+        specobjids = arrays.pop(INDEX_COLUMN)
+
+        return SpecObjIndex(specobjids, arrays, is_sorted=True)
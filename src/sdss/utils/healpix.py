@@ -0,0 +1,155 @@
+"""
+HEALPix pixels in the NESTED scheme with numpy, without healpy.
+Follows the ang2pix_nest and pix2ang_nest algorithms of the HEALPix
+library (Gorski et al. 2005)
+"""
+
+import numpy as np
+
+# ring and longitude offsets of the 12 base pixels
+JRLL = np.array([2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4])
+JPLL = np.array([1, 3, 5, 7, 0, 2, 4, 6, 1, 3, 5, 7])
+
+
+def number_pixels(nside: int) -> int:
+    """Number of pixels of the sphere at resolution nside"""
+
+    return 12 * nside * nside
+
+
+def _spread_bits(values: np.array) -> np.array:
+    """Move bit i of values to bit 2i, for values below 2**32"""
+
+    values = values.astype(np.int64)
+
+    values = (values | (values << 16)) & 0x0000FFFF0000FFFF
+    values = (values | (values << 8)) & 0x00FF00FF00FF00FF
+    values = (values | (values << 4)) & 0x0F0F0F0F0F0F0F0F
+    values = (values | (values << 2)) & 0x3333333333333333
+    values = (values | (values << 1)) & 0x5555555555555555
+
+    return values
+
+
+def _compress_bits(values: np.array) -> np.array:
+    """Move bit 2i of values to bit i"""
+
+    values = values & 0x5555555555555555
+
+    values = (values | (values >> 1)) & 0x3333333333333333
+    values = (values | (values >> 2)) & 0x0F0F0F0F0F0F0F0F
+    values = (values | (values >> 4)) & 0x00FF00FF00FF00FF
+    values = (values | (values >> 8)) & 0x0000FFFF0000FFFF
+    values = (values | (values >> 16)) & 0x00000000FFFFFFFF
+
+    return values
+
+
+def ang2pix(nside: int, ra: np.array, dec: np.array) -> np.array:
+    """
+    Pixel of each position
+
+    INPUTS
+    nside: resolution, a power of 2
+    ra: right ascension in degrees
+    dec: declination in degrees
+
+    OUTPUT
+    pixels: NESTED pixel of each position, int64
+    """
+
+    z = np.sin(np.deg2rad(np.asarray(dec, dtype=np.float64)))
+    z_abs = np.abs(z)
+    # longitude in units of pi/2, in [0, 4)
+    tt = np.mod(np.asarray(ra, dtype=np.float64), 360.0) / 90.0
+
+    face = np.empty(z.shape, dtype=np.int64)
+    ix = np.empty(z.shape, dtype=np.int64)
+    iy = np.empty(z.shape, dtype=np.int64)
+
+    # equatorial region
+    equator = z_abs <= 2.0 / 3.0
+
+    temp1 = nside * (0.5 + tt[equator])
+    temp2 = nside * z[equator] * 0.75
+
+    jp = (temp1 - temp2).astype(np.int64)
+    jm = (temp1 + temp2).astype(np.int64)
+
+    ifp = jp // nside
+    ifm = jm // nside
+
+    face[equator] = np.where(
+        ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8)
+    )
+    ix[equator] = jm & (nside - 1)
+    iy[equator] = nside - (jp & (nside - 1)) - 1
+
+    # polar caps
+    polar = ~equator
+
+    ntt = np.minimum(tt[polar].astype(np.int64), 3)
+    tp = tt[polar] - ntt
+    tmp = nside * np.sqrt(3.0 * (1.0 - z_abs[polar]))
+
+    jp = np.minimum((tp * tmp).astype(np.int64), nside - 1)
+    jm = np.minimum(((1.0 - tp) * tmp).astype(np.int64), nside - 1)
+
+    north = z[polar] >= 0
+
+    face[polar] = np.where(north, ntt, ntt + 8)
+    ix[polar] = np.where(north, nside - jm - 1, jp)
+    iy[polar] = np.where(north, nside - jp - 1, jm)
+
+    return (
+        face * nside * nside + _spread_bits(ix) + (_spread_bits(iy) << 1)
+    )
+
+
+def pix2ang(nside: int, pixels: np.array) -> tuple:
+    """
+    Center of each pixel
+
+    INPUTS
+    nside: resolution, a power of 2
+    pixels: NESTED pixels
+
+    OUTPUT
+    ra, dec: coordinates in degrees of the center of each pixel
+    """
+
+    pixels = np.asarray(pixels, dtype=np.int64)
+
+    pixels_per_face = nside * nside
+    fact2 = 4.0 / number_pixels(nside)
+    fact1 = 2 * nside * fact2
+
+    face = pixels // pixels_per_face
+    in_face = pixels % pixels_per_face
+
+    ix = _compress_bits(in_face)
+    iy = _compress_bits(in_face >> 1)
+
+    jr = JRLL[face] * nside - ix - iy - 1
+
+    north = jr < nside
+    south = jr > 3 * nside
+
+    nr = np.where(north, jr, np.where(south, 4 * nside - jr, nside))
+
+    z = np.where(
+        north,
+        1.0 - nr * nr * fact2,
+        np.where(south, nr * nr * fact2 - 1.0, (2 * nside - jr) * fact1),
+    )
+
+    kshift = np.where(north | south, 0, (jr - nside) & 1)
+
+    jp = (JPLL[face] * nr + ix - iy + 1 + kshift) // 2
+    jp = np.where(jp > 4 * nside, jp - 4 * nside, jp)
+    jp = np.where(jp < 1, jp + 4 * nside, jp)
+
+    ra = (jp - (kshift + 1) * 0.5) * (90.0 / nr)
+    dec = np.rad2deg(np.arcsin(z))
+
+    return ra, dec
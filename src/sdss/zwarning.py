@@ -0,0 +1,144 @@
+"""
+Decode zWarning bitmasks of whole columns at once. Every operation
+is a bitwise and over the column, hence million-row tables take
+milliseconds
+"""
+import numpy as np
+import pandas as pd
+
+# bits of zWarning and zWarning_noqso, see the SDSS bitmask documentation
+Z_WARNING_BITS = {
+    "SKY": 0,
+    "LITTLE_COVERAGE": 1,
+    "SMALL_DELTA_CHI2": 2,
+    "NEGATIVE_MODEL": 3,
+    "MANY_OUTLIERS": 4,
+    "Z_FITLIMIT": 5,
+    "NEGATIVE_EMISSION": 6,
+    "UNPLUGGED": 7,
+    "BAD_TARGET": 8,
+    "NODATA": 9,
+}
+
+# stands for any bit, including bits without a name
+ANY_FLAG = "ANY"
+
+
+###############################################################################
+class ZWarningFlags:
+    """Masks, counts and selections by flag name over a zWarning column"""
+
+    def __init__(self, z_warning: "pd.Series | np.array"):
+        """
+        PARAMETERS
+            z_warning: values of a zWarning or zWarning_noqso column
+        """
+
+        self.z_warning = np.asarray(z_warning, dtype=np.int64)
+
+    ###########################################################################
+    @staticmethod
+    def flag_bits(names: list) -> int:
+        """
+        PARAMETERS
+            names: flag names, e.g. ["SKY", "UNPLUGGED"] or [ANY_FLAG]
+
+        OUTPUT
+            bits: integer with the bits of all flags in names set
+        """
+
+        bits = 0
+
+        for name in names:
+
+            if name == ANY_FLAG:
+                return -1
+
+            if name not in Z_WARNING_BITS:
+                raise ValueError(f"Unknown zWarning flag: {name}")
+
+            bits |= 1 << Z_WARNING_BITS[name]
+
+        return bits
+
+    ###########################################################################
+    def mask(self, names: list) -> np.array:
+        """
+        PARAMETERS
+            names: flag names
+
+        OUTPUT
+            mask: True for rows with at least one of the flags
+        """
+
+        return (self.z_warning & self.flag_bits(names)) != 0
+
+    ###########################################################################
+    def masks(self) -> pd.DataFrame:
+        """
+        OUTPUT
+            masks_df: a boolean column per flag, True for rows with
+                the flag set
+        """
+
+        masks = {
+            name: (self.z_warning & (1 << bit)) != 0
+            for name, bit in Z_WARNING_BITS.items()
+        }
+
+        return pd.DataFrame(masks)
+
+    ###########################################################################
+    def counts(self) -> dict:
+        """
+        OUTPUT
+            counts: number of rows with each flag set, e.g.
+                {"SKY": 0, "LITTLE_COVERAGE": 10, ...}
+        """
+
+        counts = {
+            name: int(np.count_nonzero(self.z_warning & (1 << bit)))
+            for name, bit in Z_WARNING_BITS.items()
+        }
+
+        return counts
+
+    ###########################################################################
+    def select(self, include: list = None, exclude: list = None) -> np.array:
+        """
+        PARAMETERS
+            include: if not None, rows must have at least one of
+                these flags
+            exclude: rows with any of these flags are left out, e.g.
+                [ANY_FLAG] keeps rows with zWarning equal to zero
+
+        OUTPUT
+            mask: True for selected rows
+        """
+
+        selection = np.ones(self.z_warning.size, dtype=bool)
+
+        if include:
+            selection &= self.mask(include)
+
+        if exclude:
+            selection &= ~self.mask(exclude)
+
+        return selection
+
+    ###########################################################################
+    @staticmethod
+    def meaning(z_warning: int) -> list:
+        """
+        PARAMETERS
+            z_warning: a single zWarning value
+
+        OUTPUT
+            names: names of the flags set in z_warning, empty if none
+        """
+
+        return [
+            name
+            for name, bit in Z_WARNING_BITS.items()
+            if int(z_warning) & (1 << bit)
+        ]
@@ -0,0 +1,51 @@
+"""Fixtures shared by the tests"""
+import asyncio
+import threading
+
+from aiohttp import web
+import pytest
+
+
+###############################################################################
+@pytest.fixture
+def local_server():
+    """
+    Start aiohttp applications on 127.0.0.1 in a background thread,
+    hence code under test can run its own event loop
+
+    OUTPUT
+        serve: function of a web.Application, returns the url of the
+            server, e.g. http://127.0.0.1:8000
+    """
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    runners = []
+
+    async def start(app: web.Application) -> str:
+
+        runner = web.AppRunner(app)
+        await runner.setup()
+
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+
+        runners.append(runner)
+
+        port = site._server.sockets[0].getsockname()[1]
+
+        return f"http://127.0.0.1:{port}"
+
+    def serve(app: web.Application) -> str:
+        return asyncio.run_coroutine_threadsafe(start(app), loop).result()
+
+    yield serve
+
+    for runner in runners:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
@@ -0,0 +1,117 @@
+"""AsyncDownloader against a local stand-in server"""
+from collections import Counter
+
+from aiohttp import web
+import pytest
+
+from sdss.asyncdownload import AsyncDownloader
+from sdss.scheduler import RetryScheduler
+
+FILES = {"ok.fits": b"spectrum ok", "flaky.fits": b"spectrum flaky"}
+
+
+###############################################################################
+@pytest.fixture
+def server(local_server):
+    """
+    Local stand-in of the science archive server. It serves FILES,
+    flaky.fits answers 503 to its first request and any other file
+    is missing, 404
+
+    OUTPUT
+        base_url, requests: url of the server and number of requests
+            of each file
+    """
+
+    requests = Counter()
+
+    async def get_file(request: web.Request) -> web.Response:
+
+        name = request.match_info["name"]
+        requests[name] += 1
+
+        if name not in FILES:
+            raise web.HTTPNotFound()
+
+        if name == "flaky.fits" and requests[name] == 1:
+            raise web.HTTPServiceUnavailable()
+
+        return web.Response(body=FILES[name])
+
+    app = web.Application()
+    app.router.add_get("/sas/{name}", get_file)
+
+    return local_server(app), requests
+
+
+###############################################################################
+def get_downloader(base_url: str, **kwargs) -> AsyncDownloader:
+    """Downloader without FITS checks and with short backoff delays"""
+
+    return AsyncDownloader(
+        base_url=base_url,
+        concurrency=2,
+        verify_fits=False,
+        scheduler=RetryScheduler(
+            max_attempts=3, base_delay=0.01, max_concurrency=2
+        ),
+        **kwargs,
+    )
+
+
+###############################################################################
+def test_download(server, tmp_path):
+
+    base_url, requests = server
+
+    downloaded = {}
+    missing = []
+
+    downloader = get_downloader(
+        base_url,
+        on_success=lambda key, size, checksum: downloaded.update(
+            {key: size}
+        ),
+        on_failure=missing.append,
+    )
+
+    tasks = [
+        (name, f"sas/{name}", f"{tmp_path}/{name}")
+        for name in ["ok.fits", "flaky.fits", "missing.fits"]
+    ]
+
+    failed = downloader.download(tasks)
+
+    assert failed == [tasks[2]]
+    assert missing == ["missing.fits"]
+    assert downloaded == {name: len(FILES[name]) for name in FILES}
+
+    for name, content in FILES.items():
+        with open(f"{tmp_path}/{name}", "rb") as file:
+            assert file.read() == content
+
+    # a 503 is retried, a 404 is permanent
+    assert requests == {"ok.fits": 1, "flaky.fits": 2, "missing.fits": 1}
+
+
+###############################################################################
+def test_raising_callback(server, tmp_path):
+
+    base_url, requests = server
+
+    def on_success(key: str, size: int, checksum: str) -> None:
+        raise OSError(f"cannot record {key}")
+
+    downloader = get_downloader(base_url, on_success=on_success)
+
+    tasks = [
+        (name, f"sas/{name}", f"{tmp_path}/{name}")
+        for name in ["ok.fits", "flaky.fits"]
+    ]
+
+    # the download finishes and the error of the callback is raised
+    with pytest.raises(OSError, match="cannot record"):
+        downloader.download(tasks)
+
+    for name in FILES:
+        assert (tmp_path / name).is_file()
@@ -0,0 +1,191 @@
+"""NESTED HEALPix pixels of sdss.utils.healpix"""
+import numpy as np
+import pytest
+
+from sdss.utils.healpix import ang2pix, number_pixels, pix2ang
+
+NSIDES = [1, 2, 4, 16, 256, 2048]
+
+
+###############################################################################
+def test_base_pixels():
+
+    # centers of the 12 base pixels: north cap at z = 2/3, equator
+    # and south cap at z = -2/3
+    dec_cap = np.rad2deg(np.arcsin(2 / 3))
+
+    ra = np.tile(90 * np.arange(4), 3) + np.repeat([45, 0, 45], 4)
+    dec = np.repeat([dec_cap, 0.0, -dec_cap], 4)
+
+    np.testing.assert_array_equal(ang2pix(1, ra, dec), np.arange(12))
+
+    center_ra, center_dec = pix2ang(1, np.arange(12))
+
+    np.testing.assert_allclose(center_ra, ra)
+    np.testing.assert_allclose(center_dec, dec, atol=1e-12)
+
+
+###############################################################################
+@pytest.mark.parametrize("nside", NSIDES)
+def test_poles(nside):
+
+    pixels_per_face = nside * nside
+
+    # the north pole is the last pixel of faces 0 to 3 and the south
+    # pole the first pixel of faces 8 to 11
+    ra = np.array([10.0, 100.0, 190.0, 280.0])
+
+    np.testing.assert_array_equal(
+        ang2pix(nside, ra, np.full(4, 90.0)),
+        (np.arange(4) + 1) * pixels_per_face - 1,
+    )
+    np.testing.assert_array_equal(
+        ang2pix(nside, ra, np.full(4, -90.0)),
+        (np.arange(4) + 8) * pixels_per_face,
+    )
+
+    # centers of the pixels at the north pole, first ring
+    center_ra, center_dec = pix2ang(
+        nside, (np.arange(4) + 1) * pixels_per_face - 1
+    )
+
+    np.testing.assert_allclose(center_ra, 45 + 90 * np.arange(4))
+    np.testing.assert_allclose(
+        np.sin(np.deg2rad(center_dec)), 1 - 1 / (3 * nside**2)
+    )
+
+
+###############################################################################
+@pytest.mark.parametrize("nside", NSIDES[:4])
+def test_rings(nside):
+
+    ra, dec = pix2ang(nside, np.arange(number_pixels(nside)))
+
+    z = np.round(np.sin(np.deg2rad(dec)), 12)
+    rings, counts = np.unique(-z, return_counts=True)
+
+    # 4 nside - 1 rings, 4 i pixels in ring i of the polar caps and
+    # 4 nside pixels in the equatorial rings
+    number_rings = 4 * nside - 1
+    ring = np.arange(1, number_rings + 1)
+
+    expected_counts = 4 * np.minimum(
+        np.minimum(ring, number_rings + 1 - ring), nside
+    )
+
+    np.testing.assert_array_equal(counts, expected_counts)
+
+    # caps end at z = 2/3, equatorial rings are equally spaced in z
+    expected_z = np.where(
+        ring < nside,
+        1 - ring**2 / (3 * nside**2),
+        np.where(
+            ring > 3 * nside,
+            (4 * nside - ring) ** 2 / (3 * nside**2) - 1,
+            4 / 3 - 2 * ring / (3 * nside),
+        ),
+    )
+
+    np.testing.assert_allclose(-rings, expected_z, atol=1e-12)
+
+    # pixels of a ring are equally spaced in ra
+    for ring_z, count in zip(-rings, counts):
+
+        ring_ra = np.sort(ra[z == ring_z] % 360)
+
+        np.testing.assert_allclose(np.diff(ring_ra), 360 / count)
+
+
+###############################################################################
+@pytest.mark.parametrize("nside", NSIDES[:4])
+def test_ring_boundaries(nside):
+
+    # points at the edge of the polar caps and of the faces
+    dec_cap = np.rad2deg(np.arcsin(2 / 3))
+    offsets = np.array([-1e-9, 0.0, 1e-9])
+
+    dec = np.concatenate([dec_cap + offsets, -dec_cap + offsets, offsets])
+    ra = np.array([0.0, 45.0, 90.0, 135.0, 180.0, 359.999999, 360.0])
+
+    ra, dec = np.meshgrid(ra, dec)
+    ra, dec = ra.reshape(-1), dec.reshape(-1)
+
+    pixels = ang2pix(nside, ra, dec)
+
+    assert np.all((pixels >= 0) & (pixels < number_pixels(nside)))
+
+    # ra is periodic
+    np.testing.assert_array_equal(
+        ang2pix(nside, ra + 360.0, dec), ang2pix(nside, ra, dec)
+    )
+
+    # each point is close to the center of its pixel
+    center_ra, center_dec = pix2ang(nside, pixels)
+
+    distance = angular_distance(ra, dec, center_ra, center_dec)
+
+    assert np.all(distance < max_pixel_radius(nside))
+
+
+###############################################################################
+@pytest.mark.parametrize("nside", NSIDES[:5])
+def test_round_trip(nside):
+
+    pixels = np.arange(number_pixels(nside))
+
+    np.testing.assert_array_equal(
+        ang2pix(nside, *pix2ang(nside, pixels)), pixels
+    )
+
+
+###############################################################################
+@pytest.mark.parametrize("nside", NSIDES)
+def test_random_positions(nside):
+
+    rng = np.random.default_rng(nside)
+
+    ra = rng.uniform(0, 360, 10_000)
+    dec = np.rad2deg(np.arcsin(rng.uniform(-1, 1, 10_000)))
+
+    pixels = ang2pix(nside, ra, dec)
+
+    # positions are close to the center of their pixel
+    center_ra, center_dec = pix2ang(nside, pixels)
+
+    distance = angular_distance(ra, dec, center_ra, center_dec)
+
+    assert np.all(distance < max_pixel_radius(nside))
+
+    # in the NESTED scheme the parent of a pixel is pixel // 4
+    if nside > 1:
+        np.testing.assert_array_equal(
+            pixels // 4, ang2pix(nside // 2, ra, dec)
+        )
+
+
+###############################################################################
+def angular_distance(
+    ra_1: np.array, dec_1: np.array, ra_2: np.array, dec_2: np.array
+) -> np.array:
+    """Distance in degrees between positions in degrees"""
+
+    ra_1, dec_1, ra_2, dec_2 = map(np.deg2rad, (ra_1, dec_1, ra_2, dec_2))
+
+    cos_distance = np.sin(dec_1) * np.sin(dec_2) + np.cos(dec_1) * np.cos(
+        dec_2
+    ) * np.cos(ra_1 - ra_2)
+
+    return np.rad2deg(np.arccos(np.clip(cos_distance, -1, 1)))
+
+
+###############################################################################
+def max_pixel_radius(nside: int) -> float:
+    """
+    Upper bound in degrees of the distance from the center of a pixel
+    to its corners, pixels are at most about 1.4 times the side of a
+    square with the same area
+    """
+
+    side = np.rad2deg(np.sqrt(4 * np.pi / number_pixels(nside)))
+
+    return 1.5 * side
@@ -0,0 +1,44 @@
+"""Configuration of the interpolation script, process/interpolate.py"""
+from configparser import ConfigParser, ExtendedInterpolation
+import importlib.util
+import os
+
+import pytest
+
+from sdss.process.extinction import DUST_LAWS, extinction_table
+
+SCRIPT_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "process"
+)
+
+
+###############################################################################
+@pytest.fixture(scope="module")
+def script():
+    """process/interpolate.py as a module, its main block does not run"""
+
+    spec = importlib.util.spec_from_file_location(
+        "interpolate_script", f"{SCRIPT_DIRECTORY}/interpolate.py"
+    )
+
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+###############################################################################
+@pytest.mark.parametrize("dust_law", sorted(DUST_LAWS))
+def test_dust_law_from_config(script, dust_law):
+
+    parser = ConfigParser(interpolation=ExtendedInterpolation())
+    parser.read(f"{SCRIPT_DIRECTORY}/interpolate.ini")
+
+    parser.set("extinction", "dust_law", dust_law)
+
+    dust_parameters = script.get_dust_parameters(parser)
+
+    assert dust_parameters == {"dust_law": dust_law, "r_v": 3.1}
+
+    # Interpolate builds its table from these parameters
+    extinction_table(dust_law, dust_parameters["r_v"])
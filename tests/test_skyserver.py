@@ -0,0 +1,75 @@
+"""SkyServerFetcher against a local stand-in server"""
+from aiohttp import web
+import pytest
+
+from sdss.skyserver import SkyServerFetcher
+
+PLOTS = {1001: b"plot 1001", 1002: b"plot 1002", 1003: b"plot 1003"}
+MISSING = 2001
+
+
+###############################################################################
+@pytest.fixture
+def server(local_server):
+    """
+    Local stand-in of SkyServer, serves the plots in PLOTS and 404
+    for other ids
+
+    OUTPUT
+        base_url, requests: url of the server and list of the ids
+            requested so far
+    """
+
+    requests = []
+
+    async def spectrum_plot(request: web.Request) -> web.Response:
+
+        specobjid = int(request.query["id"])
+        requests.append(specobjid)
+
+        if specobjid not in PLOTS:
+            raise web.HTTPNotFound()
+
+        return web.Response(body=PLOTS[specobjid])
+
+    app = web.Application()
+    app.router.add_get("/en/get/SpecById.ashx", spectrum_plot)
+
+    return local_server(app), requests
+
+
+###############################################################################
+def test_spectrum_plots_are_cached(server, tmp_path):
+
+    base_url, requests = server
+
+    fetcher = SkyServerFetcher(str(tmp_path), base_url=base_url)
+
+    failed = fetcher.spectrum_plots(list(PLOTS))
+
+    assert failed == []
+    assert sorted(requests) == sorted(PLOTS)
+
+    for specobjid, plot in PLOTS.items():
+        with open(fetcher.spectrum_location(specobjid), "rb") as file:
+            assert file.read() == plot
+
+    # second call is served from the cache
+    requests.clear()
+
+    assert fetcher.spectrum_plots(list(PLOTS)) == []
+    assert requests == []
+
+
+###############################################################################
+def test_missing_plot_is_failed(server, tmp_path):
+
+    base_url, requests = server
+
+    fetcher = SkyServerFetcher(str(tmp_path), base_url=base_url)
+
+    failed = fetcher.spectrum_plots([1001, MISSING])
+
+    assert failed == [MISSING]
+    # a 404 is permanent, hence it is not retried
+    assert requests.count(MISSING) == 1